@@ -4,7 +4,9 @@ from django.contrib import admin
 
 from allianceauth.services.admin import ServicesUserAdmin
 
-from .models import DiscordManagedServer, MultiDiscordUser, ServerActiveFilter
+from .models import (
+    BulkSyncJob, DiscordManagedServer, MultiDiscordUser, ServerActiveFilter,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -44,7 +46,7 @@ class MultiDiscordUserAdmin(ServicesUserAdmin):
 
 @admin.register(DiscordManagedServer)
 class DiscordMultiverseServer(admin.ModelAdmin):
-    list_display = ['server_name', 'guild_id', 'sync_names']
+    list_display = ['server_name', 'guild_id', 'sync_names', 'bot_name']
     filter_horizontal = [
         "included_groups",
         "faction_access",
@@ -54,3 +56,28 @@ class DiscordMultiverseServer(admin.ModelAdmin):
         "group_access",
         "state_access",
         ]
+
+
+@admin.register(BulkSyncJob)
+class BulkSyncJobAdmin(admin.ModelAdmin):
+    list_display = [
+        'guild', 'name', 'status', '_progress', 'done', 'skipped', 'failed', 'total',
+        '_throughput', 'created', 'updated'
+    ]
+    list_filter = ['status', 'name', 'guild']
+    list_select_related = ['guild']
+    readonly_fields = [
+        'guild', 'name', 'methods', 'status', 'total', 'done', 'skipped', 'failed',
+        'cursor', 'created', 'updated', 'finished'
+    ]
+
+    @admin.display(description='Progress')
+    def _progress(self, obj):
+        return f'{obj.progress:.1f}%'
+
+    @admin.display(description='Items / minute')
+    def _throughput(self, obj):
+        return f'{obj.throughput:.1f}'
+
+    def has_add_permission(self, request):
+        return False
@@ -12,3 +12,56 @@ DISCORD_TASKS_RETRY_PAUSE = clean_setting('DISCORD_TASKS_RETRY_PAUSE', 60)
 
 # DMV Specific Settings otherwise use discord core settings
 DISCORD_CALLBACK_URL = clean_setting('DMV_CALLBACK_URL', '')
+
+# Window in seconds in which repeated group and nickname syncs for the same
+# user on the same guild are collapsed into a single task.
+# The task will use the latest state from the DB. Set to 0 to disable.
+DMV_SYNC_DEBOUNCE_SECONDS = clean_setting('DMV_SYNC_DEBOUNCE_SECONDS', 5)
+
+# When enabled group and nickname syncs of a user are done for all
+# guilds at once with a single task, instead of one task per guild.
+DMV_SYNC_USER_ALL_GUILDS = clean_setting('DMV_SYNC_USER_ALL_GUILDS', False)
+
+# When enabled the OAuth callback only exchanges the code for a token and
+# the user is added to the server by a task, so no web worker waits for Discord.
+DMV_ASYNC_ACTIVATION = clean_setting('DMV_ASYNC_ACTIVATION', False)
+
+# Max number of users handled per round of the bulk dispatcher.
+# Each round is split evenly across all guilds with pending bulk work.
+DMV_BULK_BATCH_SIZE = clean_setting('DMV_BULK_BATCH_SIZE', 50, min_value=1)
+
+# Seconds after which a stuck bulk dispatcher is considered dead
+# and will be restarted with the next bulk work queued.
+DMV_BULK_DISPATCHER_LEASE = clean_setting('DMV_BULK_DISPATCHER_LEASE', 600, min_value=60)
+
+# Seconds without progress after which a running bulk sync job is considered
+# interrupted and is resumed from its last checkpoint by resume_bulk_jobs.
+DMV_BULK_JOB_STALE_SECONDS = clean_setting('DMV_BULK_JOB_STALE_SECONDS', 3600, min_value=300)
+
+# When enabled a user joining or leaving a synced group only adds or removes
+# that one role on Discord, instead of running a full group sync.
+DMV_DELTA_ROLE_UPDATES = clean_setting('DMV_DELTA_ROLE_UPDATES', False)
+
+# Max seconds a process waits before it picks up servers added, changed or
+# deleted by another process. Checking costs one Redis GET per request or task.
+DMV_HOOKS_REFRESH_INTERVAL = clean_setting('DMV_HOOKS_REFRESH_INTERVAL', 30)
+
+# Dedicated bots that managed servers can be assigned to, by name:
+# {"name": {"token": "...", "app_id": "...", "app_secret": "..."}}
+# Every bot has its own rate limits. Servers without a bot use DISCORD_BOT_TOKEN.
+DMV_BOTS = clean_setting('DMV_BOTS', {})
+
+# Token a Prometheus server can send as bearer token to scrape the metrics
+# endpoint. Without a token the endpoint is only available to superusers.
+DMV_METRICS_TOKEN = clean_setting('DMV_METRICS_TOKEN', '')
+
+# Fraction of user sync task runs, e.g. 0.01, for which the time spent in DB
+# queries, Redis, HTTP requests, sleeps and on the CPU is logged and added to
+# the metrics. 0 disables profiling.
+DMV_TASK_PROFILING_SAMPLE_RATE = clean_setting(
+    'DMV_TASK_PROFILING_SAMPLE_RATE',
+    0.0,
+    min_value=0.0,
+    max_value=1.0,
+    required_type=(int, float)
+)
@@ -14,9 +14,9 @@ class DiscordMultiVerseServiceConfig(AppConfig):
 
     def ready(self):
         # run on startup to sync services!
-        from .auth_hooks import add_del_callback  # NOPEP8
+        from .auth_hooks import refresh_guild_hooks  # NOPEP8
         try:
-            add_del_callback()
+            refresh_guild_hooks()
         except Exception as e:
             logger.error("DMV: Failed to Init DMV Server Hook")
             logger.error(e, stack_info=True)
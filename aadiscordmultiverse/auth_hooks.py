@@ -1,8 +1,14 @@
 import logging
+import threading
+from time import monotonic
 
+from celery.signals import task_prerun
+from django_redis import get_redis_connection
 from pytz import AmbiguousTimeError
 
 from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db import transaction
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.template import TemplateDoesNotExist
@@ -15,21 +21,48 @@ from aadiscordmultiverse.discord_client.client import DiscordClient
 from aadiscordmultiverse.discord_client.exceptions import DiscordApiBackoff
 
 from . import tasks, urls
+from .app_settings import (
+    DMV_ASYNC_ACTIVATION, DMV_DELTA_ROLE_UPDATES, DMV_HOOKS_REFRESH_INTERVAL,
+    DMV_SYNC_DEBOUNCE_SECONDS, DMV_SYNC_USER_ALL_GUILDS,
+)
 from .models import DiscordManagedServer, MultiDiscordUser, ServerActiveFilter
+from .tasks import SINGLE_TASK_PRIORITY
 from .utils import LoggerAddTag
 
 logger = logging.getLogger(__name__)
 
-# Default priority for single tasks like update group and sync nickname
-SINGLE_TASK_PRIORITY = 3
+# registered hook classes by guild_id
+_guild_hooks = dict()
+_guild_hooks_lock = threading.Lock()
+# bumped by every change of a guild, so all processes can refresh their hooks
+_KEY_HOOKS_GENERATION = 'dmv:hooks:generation'
+# generation the hooks of this process are at and when it was last checked
+_hooks_generation = None
+_hooks_checked_at = None
+_service_ctrl_template = None
+
+
+def service_ctrl_template() -> str:
+    """returns the template of the service control matching the Auth version,
+    resolved once per process
+    """
+    global _service_ctrl_template
+    if _service_ctrl_template is None:
+        try:
+            get_template("services/services_ctrl_base.html")
+            _service_ctrl_template = 'aadiscordmultiverse/dmv_service_ctrl_bs5.html'
+        except TemplateDoesNotExist:
+            _service_ctrl_template = 'aadiscordmultiverse/dmv_service_ctrl.html'
+    return _service_ctrl_template
 
 
 class MultiDiscordService(ServicesHook):
     """Service for managing many Discord servers with a Single Auth"""
-    def __init_subclass__(cls, gid, guild_name=None):
+    def __init_subclass__(cls, gid, guild_name=None, bot_name=''):
         super().__init_subclass__()
         cls.guild_id = gid
         cls.guild_name = guild_name
+        cls.bot_name = bot_name
 
     def __init__(self):
         ServicesHook.__init__(self)
@@ -38,16 +71,19 @@ class MultiDiscordService(ServicesHook):
         else:
             self.name = f'dmv'
 
-        template = 'aadiscordmultiverse/dmv_service_ctrl.html'
-        try:
-            get_template("services/services_ctrl_base.html")
-            template = 'aadiscordmultiverse/dmv_service_ctrl_bs5.html'
-        except TemplateDoesNotExist:
-            pass
-        self.service_ctrl_template = template
+        self.service_ctrl_template = service_ctrl_template()
         self.access_perm = 'aadiscordmultiverse.access_discord_multiverse'
         self.name_format = '{character_name}'
-        self.client = MultiDiscordUser.objects._bot_client()
+        self._client = None
+
+    @property
+    def client(self) -> DiscordClient:
+        """bot client of this guild, created on first use"""
+        if self._client is None:
+            self._client = MultiDiscordUser.objects._bot_client(
+                bot_name=getattr(self, 'bot_name', '')
+            )
+        return self._client
 
     def delete_user(self, user: User, notify_user: bool = False) -> None:
         if self.user_has_account(user):
@@ -61,15 +97,21 @@ class MultiDiscordService(ServicesHook):
     def render_services_ctrl(self, request):
         if DiscordManagedServer.user_can_access_guild(request.user, self.guild_id):
             timeout = False
-            if self.user_has_account(request.user):
+            server_user = MultiDiscordUser.objects.filter(
+                user=request.user, guild_id=self.guild_id
+            ).only("username").first()
+            if server_user:
                 user_has_account = True
-                server_user = MultiDiscordUser.objects.get(
-                    user=request.user, guild_id=self.guild_id)
                 username = server_user.username
                 discord_username = f'@{username}'
             else:
                 discord_username = ''
                 user_has_account = False
+            activation_pending = (
+                DMV_ASYNC_ACTIVATION
+                and not user_has_account
+                and MultiDiscordUser.objects.activation_pending(request.user, self.guild_id)
+            )
 
             try:
                 self.client._handle_ongoing_api_backoff("DMV_HOOK")
@@ -79,10 +121,13 @@ class MultiDiscordService(ServicesHook):
             return render_to_string(
                 self.service_ctrl_template,
                 {
-                    'server_name': MultiDiscordUser.objects.server_name(self.guild_id),
+                    'server_name': MultiDiscordUser.objects.server_name(
+                        self.guild_id, bot_name=self.bot_name
+                    ),
                     "guild_id": self.guild_id,
                     'user_has_account': user_has_account,
                     'discord_username': discord_username,
+                    'activation_pending': activation_pending,
                     'timeout': timeout
                 },
                 request=request
@@ -101,6 +146,18 @@ class MultiDiscordService(ServicesHook):
         logger.debug(f"Syncing {user} nicknames on  {self.guild_id}")
 
         if self.user_has_account(user):
+            if DMV_SYNC_USER_ALL_GUILDS:
+                self._sync_user_all_guilds(user)
+                return
+            if DMV_SYNC_DEBOUNCE_SECONDS:
+                # the nickname is formatted when the task runs after the window
+                tasks.debounce_user_task(
+                    tasks.update_nickname,
+                    self.guild_id,
+                    user.pk,
+                    priority=SINGLE_TASK_PRIORITY
+                )
+                return
             guild = DiscordManagedServer.objects.get(guild_id=self.guild_id)
             tasks.update_nickname.apply_async(
                 kwargs={
@@ -130,6 +187,23 @@ class MultiDiscordService(ServicesHook):
     def update_groups(self, user):
         logger.debug('Processing %s groups for %s', self.name, user)
         if self.user_has_account(user):
+            if DMV_DELTA_ROLE_UPDATES and tasks.is_delta_synced(
+                self.guild_id, user.pk, user.profile.state.name
+            ):
+                logger.debug('Group changes of %s are applied as role deltas', user)
+                return
+            if DMV_SYNC_USER_ALL_GUILDS:
+                self._sync_user_all_guilds(user)
+                return
+            if DMV_SYNC_DEBOUNCE_SECONDS:
+                # state changes are committed by the time the window has passed
+                tasks.debounce_user_task(
+                    tasks.update_groups,
+                    self.guild_id,
+                    user.pk,
+                    priority=SINGLE_TASK_PRIORITY
+                )
+                return
             tasks.update_groups.apply_async(
                 kwargs={
                     'guild_id': self.guild_id,
@@ -151,6 +225,27 @@ class MultiDiscordService(ServicesHook):
         user_pks = [user.pk for user in users]
         tasks.update_groups_bulk.delay(user_pks, guild_id=self.guild_id)
 
+    def _sync_user_all_guilds(self, user: User) -> None:
+        """Hand the sync over to the cross guild task.
+        The calls from every guild hook of this user resolve to the same task.
+        """
+        logger.debug('Syncing %s on all guilds', user)
+        if DMV_SYNC_DEBOUNCE_SECONDS:
+            tasks.debounce_user_task(
+                tasks.sync_user_all_guilds,
+                None,
+                user.pk,
+                priority=SINGLE_TASK_PRIORITY
+            )
+        else:
+            tasks.sync_user_all_guilds.apply_async(
+                kwargs={
+                    'user_pk': user.pk,
+                    'state_name': user.profile.state.name
+                },
+                priority=SINGLE_TASK_PRIORITY
+            )
+
     def user_has_account(self, user: User) -> bool:
         result = MultiDiscordUser.objects.user_has_account(
             user, guild_id=self.guild_id)
@@ -168,50 +263,105 @@ class MultiDiscordService(ServicesHook):
 
 def add_del_callback(*args, **kwargs):
     """
-        This works great at startup of auth, however has a bug where changes
-        made during operation are only captured on a single thread.
-        TLDR restart auth after adding a new server
+        Registers a hook for every guild, removes the hooks of deleted guilds
+        and updates the names and bots of the others.
+
+        Only updates the hooks of this process,
+        the others follow with refresh_guild_hooks()
     """
-    # Get a list of all guild ID's to check in our hook list
-    guild_add = list(DiscordManagedServer.objects.all(
-    ).values_list("guild_id", flat=True))
-    # Spit out the ID's for troubleshooting
-    logger.info(f"Processing Guilds {guild_add}")
-
-    # Loop all services and look for our specific hook classes
-    for h in hooks._hooks.get("services_hook", []):
-        if isinstance(h(), MultiDiscordService):
-            # This is our hook
-            # h is an instanced MultiDiscordService hook with a guild_id
-            if h.guild_id in guild_add:
-                # this is a known discord ID so remove it from our list of knowns
-                guild_add.remove(h.guild_id)
-            else:
-                # This one was deleted remove the hook.
-                del (h)
-
-    # Loop to setup what is mising ( or everyhting on first boot )
-    for gid in guild_add:
-        # What guild_id
-        logger.info(f"Adding GUILD ID {gid}")
-        guild = DiscordManagedServer.objects.get(guild_id=gid)
-        # This is the magic to instance the hook class with a new Class Name
-        # this way there are no conflicts at runtime
-        guild_class = type(
-            f"MultiDiscordService{gid}", # New class name
-            (MultiDiscordService,), {}, # Super class
-            gid=guild.guild_id, # set the guild_id
-            guild_name=guild.server_name # and server name
+    guilds = {
+        guild_id: (server_name, bot_name)
+        for guild_id, server_name, bot_name in DiscordManagedServer.objects.values_list(
+            "guild_id", "server_name", "bot_name"
         )
-        # This adds the hook to the services_hook group to be loaded when needed.
-        hooks.register("services_hook", guild_class)
+    }
+    # Spit out the ID's for troubleshooting
+    logger.info(f"Processing Guilds {list(guilds)}")
+
+    with _guild_hooks_lock:
+        services_hooks = hooks._hooks.setdefault("services_hook", [])
+        for gid in [gid for gid in _guild_hooks if gid not in guilds]:
+            # This one was deleted remove the hook.
+            logger.info(f"Removing GUILD ID {gid}")
+            guild_class = _guild_hooks.pop(gid)
+            if guild_class in services_hooks:
+                services_hooks.remove(guild_class)
+
+        for gid, (server_name, bot_name) in guilds.items():
+            guild_class = _guild_hooks.get(gid)
+            if guild_class:
+                # known guild, which may have been renamed or moved to another bot
+                guild_class.guild_name = server_name
+                guild_class.bot_name = bot_name
+                continue
+            logger.info(f"Adding GUILD ID {gid}")
+            # This is the magic to instance the hook class with a new Class Name
+            # this way there are no conflicts at runtime
+            guild_class = type(
+                f"MultiDiscordService{gid}",  # New class name
+                (MultiDiscordService,), {},  # Super class
+                gid=gid,  # set the guild_id
+                guild_name=server_name,  # and server name
+                bot_name=bot_name  # and the bot managing it
+            )
+            # This adds the hook to the services_hook group to be loaded when needed.
+            hooks.register("services_hook", guild_class)
+            _guild_hooks[gid] = guild_class
+
+
+def refresh_guild_hooks(*args, **kwargs):
+    """Update the hooks when a guild was changed by any process.
+    Redis is asked at most every DMV_HOOKS_REFRESH_INTERVAL seconds.
+    """
+    global _hooks_checked_at, _hooks_generation
+    now = monotonic()
+    if (
+        _hooks_checked_at is not None
+        and now - _hooks_checked_at < DMV_HOOKS_REFRESH_INTERVAL
+    ):
+        return
+    _hooks_checked_at = now
+    try:
+        generation = int(get_redis_connection("default").get(_KEY_HOOKS_GENERATION) or 0)
+    except Exception:
+        # without Redis we can not tell, so we better look
+        logger.warning('Failed to check for changed guilds', exc_info=True)
+        generation = None
+    if generation is None or generation != _hooks_generation:
+        # the generation is read before the guilds,
+        # so changes made in between are picked up with the next check
+        add_del_callback()
+        _hooks_generation = generation
+
+
+def bump_hooks_generation() -> None:
+    """Tell all processes to refresh their hooks"""
+    try:
+        get_redis_connection("default").incr(_KEY_HOOKS_GENERATION)
+    except Exception:
+        logger.warning('Failed to announce changed guilds', exc_info=True)
+
+
+def guild_changed(*args, **kwargs):
+    add_del_callback()
+    # the other processes must not look before the change is committed
+    transaction.on_commit(bump_hooks_generation)
+
 
-post_save.connect(add_del_callback, sender=DiscordManagedServer)
-post_delete.connect(add_del_callback, sender=DiscordManagedServer)
+post_save.connect(guild_changed, sender=DiscordManagedServer)
+post_delete.connect(guild_changed, sender=DiscordManagedServer)
+request_started.connect(refresh_guild_hooks)
+task_prerun.connect(refresh_guild_hooks)
 
 @hooks.register("url_hook")
 def register_urls():
-    return UrlHook(urls, "dmv", r"^dmv/")
+    # the metrics are scraped without a login
+    return UrlHook(
+        urls,
+        "dmv",
+        r"^dmv/",
+        excluded_views=["aadiscordmultiverse.views.prometheus_metrics"]
+    )
 
 @hooks.register("secure_group_filters")
 def filters():
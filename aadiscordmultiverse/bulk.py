@@ -0,0 +1,140 @@
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+from django_redis import get_redis_connection
+from redis import Redis
+
+logger = logging.getLogger(__name__)
+
+
+class BulkWorkQueue:
+    """Per guild queues of bulk work, that are handed out round robin.
+
+    Every guild has its own FIFO list of work items in Redis and a rotation list
+    holds all guilds with pending work. Batches are taken evenly from the
+    guilds at the front of the rotation, which then move to the back,
+    so every guild makes steady progress no matter how large the others are.
+
+    Work items are tuples of (method, user_pk, job_pk),
+    where method is a method of MultiDiscordUser
+    and job_pk the BulkSyncJob tracking it or 0.
+    """
+    _KEY_GUILDS = 'dmv:bulk:guilds'
+    _KEYPREFIX_QUEUE = 'dmv:bulk:queue:'
+
+    # max items pushed to Redis in one call
+    _PUSH_CHUNK_SIZE = 1000
+
+    def __init__(self, redis: Redis = None) -> None:
+        self._redis = redis if redis else get_redis_connection("default")
+
+        lua_add_guild = """
+            local guilds = redis.call("lrange", KEYS[1], 0, -1)
+            for _, gid in ipairs(guilds) do
+                if gid == ARGV[1] then
+                    return 0
+                end
+            end
+            return redis.call("rpush", KEYS[1], ARGV[1])
+        """
+        self.__redis_script_add_guild = self._redis.register_script(lua_add_guild)
+
+        lua_pop = """
+            local guilds = redis.call("lrange", KEYS[1], 0, tonumber(ARGV[1]) - 1)
+            if #guilds == 0 then
+                return {}
+            end
+            local per_guild = math.max(1, math.floor(tonumber(ARGV[1]) / #guilds))
+            local result = {}
+            for _, gid in ipairs(guilds) do
+                local queue = ARGV[2] .. gid
+                local items = redis.call("lrange", queue, 0, per_guild - 1)
+                redis.call("ltrim", queue, per_guild, -1)
+                redis.call("lrem", KEYS[1], 1, gid)
+                if redis.call("llen", queue) > 0 then
+                    redis.call("rpush", KEYS[1], gid)
+                end
+                for _, item in ipairs(items) do
+                    table.insert(result, gid .. ":" .. item)
+                end
+            end
+            return result
+        """
+        self.__redis_script_pop = self._redis.register_script(lua_pop)
+
+        lua_remove_job = """
+            local items = redis.call("lrange", KEYS[1], 0, -1)
+            local suffix_len = string.len(ARGV[1])
+            local removed = 0
+            redis.call("del", KEYS[1])
+            for _, item in ipairs(items) do
+                if string.sub(item, -suffix_len) == ARGV[1] then
+                    removed = removed + 1
+                else
+                    redis.call("rpush", KEYS[1], item)
+                end
+            end
+            return removed
+        """
+        self.__redis_script_remove_job = self._redis.register_script(lua_remove_job)
+
+    @classmethod
+    def _queue_key(cls, guild_id: int) -> str:
+        return f'{cls._KEYPREFIX_QUEUE}{guild_id}'
+
+    def push(self, guild_id: int, items: Iterable[Tuple[str, int]], job_pk: int = 0) -> int:
+        """Add work items to the end of the queue of a guild
+
+        Params:
+        - items: list of (method, user_pk)
+        - job_pk: BulkSyncJob the items are tracked by
+
+        Returns the number of items added
+        """
+        items = [f'{method}:{user_pk}:{job_pk}' for method, user_pk in items]
+        if not items:
+            return 0
+        key = self._queue_key(guild_id)
+        pipe = self._redis.pipeline()
+        for start in range(0, len(items), self._PUSH_CHUNK_SIZE):
+            pipe.rpush(key, *items[start:start + self._PUSH_CHUNK_SIZE])
+        pipe.execute()
+        self.__redis_script_add_guild(keys=[self._KEY_GUILDS], args=[str(guild_id)])
+        logger.debug('Queued %d bulk items for guild %s', len(items), guild_id)
+        return len(items)
+
+    def pop_round_robin(self, size: int) -> Dict[int, List[Tuple[str, int, int]]]:
+        """Take the next batch of up to `size` work items evenly from the guilds
+        at the front of the rotation
+
+        Returns work items by guild_id
+        """
+        batch = dict()
+        for raw in self.__redis_script_pop(
+            keys=[self._KEY_GUILDS], args=[int(size), self._KEYPREFIX_QUEUE]
+        ):
+            guild_id, method, user_pk, job_pk = self._redis_decode(raw).split(':')
+            batch.setdefault(int(guild_id), list()).append(
+                (method, int(user_pk), int(job_pk))
+            )
+        return batch
+
+    def remove_job(self, guild_id: int, job_pk: int) -> int:
+        """Remove all queued work items of a job
+
+        Returns the number of items removed
+        """
+        return self.__redis_script_remove_job(
+            keys=[self._queue_key(guild_id)], args=[f':{job_pk}']
+        )
+
+    def pending(self, guild_id: int) -> int:
+        """Number of work items waiting for a guild"""
+        return self._redis.llen(self._queue_key(guild_id))
+
+    def has_work(self) -> bool:
+        return self._redis.llen(self._KEY_GUILDS) > 0
+
+    @staticmethod
+    def _redis_decode(value) -> str:
+        return value.decode('utf-8') if isinstance(value, bytes) else value
@@ -0,0 +1,148 @@
+"""State of the rate limits and the sync backlog for the dashboard"""
+
+import logging
+from typing import Iterable
+
+from django_redis import get_redis_connection
+from redis import Redis
+
+from django.core.cache import cache
+
+from .app_settings import DMV_BOTS
+from .bulk import BulkWorkQueue
+from .discord_client import DiscordClient
+from .discord_client.metrics import metrics
+from .models import BulkSyncJob, DiscordManagedServer
+
+logger = logging.getLogger(__name__)
+
+_BUCKET_KEY_PREFIX = 'dmv:bucket:'
+# finished jobs shown per guild
+RECENT_JOBS = 3
+
+# keys asked for per SCAN call while looking up the rate limit buckets
+_SCAN_COUNT = 1000
+
+
+def redis_state(guild_ids: Iterable[int], redis: Redis = None) -> dict:
+    """Reads the rate limit buckets, backoffs and bulk queues
+
+    The bucket keys are looked up with SCAN, their values and all other keys
+    are then read in one pipeline.
+
+    Returns a dict with:
+    - buckets: list of dicts with key, remaining and resets_in seconds
+    - backoffs: list of dicts with bot, global_backoff seconds left
+    - circuit_open: seconds left till the circuit breaker closes
+    - pending: number of queued bulk items by guild_id
+    """
+    redis = redis if redis else get_redis_connection("default")
+    guild_ids = list(guild_ids)
+    namespaces = [''] + sorted(DMV_BOTS)
+    ttl_keys = [
+        DiscordClient._rate_limit_key_for(DiscordClient._KEY_GLOBAL_BACKOFF_UNTIL, namespace)
+        for namespace in namespaces
+    ] + [DiscordClient._KEY_CIRCUIT_OPEN]
+    queue_keys = [BulkWorkQueue._queue_key(guild_id) for guild_id in guild_ids]
+    raw_prefix = cache.client.make_key(_BUCKET_KEY_PREFIX)
+    # SCAN runs in small steps, so the other clients of Redis are not blocked
+    bucket_keys = sorted({
+        key.decode() if isinstance(key, bytes) else key
+        for key in redis.scan_iter(match=f'{raw_prefix}*', count=_SCAN_COUNT)
+    })
+    pipe = redis.pipeline(transaction=False)
+    for key in bucket_keys:
+        pipe.get(key)
+        pipe.pttl(key)
+    for key in ttl_keys:
+        pipe.pttl(key)
+    for key in queue_keys:
+        pipe.llen(key)
+    results = pipe.execute()
+    bucket_values = results[:2 * len(bucket_keys)]
+    ttls = results[len(bucket_values):len(bucket_values) + len(ttl_keys)]
+    lengths = results[len(bucket_values) + len(ttl_keys):]
+
+    buckets = list()
+    for key, value, ttl in zip(bucket_keys, bucket_values[::2], bucket_values[1::2]):
+        # the bucket expired after the scan
+        if value is None:
+            continue
+        buckets.append({
+            'key': key[len(raw_prefix):],
+            'remaining': cache.client.decode(value),
+            'resets_in': _seconds_left(ttl),
+        })
+    backoffs = [
+        {'bot': namespace, 'global_backoff': _seconds_left(ttl)}
+        for namespace, ttl in zip(namespaces, ttls)
+    ]
+    return {
+        'buckets': buckets,
+        'backoffs': backoffs,
+        'circuit_open': _seconds_left(ttls[-1]),
+        'pending': dict(zip(guild_ids, lengths)),
+    }
+
+
+def _seconds_left(pttl: int) -> float:
+    """Seconds left of a Redis PTTL, which is negative for missing keys"""
+    return max(0, pttl) / 1000
+
+
+def metrics_state() -> dict:
+    """Counters of 429s and task results from the metrics
+
+    Returns a dict with:
+    - rate_limited: list of dicts with route, scope and count, most frequent first
+    - results: counts of task results by guild_id and result
+    """
+    rate_limited = list()
+    results = dict()
+    for sample, value in metrics.samples().items():
+        name, labels = metrics.parse_sample_name(sample)
+        if name == 'dmv_discord_api_rate_limited_total':
+            rate_limited.append({
+                'route': labels.get('route', ''),
+                'scope': labels.get('scope', ''),
+                'count': int(value),
+            })
+        elif name == 'dmv_task_results_total' and labels.get('guild_id', '').isdigit():
+            guild_results = results.setdefault(int(labels['guild_id']), dict())
+            result = labels.get('result', '')
+            guild_results[result] = guild_results.get(result, 0) + int(value)
+    rate_limited.sort(key=lambda row: (-row['count'], row['route']))
+    return {'rate_limited': rate_limited, 'results': results}
+
+
+def dashboard_context() -> dict:
+    """Everything shown on the dashboard"""
+    guilds = list(DiscordManagedServer.objects.order_by('server_name', 'guild_id'))
+    state = redis_state(guild.guild_id for guild in guilds)
+    counters = metrics_state()
+    jobs_by_guild = dict()
+    for job in BulkSyncJob.objects.filter(status=BulkSyncJob.Status.RUNNING):
+        jobs_by_guild.setdefault(job.guild_id, list()).append(job)
+    # a small query per guild, filtering on window functions needs Django 4.2
+    for guild in guilds:
+        jobs_by_guild.setdefault(guild.guild_id, list()).extend(
+            BulkSyncJob.objects.filter(
+                guild_id=guild.guild_id, status=BulkSyncJob.Status.FINISHED
+            ).order_by('-created', '-pk')[:RECENT_JOBS]
+        )
+    return {
+        'guilds': [
+            {
+                'guild': guild,
+                'pending': state['pending'][guild.guild_id],
+                'jobs': jobs_by_guild.get(guild.guild_id, []),
+                'results': counters['results'].get(guild.guild_id, {}),
+            }
+            for guild in guilds
+        ],
+        'buckets': state['buckets'],
+        'backoffs': state['backoffs'],
+        'circuit_open': state['circuit_open'],
+        'rate_limited': counters['rate_limited'],
+        'metrics_enabled': metrics.is_enabled,
+    }
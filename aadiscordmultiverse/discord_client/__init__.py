@@ -1,5 +1,5 @@
 # AllianceAuth Discord Service Copy Pasted
 
 from .client import DiscordClient  # noqa
-from .exceptions import DiscordApiBackoff  # noqa
+from .exceptions import DiscordApiBackoff, DiscordCircuitOpen  # noqa
 from .helpers import DiscordRoles  # noqa
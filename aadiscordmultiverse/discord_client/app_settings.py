@@ -5,14 +5,58 @@ DISCORD_API_BASE_URL = clean_setting(
     'DISCORD_API_BASE_URL', 'https://discord.com/api/v10'
 )
 
-# Low level connecttimeout for requests to the Discord API in seconds
+# Low level connect timeout for requests to the Discord API in seconds.
+# Falls back to DISCORD_API_TIMEOUT, which used to set both timeouts.
 DISCORD_API_TIMEOUT_CONNECT = clean_setting(
-    'DISCORD_API_TIMEOUT', 5
+    'DMV_API_TIMEOUT_CONNECT',
+    clean_setting('DISCORD_API_TIMEOUT', 5, required_type=(int, float)),
+    min_value=0.1,
+    required_type=(int, float)
 )
 
-# Low level read timeout for requests to the Discord API in seconds
+# Low level read timeout for requests to the Discord API in seconds.
+# Falls back to DISCORD_API_TIMEOUT, which used to set both timeouts.
 DISCORD_API_TIMEOUT_READ = clean_setting(
-    'DISCORD_API_TIMEOUT', 30
+    'DMV_API_TIMEOUT_READ',
+    clean_setting('DISCORD_API_TIMEOUT', 30, required_type=(int, float)),
+    min_value=0.1,
+    required_type=(int, float)
+)
+
+# Timeouts in seconds for single routes, given by their rate limit bucket,
+# e.g. {"GET guilds/{guild_id}/members": 60}.
+# Values are either the read timeout or a tuple of connect and read timeout.
+# Merged into the defaults of the client.
+DMV_API_ROUTE_TIMEOUTS = clean_setting('DMV_API_ROUTE_TIMEOUTS', {})
+
+# Max number of times an idempotent request is retried by the client
+# after a connection error, timeout or 5xx response. Set to 0 to disable.
+DMV_API_RETRY_MAX = clean_setting('DMV_API_RETRY_MAX', 2, min_value=0)
+
+# Base delay in seconds for the jittered exponential backoff between retries
+DMV_API_RETRY_BASE_DELAY = clean_setting(
+    'DMV_API_RETRY_BASE_DELAY', 0.25, min_value=0.0, required_type=(int, float)
+)
+
+# Max delay in seconds between two retries
+DMV_API_RETRY_MAX_DELAY = clean_setting(
+    'DMV_API_RETRY_MAX_DELAY', 2.0, min_value=0.0, required_type=(int, float)
+)
+
+# Max total seconds a single request may spend waiting for retries
+DMV_API_RETRY_BUDGET = clean_setting(
+    'DMV_API_RETRY_BUDGET', 5.0, min_value=0.0, required_type=(int, float)
+)
+
+# Number of consecutive connection errors, timeouts or 5xx responses
+# across all workers after which requests to Discord fail fast.
+# Set to 0 to disable the circuit breaker.
+DMV_CIRCUIT_BREAKER_THRESHOLD = clean_setting('DMV_CIRCUIT_BREAKER_THRESHOLD', 10)
+
+# Seconds requests fail fast once the circuit breaker has tripped.
+# Afterwards a single request is let through to probe for recovery.
+DMV_CIRCUIT_BREAKER_COOLDOWN = clean_setting(
+    'DMV_CIRCUIT_BREAKER_COOLDOWN', 30, min_value=1
 )
 
 # Base authorization URL for Discord Oauth
@@ -36,6 +80,20 @@ DISCORD_ROLES_CACHE_MAX_AGE = clean_setting(
     'DISCORD_ROLES_CACHE_MAX_AGE', 3600 * 1
 )
 
+# How long guild members retrieved from the server are cached in seconds.
+# Keeps back to back operations on the same member from fetching it again.
+# Set to 0 to disable.
+DMV_GUILD_MEMBER_CACHE_MAX_AGE = clean_setting(
+    'DMV_GUILD_MEMBER_CACHE_MAX_AGE', 60
+)
+
+# How long the snapshot of all member nicks of a guild taken at the start
+# of a bulk nickname update is kept at most in seconds.
+# It is deleted as soon as the job is finished.
+DMV_GUILD_NICKS_SNAPSHOT_MAX_AGE = clean_setting(
+    'DMV_GUILD_NICKS_SNAPSHOT_MAX_AGE', 3600
+)
+
 # Turns off creation of new roles. In case the rate limit for creating roles is
 # exhausted, this setting allows the Discord service to continue to function
 # and wait out the reset. Rate limit is about 250 per 48 hrs.
@@ -46,3 +104,36 @@ DISCORD_DISABLE_ROLE_CREATION = clean_setting(
 DISCORD_DEBUG_LOGGING = clean_setting(
     'DISCORD_DEBUG_LOGGING', True
 )
+
+# Max requests per second a bot can send to the Discord API across all routes
+DMV_GLOBAL_RATE_LIMIT = clean_setting(
+    'DMV_GLOBAL_RATE_LIMIT', 50
+)
+
+# Fraction of each rate limit bucket and of the global rate limit that is
+# reserved for interactive requests, e.g. a user activating their account.
+# Bulk and background requests will back off once only the reserve is left,
+# the reserve never takes the last request of a bucket. 0 disables it.
+DMV_RATE_LIMIT_INTERACTIVE_RESERVE = clean_setting(
+    'DMV_RATE_LIMIT_INTERACTIVE_RESERVE',
+    0.2,
+    min_value=0.0,
+    max_value=0.9,
+    required_type=(int, float)
+)
+
+# When enabled bulk and background requests are spaced evenly across the rate
+# limit window of their bucket, based on the remaining requests and reset
+# reported by Discord, instead of bursting until the bucket is exhausted.
+DMV_RATE_LIMIT_PACING = clean_setting('DMV_RATE_LIMIT_PACING', False)
+
+# Max seconds a paced request sleeps for its slot. When the next slot is further
+# away the request raises, so the task can be retried when the slot is due.
+DMV_RATE_LIMIT_PACING_MAX_SLEEP = clean_setting(
+    'DMV_RATE_LIMIT_PACING_MAX_SLEEP', 2.0, min_value=0.0, required_type=(int, float)
+)
+
+# When enabled request latencies, rate limit buckets, 429s, backoffs and
+# results of sync tasks are aggregated in Redis across all workers
+# and can be exported in the Prometheus format.
+DMV_METRICS_ENABLED = clean_setting('DMV_METRICS_ENABLED', False)
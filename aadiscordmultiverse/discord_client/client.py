@@ -1,7 +1,9 @@
 import json
 import logging
+import random
+import re
 from hashlib import md5
-from time import sleep
+from time import sleep, time
 from urllib.parse import urljoin
 from uuid import uuid1
 
@@ -18,11 +20,22 @@ from .app_settings import (
     DISCORD_API_TIMEOUT_READ, DISCORD_DEBUG_LOGGING,
     DISCORD_DISABLE_ROLE_CREATION, DISCORD_GUILD_NAME_CACHE_MAX_AGE,
     DISCORD_OAUTH_BASE_URL, DISCORD_OAUTH_TOKEN_URL,
-    DISCORD_ROLES_CACHE_MAX_AGE,
+    DISCORD_ROLES_CACHE_MAX_AGE, DMV_API_RETRY_BASE_DELAY,
+    DMV_API_RETRY_BUDGET, DMV_API_RETRY_MAX, DMV_API_RETRY_MAX_DELAY,
+    DMV_API_ROUTE_TIMEOUTS, DMV_CIRCUIT_BREAKER_COOLDOWN,
+    DMV_CIRCUIT_BREAKER_THRESHOLD, DMV_GLOBAL_RATE_LIMIT,
+    DMV_GUILD_MEMBER_CACHE_MAX_AGE, DMV_GUILD_NICKS_SNAPSHOT_MAX_AGE,
+    DMV_RATE_LIMIT_INTERACTIVE_RESERVE, DMV_RATE_LIMIT_PACING,
+    DMV_RATE_LIMIT_PACING_MAX_SLEEP,
+)
+from .exceptions import (
+    DiscordApiBackoff, DiscordCircuitOpen, DiscordRateLimitExhausted,
+    DiscordTooManyRequestsError,
 )
-from .exceptions import DiscordRateLimitExhausted, DiscordTooManyRequestsError
 from .helpers import DiscordRoles
-from .rate_limiting import RateLimits
+from .metrics import metrics
+from .rate_limiting import rate_limiter
+from .timing import timed
 
 logger = logging.getLogger(__name__)
 
@@ -71,33 +84,73 @@ class DiscordClient:
     OAUTH_BASE_URL = DISCORD_OAUTH_BASE_URL
     OAUTH_TOKEN_URL = DISCORD_OAUTH_TOKEN_URL
 
+    _KEY_CIRCUIT_FAILURES = 'DISCORD_CIRCUIT_FAILURES'
+    _KEY_CIRCUIT_OPEN = 'DISCORD_CIRCUIT_OPEN'
+    _KEY_CIRCUIT_PROBE = 'DISCORD_CIRCUIT_PROBE'
     _KEY_GLOBAL_BACKOFF_UNTIL = 'DISCORD_GLOBAL_BACKOFF_UNTIL'
     _KEY_GLOBAL_RATE_LIMIT_REMAINING = 'DISCORD_GLOBAL_RATE_LIMIT_REMAINING'
+    _KEYPREFIX_GUILD_MEMBER = 'DISCORD_GUILD_MEMBER'
     _KEYPREFIX_GUILD_NAME = 'DISCORD_GUILD_NAME'
+    _KEYPREFIX_GUILD_NICKS = 'DISCORD_GUILD_NICKS'
     _KEYPREFIX_GUILD_ROLES = 'DISCORD_GUILD_ROLES'
+    _KEYPREFIX_PACE_INTERVAL = 'DISCORD_PACE_INTERVAL'
+    _KEYPREFIX_PACE_NEXT = 'DISCORD_PACE_NEXT'
     _KEYPREFIX_ROLE_NAME = 'DISCORD_ROLE_NAME'
     _NICK_MAX_CHARS = 32
+    _GUILD_MEMBERS_MAX_LIMIT = 1000
 
     _HTTP_STATUS_CODE_NOT_FOUND = 404
     _HTTP_STATUS_CODE_RATE_LIMITED = 429
+    _HTTP_STATUS_CODES_RETRY = (500, 502, 503, 504)
+    # read timeouts in seconds for routes that need to differ from the default
+    _ROUTE_TIMEOUTS = {
+        # members are added and updated while a user is waiting
+        "PUT guilds/{guild_id}/members/{user_id}": 10,
+        "PATCH guilds/{guild_id}/members/{user_id}": 10,
+        # pages of up to 1000 members can be slow
+        "GET guilds/{guild_id}/members": 60,
+    }
+
+    # methods that can safely be sent again.
+    # PATCH is included, since all our PATCHes set absolute values
+    _RETRY_METHODS = ('get', 'put', 'patch', 'delete')
+    # reason reported to metrics for backoffs raised before a request is sent
+    _BACKOFF_REASONS = {
+        DiscordTooManyRequestsError: 'ongoing_backoff',
+        DiscordCircuitOpen: 'circuit_open',
+        DiscordRateLimitExhausted: 'rate_limit',
+    }
     _DISCORD_STATUS_CODE_UNKNOWN_MEMBER = 10007
+    # clients shared within this process by token and options
+    _shared_clients = {}
+    # Discord keeps the limits of a bucket per guild, channel or webhook
+    _ROUTE_MAJOR_PARAMETER = re.compile(r'^(guilds|channels|webhooks)/(\d+)')
 
     def __init__(
         self,
         access_token: str,
         redis: Redis = None,
-        is_rate_limited: bool = True
+        is_rate_limited: bool = True,
+        is_interactive: bool = False,
+        rate_limit_namespace: str = ""
     ) -> None:
         """
         Params:
         - access_token: Discord access token used to authenticate all calls to the API
         - redis: Redis instance to be used.
         - is_rate_limited: Set to False to run of rate limiting (use with care)
+        - is_interactive: Set to True for requests a user is waiting on,
+        which may use the reserved part of the rate limits
+        - rate_limit_namespace: Rate limits and backoffs are tracked per namespace,
+        so every bot needs its own. The default bot has none.
         If not specified will try to use the Redis instance
         from the default Django cache backend.
         """
         self._access_token = str(access_token)
         self._is_rate_limited = bool(is_rate_limited)
+        self._is_interactive = bool(is_interactive)
+        self._rate_limit_namespace = str(rate_limit_namespace)
+        self._rate_limits = rate_limiter(self._rate_limit_namespace)
         if not redis:
             self._redis = get_redis_connection("default")
             if not isinstance(self._redis, Redis):
@@ -126,6 +179,104 @@ class DiscordClient:
         """
         self.__redis_script_set_longer = self._redis.register_script(lua_2)
 
+        # returns 0 when a request may be sent, else ms until the next try
+        lua_circuit_check = """
+            local open_px = tonumber(redis.call("pttl", KEYS[1]))
+            if open_px > 0 then
+                return open_px
+            end
+            local failures = tonumber(redis.call("get", KEYS[2]) or "0")
+            if failures < tonumber(ARGV[1]) then
+                return 0
+            end
+            if redis.call("set", KEYS[3], "1", "nx", "px", ARGV[2]) then
+                return 0
+            end
+            return math.max(1, tonumber(redis.call("pttl", KEYS[3])))
+        """
+        self.__redis_script_circuit_check = self._redis.register_script(
+            lua_circuit_check
+        )
+
+        lua_circuit_failure = """
+            local failures = redis.call("incr", KEYS[1])
+            redis.call("pexpire", KEYS[1], tonumber(ARGV[2]) * 10)
+            if failures >= tonumber(ARGV[1]) then
+                redis.call("set", KEYS[2], "1", "px", ARGV[2])
+                redis.call("del", KEYS[3])
+            end
+            return failures
+        """
+        self.__redis_script_circuit_failure = self._redis.register_script(
+            lua_circuit_failure
+        )
+
+        # returns {1, ms to wait} when a slot was taken
+        # or {0, ms until the next slot} when it is too far away
+        lua_pace_take = """
+            local now = tonumber(ARGV[1])
+            local interval = tonumber(redis.call("get", KEYS[2]) or "0")
+            local slot = math.max(now, tonumber(redis.call("get", KEYS[1]) or "0"))
+            local wait = slot - now
+            if wait > tonumber(ARGV[2]) then
+                return {0, wait}
+            end
+            if interval > 0 then
+                redis.call("set", KEYS[1], slot + interval, "px", wait + interval + 1000)
+            end
+            return {1, wait}
+        """
+        self.__redis_script_pace_take = self._redis.register_script(lua_pace_take)
+
+        lua_pace_update = """
+            local now = tonumber(ARGV[1])
+            local remaining = tonumber(ARGV[2])
+            local reset_after = tonumber(ARGV[3])
+            if remaining > 0 then
+                redis.call(
+                    "set", KEYS[2], math.ceil(reset_after / remaining),
+                    "px", reset_after + 1000
+                )
+            else
+                local reset_at = now + reset_after
+                if tonumber(redis.call("get", KEYS[1]) or "0") < reset_at then
+                    redis.call("set", KEYS[1], reset_at, "px", reset_after + 1000)
+                end
+            end
+        """
+        self.__redis_script_pace_update = self._redis.register_script(lua_pace_update)
+
+    @classmethod
+    def shared(
+        cls,
+        access_token: str,
+        is_rate_limited: bool = True,
+        is_interactive: bool = False,
+        rate_limit_namespace: str = ""
+    ) -> "DiscordClient":
+        """returns the client for a token and options that is shared within this process,
+        so the Redis connection and scripts are only set up once
+
+        Only use for bot tokens, since clients are kept for the lifetime of the process.
+        Params are the same as for a new client.
+        """
+        key = (
+            str(access_token),
+            bool(is_rate_limited),
+            bool(is_interactive),
+            str(rate_limit_namespace)
+        )
+        client = cls._shared_clients.get(key)
+        if client is None:
+            client = cls(
+                access_token,
+                is_rate_limited=is_rate_limited,
+                is_interactive=is_interactive,
+                rate_limit_namespace=rate_limit_namespace
+            )
+            cls._shared_clients[key] = client
+        return client
+
     @property
     def access_token(self):
         return self._access_token
@@ -134,6 +285,25 @@ class DiscordClient:
     def is_rate_limited(self):
         return self._is_rate_limited
 
+    @property
+    def is_interactive(self):
+        return self._is_interactive
+
+    @property
+    def rate_limit_namespace(self):
+        return self._rate_limit_namespace
+
+    def _rate_limit_key(self, key: str) -> str:
+        """returns the Redis key of a rate limit in the namespace of this client"""
+        return self._rate_limit_key_for(key, self._rate_limit_namespace)
+
+    @staticmethod
+    def _rate_limit_key_for(key: str, namespace: str) -> str:
+        """returns the Redis key of a rate limit in a namespace"""
+        if namespace:
+            return f'{key}:{namespace}'
+        return key
+
     def __repr__(self):
         return f'{type(self).__name__}(access_token=...{self.access_token[-5:]})'
 
@@ -157,6 +327,51 @@ class DiscordClient:
             keys=[str(name)], args=[str(value), int(px)]
         )
 
+    def _redis_circuit_check(self, threshold: int, px: int) -> int:
+        """returns 0 if the circuit breaker lets a request through,
+        else the time in ms until it may be tried again
+
+        Implemented as Lua script to ensure atomicity.
+        """
+        return self.__redis_script_circuit_check(
+            keys=[self._KEY_CIRCUIT_OPEN, self._KEY_CIRCUIT_FAILURES, self._KEY_CIRCUIT_PROBE],
+            args=[int(threshold), int(px)]
+        )
+
+    def _redis_circuit_failure(self, threshold: int, px: int) -> int:
+        """counts a failed request and trips the circuit breaker at the threshold
+
+        Implemented as Lua script to ensure atomicity.
+        """
+        return self.__redis_script_circuit_failure(
+            keys=[self._KEY_CIRCUIT_FAILURES, self._KEY_CIRCUIT_OPEN, self._KEY_CIRCUIT_PROBE],
+            args=[int(threshold), int(px)]
+        )
+
+    def _redis_pace_take(self, keys: list, max_wait: int) -> tuple:
+        """takes the next request slot of a paced bucket if it is due within max_wait
+
+        Returns a tuple of whether the slot was taken and ms until it is due
+
+        Implemented as Lua script to ensure atomicity.
+        """
+        with timed('redis'):
+            taken, wait = self.__redis_script_pace_take(
+                keys=keys, args=[int(time() * 1000), int(max_wait)]
+            )
+        return bool(taken), int(wait)
+
+    def _redis_pace_update(self, keys: list, remaining: int, reset_after: int) -> None:
+        """sets the request interval of a paced bucket from the remaining requests
+        or moves its next slot to the reset once no requests are remaining
+
+        Implemented as Lua script to ensure atomicity.
+        """
+        with timed('redis'):
+            self.__redis_script_pace_update(
+                keys=keys, args=[int(time() * 1000), int(remaining), int(reset_after)]
+            )
+
     # users
 
     def current_user(self) -> dict:
@@ -399,17 +614,31 @@ class DiscordClient:
         )
         r.raise_for_status()
         if r.status_code == 201:
+            self._set_guild_member_cache(guild_id, user_id, self._response_json(r))
             return True
         elif r.status_code == 204:
             return None
         else:
             return False
 
-    def guild_member(self, guild_id: int, user_id: int) -> dict:
-        """returns the user info for a guild member
+    def guild_member(self, guild_id: int, user_id: int, use_cache: bool = True) -> dict:
+        """returns the user info for a guild member (cached)
 
         or None if the user is not a member of the guild
+
+        Params:
+        - use_cache: When set to False will force an API call to get the member
         """
+        if use_cache and DMV_GUILD_MEMBER_CACHE_MAX_AGE:
+            member_raw = self._redis.get(
+                name=self._guild_member_cache_key(guild_id, user_id)
+            )
+            if member_raw:
+                logger.debug(
+                    'Returning member %s of guild %s from cache', user_id, guild_id
+                )
+                return json.loads(self._redis_decode(member_raw))
+
         route = f'guilds/{guild_id}/members/{user_id}'
         r = self._api_request(
             method='get',
@@ -423,7 +652,81 @@ class DiscordClient:
             return None
         else:
             r.raise_for_status()
-            return r.json()
+            member = r.json()
+            self._set_guild_member_cache(guild_id, user_id, member)
+            return member
+
+    def guild_members(self, guild_id: int) -> list:
+        """returns all members of a guild, fetched in pages of 1000"""
+        route = f'guilds/{guild_id}/members'
+        members = list()
+        after = 0
+        while True:
+            r = self._api_request(
+                method='get',
+                route=f'{route}?limit={self._GUILD_MEMBERS_MAX_LIMIT}&after={after}',
+                bucket='GET guilds/{guild_id}/members'
+            )
+            page = r.json()
+            members += page
+            if len(page) < self._GUILD_MEMBERS_MAX_LIMIT:
+                return members
+            after = max(int(member['user']['id']) for member in page)
+
+    def snapshot_guild_nicks(self, guild_id: int) -> int:
+        """Fetches all members of a guild and keeps their nicks,
+        so later nickname updates can skip members that already have it
+
+        Returns the number of members in the snapshot
+        """
+        members = self.guild_members(guild_id)
+        key = self._guild_nicks_cache_key(guild_id)
+        pipe = self._redis.pipeline()
+        pipe.delete(key)
+        for start in range(0, len(members), self._GUILD_MEMBERS_MAX_LIMIT):
+            pipe.hset(key, mapping={
+                member['user']['id']: member.get('nick') or ''
+                for member in members[start:start + self._GUILD_MEMBERS_MAX_LIMIT]
+            })
+        pipe.expire(key, DMV_GUILD_NICKS_SNAPSHOT_MAX_AGE)
+        pipe.execute()
+        logger.debug('Took snapshot of %d member nicks for guild %s', len(members), guild_id)
+        return len(members)
+
+    def delete_guild_nicks_snapshot(self, guild_id: int) -> None:
+        """Deletes the nicks snapshot of a guild once the job that took it is done"""
+        self._redis.delete(self._guild_nicks_cache_key(guild_id))
+
+    def guild_member_has_nick(
+        self, guild_id: int, user_id: int, nick: str, use_snapshot: bool = False
+    ) -> bool:
+        """returns True if the guild member is known to already have this nick
+
+        Only looks at the member cache and the nicks snapshot, does not hit the API
+
+        Params:
+        - use_snapshot: also look at the nicks snapshot, only for the job that took it
+        """
+        nick = self._sanitize_nick(nick)
+        if DMV_GUILD_MEMBER_CACHE_MAX_AGE:
+            member_raw = self._redis.get(
+                name=self._guild_member_cache_key(guild_id, user_id)
+            )
+            if member_raw:
+                member = json.loads(self._redis_decode(member_raw))
+                return (member.get('nick') or '') == nick
+        if not use_snapshot:
+            return False
+        current_nick = self._redis.hget(self._guild_nicks_cache_key(guild_id), str(user_id))
+        if current_nick is None:
+            return False
+        return self._redis_decode(current_nick) == nick
+
+    @classmethod
+    def _guild_nicks_cache_key(cls, guild_id: int) -> str:
+        """Returns key for accessing the nicks snapshot of a guild"""
+        gen_key = DiscordClient._generate_hash(f'{guild_id}')
+        return f'{cls._KEYPREFIX_GUILD_NICKS}__{gen_key}'
 
     def modify_guild_member(
         self, guild_id: int, user_id: int, role_ids: list = None, nick: str = None
@@ -458,11 +761,19 @@ class DiscordClient:
         )
         if self._is_member_unknown_error(r):
             logger.warning('User ID %s is not a member of this guild', user_id)
+            self._invalidate_guild_member_cache(guild_id, user_id)
             return None
         else:
             r.raise_for_status()
 
-        if r.status_code == 204:
+        if r.status_code in (200, 204):
+            self._redis.hdel(self._guild_nicks_cache_key(guild_id), str(user_id))
+        if r.status_code == 200:
+            # Discord returns the updated member
+            self._set_guild_member_cache(guild_id, user_id, self._response_json(r))
+            return True
+        elif r.status_code == 204:
+            self._invalidate_guild_member_cache(guild_id, user_id)
             return True
         else:
             return False
@@ -482,6 +793,7 @@ class DiscordClient:
             raise_for_status=False,
             bucket="DELETE guilds/{guild_id}/members/{user_id}"
         )
+        self._invalidate_guild_member_cache(guild_id, user_id)
         if self._is_member_unknown_error(r):
             logger.warning('User ID %s is not a member of this guild', user_id)
             return None
@@ -493,6 +805,32 @@ class DiscordClient:
         else:
             return False
 
+    def _set_guild_member_cache(self, guild_id: int, user_id: int, member: dict) -> None:
+        if DMV_GUILD_MEMBER_CACHE_MAX_AGE and member and isinstance(member, dict):
+            self._redis.set(
+                name=self._guild_member_cache_key(guild_id, user_id),
+                value=json.dumps(member),
+                ex=DMV_GUILD_MEMBER_CACHE_MAX_AGE
+            )
+
+    def _invalidate_guild_member_cache(self, guild_id: int, user_id: int) -> None:
+        self._redis.delete(self._guild_member_cache_key(guild_id, user_id))
+        logger.debug('Guild member cache invalidated for %s', user_id)
+
+    @staticmethod
+    def _response_json(r: requests.Response):
+        """returns the decoded JSON body of a response or None if there is none"""
+        try:
+            return r.json()
+        except ValueError:
+            return None
+
+    @classmethod
+    def _guild_member_cache_key(cls, guild_id: int, user_id: int) -> str:
+        """Returns key for accessing a cached guild member"""
+        gen_key = DiscordClient._generate_hash(f'{guild_id}__{user_id}')
+        return f'{cls._KEYPREFIX_GUILD_MEMBER}__{gen_key}'
+
     # Guild member roles
 
     def add_guild_member_role(
@@ -512,6 +850,7 @@ class DiscordClient:
             raise_for_status=False,
             bucket="PUT guilds/{guild_id}/members/{user_id}/roles/{role_id}"
         )
+        self._invalidate_guild_member_cache(guild_id, user_id)
         if self._is_member_unknown_error(r):
             logger.warning('User ID %s is not a member of this guild', user_id)
             return None
@@ -540,6 +879,7 @@ class DiscordClient:
             raise_for_status=False,
             bucket="DELETE guilds/{guild_id}/members/{user_id}/roles/{role_id}"
         )
+        self._invalidate_guild_member_cache(guild_id, user_id)
         if self._is_member_unknown_error(r):
             logger.warning('User ID %s is not a member of this guild', user_id)
             return None
@@ -583,9 +923,6 @@ class DiscordClient:
         if not authorization:
             authorization = f'Bot {self.access_token}'
 
-        self._handle_ongoing_api_backoff(uid)
-        if self.is_rate_limited:
-            RateLimits.check_bucket(bucket)
         headers = {
             'User-Agent': f'{AUTH_TITLE} ({__url__}, {__version__})',
             'accept': 'application/json',
@@ -599,15 +936,68 @@ class DiscordClient:
         args = {
             'url': url,
             'headers': headers,
-            'timeout': (DISCORD_API_TIMEOUT_CONNECT, DISCORD_API_TIMEOUT_READ)
+            'timeout': self._route_timeout(bucket)
         }
         if data:
             args['json'] = data
 
-        logger.info('%s: sending %s request to url \'%s\'',
-                    uid, method.upper(), url)
-        logger.debug('%s: request headers: %s', uid, headers)
-        r = getattr(requests, method)(**args)
+        attempt = 0
+        retry_wait = 0.0
+        while True:
+            try:
+                with timed('redis'):
+                    self._handle_ongoing_api_backoff(uid)
+                    self._ensure_circuit_closed(uid)
+                    if self.is_rate_limited:
+                        reserve = (
+                            0.0 if self.is_interactive else DMV_RATE_LIMIT_INTERACTIVE_RESERVE
+                        )
+                        self._rate_limits.check_global(DMV_GLOBAL_RATE_LIMIT, reserve)
+                        self._rate_limits.check_bucket(bucket, reserve)
+                        if DMV_RATE_LIMIT_PACING and not self.is_interactive:
+                            self._pace_request(uid, bucket, route)
+            except DiscordApiBackoff as ex:
+                self._report_backoff_metrics(
+                    bucket, self._BACKOFF_REASONS.get(type(ex), 'other'), ex
+                )
+                raise
+
+            logger.info('%s: sending %s request to url \'%s\'',
+                        uid, method.upper(), url)
+            logger.debug('%s: request headers: %s', uid, headers)
+            started = time()
+            try:
+                with timed('http'):
+                    r = getattr(requests, method)(**args)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+                self._report_request_metrics(bucket, time() - started)
+                self._report_circuit_result(uid, failed=True)
+                delay = self._retry_delay(method, attempt, retry_wait)
+                if delay is None:
+                    raise
+                logger.warning(
+                    '%s: %r on attempt %d, retrying in %.3f seconds',
+                    uid, ex, attempt + 1, delay
+                )
+            else:
+                self._report_request_metrics(bucket, time() - started, r)
+                is_server_error = r.status_code in self._HTTP_STATUS_CODES_RETRY
+                self._report_circuit_result(uid, failed=is_server_error)
+                if not is_server_error:
+                    break
+                delay = self._retry_delay(method, attempt, retry_wait)
+                if delay is None:
+                    break
+                logger.warning(
+                    '%s: Discord API returned error code %d on attempt %d, '
+                    'retrying in %.3f seconds',
+                    uid, r.status_code, attempt + 1, delay
+                )
+            with timed('sleep'):
+                sleep(delay)
+            retry_wait += delay
+            attempt += 1
+
         logger.debug(
             '%s: returned status code %d with headers: %s',
             uid,
@@ -623,23 +1013,168 @@ class DiscordClient:
                 r.text
             )
 
-        if r.status_code == self._HTTP_STATUS_CODE_RATE_LIMITED:
-            self._handle_new_api_backoff(r, uid)
+        with timed('redis'):
+            if r.status_code == self._HTTP_STATUS_CODE_RATE_LIMITED:
+                try:
+                    self._handle_new_api_backoff(r, uid)
+                except DiscordTooManyRequestsError as ex:
+                    self._report_backoff_metrics(bucket, 'too_many_requests', ex)
+                    raise
 
-        self._report_rate_limit_from_api(r, uid, bucket)
+            self._report_rate_limit_from_api(r, uid, bucket, route)
 
         if raise_for_status:
             r.raise_for_status()
 
         return r
 
+    def _report_request_metrics(
+        self, bucket: str, duration: float, r: requests.Response = None
+    ) -> None:
+        """Record latency, rate limit bucket and 429s of a request.
+        Requests that got no response are recorded with status error.
+        """
+        if not metrics.is_enabled:
+            return
+        batch = metrics.batch()
+        batch.observe(
+            'dmv_discord_api_request_duration_seconds',
+            duration,
+            route=bucket,
+            status=r.status_code if r is not None else 'error'
+        )
+        if r is not None:
+            if r.status_code == self._HTTP_STATUS_CODE_RATE_LIMITED:
+                batch.inc(
+                    'dmv_discord_api_rate_limited_total',
+                    route=bucket,
+                    scope=r.headers.get('x-ratelimit-scope', 'unknown')
+                )
+            try:
+                remaining = int(r.headers['x-ratelimit-remaining'])
+                limit = int(r.headers['x-ratelimit-limit'])
+            except (KeyError, ValueError):
+                pass
+            else:
+                batch.set('dmv_discord_bucket_remaining', remaining, route=bucket)
+                batch.set('dmv_discord_bucket_limit', limit, route=bucket)
+        batch.execute()
+
+    @staticmethod
+    def _report_backoff_metrics(bucket: str, reason: str, ex: DiscordApiBackoff) -> None:
+        """Record a backoff handed to the caller and how long it has to wait"""
+        if not metrics.is_enabled:
+            return
+        batch = metrics.batch()
+        batch.inc('dmv_discord_api_backoffs_total', route=bucket, reason=reason)
+        batch.inc(
+            'dmv_discord_api_backoff_seconds_total',
+            ex.retry_after / 1000,
+            route=bucket,
+            reason=reason
+        )
+        batch.execute()
+
+    def _pace_keys(self, bucket: str, route: str) -> list:
+        """returns the Redis keys for the next slot and the interval of a paced bucket"""
+        bucket_key = self._rate_limits.lookup_slug_bucket(bucket).get_key()
+        match = self._ROUTE_MAJOR_PARAMETER.match(route)
+        if match:
+            bucket_key = f'{bucket_key}:{match.group(2)}'
+        return [
+            self._rate_limit_key(f'{self._KEYPREFIX_PACE_NEXT}__{bucket_key}'),
+            self._rate_limit_key(f'{self._KEYPREFIX_PACE_INTERVAL}__{bucket_key}'),
+        ]
+
+    def _pace_request(self, uid: str, bucket: str, route: str) -> None:
+        """Space the requests of a bucket evenly across its rate limit window
+
+        Waits for the next slot if it is due soon, else raises exception,
+        so the task can be retried right when the slot is due.
+        """
+        taken, wait = self._redis_pace_take(
+            self._pace_keys(bucket, route), DMV_RATE_LIMIT_PACING_MAX_SLEEP * 1000
+        )
+        if not taken:
+            logger.info(
+                '%s: Next request slot for bucket %s is due in %d ms. Raising exception.',
+                uid,
+                bucket,
+                wait
+            )
+            raise DiscordRateLimitExhausted(wait, bucket=bucket)
+        if wait > 0:
+            logger.debug(
+                '%s: Waiting %d ms for next request slot for bucket %s', uid, wait, bucket
+            )
+            with timed('sleep'):
+                sleep(wait / 1000)
+
+    def _ensure_circuit_closed(self, uid: str) -> None:
+        """Fail fast while the circuit breaker is open"""
+        if not DMV_CIRCUIT_BREAKER_THRESHOLD:
+            return
+        retry_after = self._redis_circuit_check(
+            DMV_CIRCUIT_BREAKER_THRESHOLD, DMV_CIRCUIT_BREAKER_COOLDOWN * 1000
+        )
+        if retry_after and retry_after > 0:
+            logger.warning(
+                '%s: Circuit breaker is open, failing fast for %s ms',
+                uid,
+                retry_after
+            )
+            raise DiscordCircuitOpen(retry_after)
+
+    def _report_circuit_result(self, uid: str, failed: bool) -> None:
+        """Count consecutive failed requests and close the circuit on success"""
+        if not DMV_CIRCUIT_BREAKER_THRESHOLD:
+            return
+        if failed:
+            with timed('redis'):
+                failures = self._redis_circuit_failure(
+                    DMV_CIRCUIT_BREAKER_THRESHOLD, DMV_CIRCUIT_BREAKER_COOLDOWN * 1000
+                )
+            if failures == DMV_CIRCUIT_BREAKER_THRESHOLD:
+                logger.error(
+                    '%s: Circuit breaker tripped after %d failed requests to Discord',
+                    uid,
+                    failures
+                )
+        else:
+            with timed('redis'):
+                self._redis.delete(self._KEY_CIRCUIT_FAILURES, self._KEY_CIRCUIT_PROBE)
+
+    @classmethod
+    def _route_timeout(cls, bucket: str) -> tuple:
+        """returns the connect and read timeouts for requests of a route"""
+        timeout = DMV_API_ROUTE_TIMEOUTS.get(bucket, cls._ROUTE_TIMEOUTS.get(bucket))
+        if timeout is None:
+            return DISCORD_API_TIMEOUT_CONNECT, DISCORD_API_TIMEOUT_READ
+        if isinstance(timeout, (tuple, list)):
+            return tuple(timeout)
+        return DISCORD_API_TIMEOUT_CONNECT, timeout
+
+    @classmethod
+    def _retry_delay(cls, method: str, attempt: int, retry_wait: float) -> float:
+        """returns the jittered delay in seconds before the next retry of a request
+        or None if it must not be retried
+        """
+        if method not in cls._RETRY_METHODS or attempt >= DMV_API_RETRY_MAX:
+            return None
+        delay = random.uniform(
+            0, min(DMV_API_RETRY_MAX_DELAY, DMV_API_RETRY_BASE_DELAY * 2 ** attempt)
+        )
+        if retry_wait + delay > DMV_API_RETRY_BUDGET:
+            return None
+        return delay
+
     def _handle_ongoing_api_backoff(self, uid: str) -> None:
         """checks if api is currently on backoff
         if on backoff: will do a blocking wait if it expires soon,
         else raises exception
         """
         global_backoff_duration = self._redis.pttl(
-            self._KEY_GLOBAL_BACKOFF_UNTIL)
+            self._rate_limit_key(self._KEY_GLOBAL_BACKOFF_UNTIL))
         if global_backoff_duration > 0:
             if global_backoff_duration < WAIT_THRESHOLD:
                 logger.info(
@@ -647,7 +1182,8 @@ class DiscordClient:
                     uid,
                     global_backoff_duration
                 )
-                sleep(global_backoff_duration / 1000)
+                with timed('sleep'):
+                    sleep(global_backoff_duration / 1000)
             else:
                 logger.info(
                     '%s: Global API backoff still ongoing for %s ms. Re-raising.',
@@ -664,15 +1200,16 @@ class DiscordClient:
 
         returns requests remaining on success
         """
+        key = self._rate_limit_key(self._KEY_GLOBAL_RATE_LIMIT_REMAINING)
         for _ in range(RATE_LIMIT_RETRIES):
             requests_remaining = self._redis_decr_or_set(
-                name=self._KEY_GLOBAL_RATE_LIMIT_REMAINING,
+                name=key,
                 value=RATE_LIMIT_MAX_REQUESTS,
                 px=RATE_LIMIT_RESETS_AFTER + DURATION_CONTINGENCY
             )
             resets_in = max(
                 MINIMUM_BLOCKING_WAIT,
-                self._redis.pttl(self._KEY_GLOBAL_RATE_LIMIT_REMAINING)
+                self._redis.pttl(key)
             )
             if requests_remaining >= 0:
                 logger.debug(
@@ -684,7 +1221,8 @@ class DiscordClient:
                 return requests_remaining
 
             elif resets_in < WAIT_THRESHOLD:
-                sleep(resets_in / 1000)
+                with timed('sleep'):
+                    sleep(resets_in / 1000)
                 logger.debug(
                     '%s: No requests remaining until reset in %d ms. '
                     'Waiting for reset.',
@@ -717,7 +1255,7 @@ class DiscordClient:
         else:
             retry_after = DEFAULT_BACKOFF_DELAY
         self._redis_set_if_longer(
-            name=self._KEY_GLOBAL_BACKOFF_UNTIL,
+            name=self._rate_limit_key(self._KEY_GLOBAL_BACKOFF_UNTIL),
             value='GLOBAL_API_BACKOFF',
             px=retry_after
         )
@@ -728,11 +1266,10 @@ class DiscordClient:
         )
         raise DiscordTooManyRequestsError(retry_after=retry_after)
 
-    def _report_rate_limit_from_api(self, r, uid, bucket):
-        """Tries to log the current rate limit reported from API"""
+    def _report_rate_limit_from_api(self, r, uid, bucket, route=''):
+        """Tries to update the rate limit of the bucket from the one reported from API"""
         if (
-            DISCORD_DEBUG_LOGGING
-            and 'x-ratelimit-limit' in r.headers
+            'x-ratelimit-limit' in r.headers
             and 'x-ratelimit-remaining' in r.headers
             and 'x-ratelimit-reset-after' in r.headers
         ):
@@ -741,7 +1278,7 @@ class DiscordClient:
                 remaining = int(r.headers['x-ratelimit-remaining'])
                 reset_after = float(r.headers['x-ratelimit-reset']) - timezone.now().timestamp()
                 window = float(r.headers['x-ratelimit-reset-after'])
-                bucket_header = r.headers.get("x-ratelimit-bucket", "Unknown")
+                bucket_header = r.headers.get("x-ratelimit-bucket", "")
                 if DISCORD_DEBUG_LOGGING:
                     logger.info(
                         '%s: Rate limit reported from API: %d requests per %s ms (%s)[%s] %s (%s)',
@@ -753,7 +1290,7 @@ class DiscordClient:
                         r.request.url,
                         bucket_header
                     )
-                RateLimits.update_slug_bucket(
+                self._rate_limits.update_slug_bucket(
                     bucket,
                     limit,
                     window,
@@ -761,6 +1298,10 @@ class DiscordClient:
                     remaining,
                     reset_after
                 )
+                if DMV_RATE_LIMIT_PACING:
+                    self._redis_pace_update(
+                        self._pace_keys(bucket, route), remaining, window * 1000
+                    )
             except ValueError as e:
                 logger.error(e)
 
@@ -31,3 +31,9 @@ class DiscordTooManyRequestsError(DiscordApiBackoff):
     """API has responded with a 429 Too Many Requests Error.
     Need to backoff for now.
     """
+
+
+class DiscordCircuitOpen(DiscordApiBackoff):
+    """Discord seems to be down after repeated connection errors or 5xx responses.
+    No requests are sent until the circuit breaker lets a probe through.
+    """
@@ -0,0 +1,220 @@
+import logging
+import math
+import re
+
+from django_redis import get_redis_connection
+from redis import Redis
+
+from .app_settings import DMV_METRICS_ENABLED
+from .timing import timed
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds of the buckets of latency histograms
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# all known metrics by name with their type and help text
+METRICS = {
+    'dmv_discord_api_request_duration_seconds': (
+        'histogram', 'Duration of requests to the Discord API by route and status'
+    ),
+    'dmv_discord_api_rate_limited_total': (
+        'counter', 'Responses from the Discord API with status 429 by route and scope'
+    ),
+    'dmv_discord_api_backoffs_total': (
+        'counter', 'Requests to the Discord API not sent or failed due to a backoff'
+    ),
+    'dmv_discord_api_backoff_seconds_total': (
+        'counter', 'Seconds of backoff requested from callers by route and reason'
+    ),
+    'dmv_discord_bucket_remaining': (
+        'gauge', 'Requests remaining in the rate limit bucket as last reported by Discord'
+    ),
+    'dmv_discord_bucket_limit': (
+        'gauge', 'Limit of the rate limit bucket as last reported by Discord'
+    ),
+    'dmv_task_results_total': (
+        'counter', 'Results of user sync tasks by task, guild, method and result'
+    ),
+    'dmv_task_profiles_total': (
+        'counter', 'Profiled runs of user sync tasks by task'
+    ),
+    'dmv_task_profile_seconds_total': (
+        'counter', 'Seconds profiled runs of user sync tasks spent by task and category'
+    ),
+}
+
+_HISTOGRAM_SUFFIXES = ('_bucket', '_sum', '_count')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+_ESCAPED = {'n': '\n'}
+
+
+class MetricsBatch:
+    """Collects metric updates and sends them to Redis in one round trip"""
+
+    def __init__(self, redis: Redis, key: str) -> None:
+        self._pipe = redis.pipeline(transaction=False)
+        self._key = key
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        """Increase a counter"""
+        field = Metrics.sample_name(name, labels)
+        if isinstance(amount, int):
+            self._pipe.hincrby(self._key, field, amount)
+        else:
+            self._pipe.hincrbyfloat(self._key, field, amount)
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Set a gauge"""
+        self._pipe.hset(self._key, Metrics.sample_name(name, labels), value)
+
+    def observe(
+        self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels
+    ) -> None:
+        """Add an observation to a histogram"""
+        for upper_bound in buckets:
+            if value <= upper_bound:
+                self._pipe.hincrby(
+                    self._key,
+                    Metrics.sample_name(f'{name}_bucket', labels, le=upper_bound),
+                    1
+                )
+        self._pipe.hincrby(
+            self._key, Metrics.sample_name(f'{name}_bucket', labels, le='+Inf'), 1
+        )
+        self._pipe.hincrbyfloat(self._key, Metrics.sample_name(f'{name}_sum', labels), value)
+        self._pipe.hincrby(self._key, Metrics.sample_name(f'{name}_count', labels), 1)
+
+    def execute(self) -> None:
+        try:
+            with timed('redis'):
+                self._pipe.execute()
+        except Exception:
+            # metrics must never break the requests they are measuring
+            logger.warning('Failed to record metrics', exc_info=True)
+
+
+class Metrics:
+    """Counters, gauges and histograms aggregated in Redis across all workers
+
+    All samples are fields of one Redis hash, named like in the Prometheus
+    text format, e.g. `dmv_task_results_total{guild_id="1",result="success"}`.
+    Updates are no-ops unless DMV_METRICS_ENABLED is set.
+    """
+    _KEY_SAMPLES = 'dmv:metrics'
+
+    def __init__(self, redis: Redis = None) -> None:
+        self._redis = redis
+
+    @property
+    def redis(self) -> Redis:
+        # connected on first use, so importing this module needs no Redis
+        if self._redis is None:
+            self._redis = get_redis_connection("default")
+        return self._redis
+
+    @property
+    def is_enabled(self) -> bool:
+        return DMV_METRICS_ENABLED
+
+    def batch(self) -> 'MetricsBatch':
+        return MetricsBatch(self.redis, self._KEY_SAMPLES)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        if self.is_enabled:
+            batch = self.batch()
+            batch.inc(name, amount, **labels)
+            batch.execute()
+
+    def set(self, name: str, value: float, **labels) -> None:
+        if self.is_enabled:
+            batch = self.batch()
+            batch.set(name, value, **labels)
+            batch.execute()
+
+    def observe(
+        self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels
+    ) -> None:
+        if self.is_enabled:
+            batch = self.batch()
+            batch.observe(name, value, buckets, **labels)
+            batch.execute()
+
+    def samples(self) -> dict:
+        """returns the values of all samples by sample name"""
+        return {
+            self._redis_decode(field): float(value)
+            for field, value in self.redis.hgetall(self._KEY_SAMPLES).items()
+        }
+
+    def reset(self) -> None:
+        self.redis.delete(self._KEY_SAMPLES)
+
+    def export(self) -> str:
+        """returns all samples in the Prometheus text format"""
+        samples_by_metric = dict()
+        for sample, value in self.samples().items():
+            samples_by_metric.setdefault(self._metric_name(sample), list()).append(
+                (sample, value)
+            )
+        lines = list()
+        for metric in sorted(samples_by_metric):
+            metric_type, help_text = METRICS.get(metric, ('untyped', ''))
+            if help_text:
+                lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {metric_type}')
+            for sample, value in sorted(samples_by_metric[metric], key=self._sort_key):
+                lines.append(f'{sample} {self._format_value(value)}')
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    @classmethod
+    def sample_name(cls, name: str, labels: dict, le=None) -> str:
+        """returns the name of a sample with its labels in the Prometheus text format"""
+        parts = [
+            f'{label}="{cls._escape(value)}"' for label, value in sorted(labels.items())
+        ]
+        if le is not None:
+            parts.append(f'le="{le}"')
+        return f'{name}{{{",".join(parts)}}}' if parts else name
+
+    @staticmethod
+    def parse_sample_name(sample: str) -> tuple:
+        """returns the name and labels of a sample in the Prometheus text format"""
+        name, _, labels = sample.partition('{')
+        return name, {
+            label: re.sub(r'\\(.)', lambda m: _ESCAPED.get(m.group(1), m.group(1)), value)
+            for label, value in _LABEL.findall(labels)
+        }
+
+    @staticmethod
+    def _escape(value) -> str:
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+    @staticmethod
+    def _metric_name(sample: str) -> str:
+        name = sample.split('{', 1)[0]
+        for suffix in _HISTOGRAM_SUFFIXES:
+            base = name[:-len(suffix)]
+            if name.endswith(suffix) and METRICS.get(base, ('',))[0] == 'histogram':
+                return base
+        return name
+
+    @staticmethod
+    def _sort_key(item: tuple) -> tuple:
+        sample = item[0]
+        match = re.search(r',?le="([^"]+)"', sample)
+        if not match:
+            return sample, 0.0
+        upper_bound = math.inf if match.group(1) == '+Inf' else float(match.group(1))
+        return sample[:match.start()] + sample[match.end():], upper_bound
+
+    @staticmethod
+    def _format_value(value: float) -> str:
+        return str(int(value)) if value.is_integer() else repr(value)
+
+    @staticmethod
+    def _redis_decode(value) -> str:
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+metrics = Metrics()
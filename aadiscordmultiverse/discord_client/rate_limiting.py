@@ -1,9 +1,11 @@
 import logging
+import math
 
 from django.core.cache import cache
 from django.utils.text import slugify
 
 from .exceptions import DiscordRateLimitExhausted
+from .timing import timed
 
 logger = logging.getLogger(__name__)
 
@@ -28,12 +30,20 @@ class RateLimitBucket:
 
 
 class RateLimiter:
-    bucket_cache = {}
+    GLOBAL_SLUG = "global"
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, namespace: str = "") -> None:
+        """
+        Params:
+        - namespace: Keeps the buckets apart from those of other bots.
+        The default bot has no namespace.
+        """
+        self.namespace = namespace
+        self.bucket_cache = {}
 
     def _slug_to_key(self, slug) -> str:
+        if self.namespace:
+            return f"dmv:bucket:{self.namespace}:{slug}"
         return f"dmv:bucket:{slug}"
 
     def lookup_slug_bucket(self, slug):
@@ -60,11 +70,12 @@ class RateLimiter:
         bucket.limit = limit
         bucket.window = window
         bucket.BUCKET_HASH = hash
-        self.set_bucket(
-            slug,
-            current,
-            timeout
-        )
+        with timed('redis'):
+            self.set_bucket(
+                slug,
+                current,
+                timeout
+            )
         logger.info(f"RATES: {slug}/{hash}, {current}/{limit} ({timeout}/{window}s)")
 
     def init_bucket(self, bucket: RateLimitBucket) -> None:
@@ -85,10 +96,21 @@ class RateLimiter:
             )
         )
 
-    def get_timeout(self, bucket: RateLimitBucket) -> int:
+    @staticmethod
+    def reserved_requests(limit: int, reserve: float) -> int:
+        """Number of requests of a limit that are held back for interactive calls
+
+        At least one request is always left for other calls,
+        so they keep flowing on buckets with a small limit.
+        """
+        if not reserve:
+            return 0
+        return max(0, min(math.ceil(limit * reserve), limit - 1))
+
+    def get_timeout(self, bucket: RateLimitBucket, reserved: int = 0) -> int:
         current_bucket = self.get_bucket(bucket)
-        if current_bucket <= 0:
-            timeout = cache.ttl(self._slug_to_key(bucket.slug)) + 1
+        if current_bucket <= reserved:
+            timeout = cache.ttl(self._slug_to_key(bucket.get_key())) + 1
             msg = (
                 f"Rate limit for bucket '{bucket.slug}':'{bucket.BUCKET_HASH}' exceeded: "
                 f"{current_bucket}/{bucket.limit} in last {bucket.window}s. "
@@ -116,17 +138,56 @@ class RateLimiter:
             timeout=timeout if timeout else bucket.window
         )
 
-    def check_bucket(self, slug: str):
+    def check_bucket(self, slug: str, reserve: float = 0.0):
+        """Raise if the bucket is exhausted
+
+        Params:
+        - reserve: fraction of the bucket that can not be used by this request
+        """
         bucket = self.lookup_slug_bucket(slug)
-        self.init_bucket(bucket)
-        # get the value
-        bucket_val = self.get_bucket(bucket)
-        logger.info(f"RATES: {slug} BV: {bucket_val}")
-        if bucket_val <= 0:
-            timeout = self.get_timeout(bucket)
+        with timed('redis'):
+            self.init_bucket(bucket)
+            # get the value
+            bucket_val = self.get_bucket(bucket)
+        reserved = self.reserved_requests(bucket.limit, reserve)
+        logger.info(f"RATES: {slug} BV: {bucket_val} R: {reserved}")
+        if bucket_val <= reserved:
+            with timed('redis'):
+                timeout = self.get_timeout(bucket, reserved)
             logger.info(f"RATES: {slug} TO: {timeout}")
             if timeout > 0:
-                raise DiscordRateLimitExhausted(bucket, timeout, bucket=bucket.slug)
+                raise DiscordRateLimitExhausted(timeout * 1000, bucket=bucket.slug)
             return
 
+    def check_global(self, limit: int, reserve: float = 0.0):
+        """Count a request against the global rate limit of the bot
+        and raise if the limit is exhausted
+
+        Params:
+        - limit: max requests per second
+        - reserve: fraction of the limit that can not be used by this request
+        """
+        key = self._slug_to_key(self.GLOBAL_SLUG)
+        with timed('redis'):
+            cache.add(key, limit, timeout=1)
+            try:
+                remaining = cache.decr(key)
+            except ValueError:
+                # expired between add and decr, so we are the first in a new window
+                cache.add(key, limit - 1, timeout=1)
+                remaining = limit - 1
+        if remaining < self.reserved_requests(limit, reserve):
+            logger.info(f"RATES: {self.GLOBAL_SLUG} exhausted {remaining}/{limit}")
+            raise DiscordRateLimitExhausted(1000, bucket=self.GLOBAL_SLUG)
+
+
 RateLimits = RateLimiter()
+
+_rate_limiters = {"": RateLimits}
+
+
+def rate_limiter(namespace: str = "") -> RateLimiter:
+    """returns the shared rate limiter of a namespace"""
+    if namespace not in _rate_limiters:
+        _rate_limiters[namespace] = RateLimiter(namespace)
+    return _rate_limiters[namespace]
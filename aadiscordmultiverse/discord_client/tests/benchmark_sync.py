@@ -0,0 +1,303 @@
+"""This script benchmarks syncing users with Discord against a local fake Discord API.
+
+It runs update_groups, bulk syncs and add_user with different numbers of
+parallel workers and reports throughput, p50 / p99 latency and the rate of 429s.
+No Discord server or bot token is needed, so it can be used to compare
+the performance of changes.
+
+This script is design to be run manually as unit test, e.g. by running the following:
+
+python runtests.py aadiscordmultiverse.discord_client.tests.benchmark_sync
+
+The load profile can be adjusted with these environment variables:
+- DMV_BENCHMARK_WORKERS: comma separated numbers of parallel workers, e.g. "1,4,16"
+- DMV_BENCHMARK_USERS: number of users to sync
+- DMV_BENCHMARK_LATENCY: seconds each response of the fake API is delayed
+
+Results are printed and also written to a special log file.
+"""
+
+import os
+import threading
+from queue import Empty, Queue
+from time import perf_counter, sleep
+from unittest.mock import patch
+
+from django_redis import get_redis_connection
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connections
+from django.test import TransactionTestCase
+
+from allianceauth.tests.auth_utils import AuthUtils
+
+from ... import tasks
+from ...bulk import BulkWorkQueue
+from ...models import DiscordManagedServer, MultiDiscordUser
+from ...utils import set_logger_to_file
+from .. import DiscordApiBackoff, DiscordClient
+from .fake_discord_api import USER_TOKEN_PREFIX, FakeDiscordApi
+
+logger = set_logger_to_file(
+    'aadiscordmultiverse.discord_client.tests.benchmark_sync', __file__
+)
+
+WORKER_COUNTS = [
+    int(num) for num in os.environ.get('DMV_BENCHMARK_WORKERS', '1,4,16').split(',')
+]
+NUMBER_OF_USERS = int(os.environ.get('DMV_BENCHMARK_USERS', 100))
+LATENCY_SECS = float(os.environ.get('DMV_BENCHMARK_LATENCY', 0.02))
+
+NUMBER_OF_GUILDS = 2
+NUMBER_OF_GROUPS = 5
+BULK_BATCH_SIZE = 10
+FIRST_GUILD_ID = 100000000000000000
+FIRST_DISCORD_USER_ID = 200000000000000000
+
+MANAGER_PATH = 'aadiscordmultiverse.managers.MultiDiscordUserManager'
+
+
+class BulkRetry(Exception):
+    """Stands in for the retry of a bulk task by Celery"""
+
+    def __init__(self, kwargs: dict, countdown: int) -> None:
+        super().__init__()
+        self.kwargs = kwargs
+        self.countdown = countdown
+
+
+def bulk_retry(kwargs, countdown):
+    raise BulkRetry(kwargs, countdown)
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, workers: int) -> None:
+        self.name = name
+        self.workers = workers
+        self.latencies = list()
+        self.backoffs = 0
+        self.errors = 0
+        self.duration = 0.0
+        self.requests = 0
+        self.rate_limited = 0
+
+    def __str__(self) -> str:
+        ops = len(self.latencies)
+        return (
+            f'{self.name:<14} workers: {self.workers:>3}  ops: {ops:>5}  '
+            f'throughput: {ops / self.duration if self.duration else 0:>7.1f}/s  '
+            f'p50: {percentile(self.latencies, 0.5) * 1000 if ops else 0:>7.1f} ms  '
+            f'p99: {percentile(self.latencies, 0.99) * 1000 if ops else 0:>7.1f} ms  '
+            f'requests: {self.requests:>5}  '
+            f'429s: {self.rate_limited / self.requests * 100 if self.requests else 0:>5.1f}%  '
+            f'backoffs: {self.backoffs:>4}  errors: {self.errors:>3}'
+        )
+
+
+@patch(
+    MANAGER_PATH + '._exchange_auth_code_for_token',
+    staticmethod(lambda authorization_code, bot_name='': authorization_code)
+)
+class TestBenchmarkSync(TransactionTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake_api = FakeDiscordApi(latency=LATENCY_SECS)
+        cls.base_url_patcher = patch(
+            'aadiscordmultiverse.discord_client.client.DISCORD_API_BASE_URL',
+            cls.fake_api.start()
+        )
+        cls.base_url_patcher.start()
+        cls.results = list()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.base_url_patcher.stop()
+        cls.fake_api.stop()
+        print()
+        for result in cls.results:
+            print(result)
+            logger.info('%s', result)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.access_group = Group.objects.create(name='benchmark access')
+        AuthUtils.add_permissions_to_groups(
+            [AuthUtils.get_permission_by_name('aadiscordmultiverse.access_discord_multiverse')],
+            [self.access_group]
+        )
+        self.groups = [
+            Group.objects.create(name=f'group {num}') for num in range(NUMBER_OF_GROUPS)
+        ]
+        self.guilds = list()
+        for num in range(NUMBER_OF_GUILDS):
+            guild = DiscordManagedServer.objects.create(
+                guild_id=FIRST_GUILD_ID + num,
+                server_name=f'guild {num}',
+                sync_names=True,
+                include_all_managed_groups=False
+            )
+            guild.included_groups.add(*self.groups)
+            guild.group_access.add(self.access_group)
+            self.guilds.append(guild)
+        self.users = list()
+        for num in range(NUMBER_OF_USERS):
+            user = AuthUtils.create_member(f'benchmark_user_{num}')
+            AuthUtils.add_main_character_2(user, f'Benchmark Character {num}', 1000 + num)
+            user.groups.add(self.access_group, *self.groups[num % 3:num % 3 + 2])
+            self.users.append(user)
+
+    def _reset_fake_api(self, with_members: bool) -> None:
+        self.fake_api.reset_stats()
+        for guild in self.guilds:
+            self.fake_api.add_guild(guild.guild_id)
+            if with_members:
+                for num in range(NUMBER_OF_USERS):
+                    self.fake_api.add_member(guild.guild_id, FIRST_DISCORD_USER_ID + num)
+
+    def _create_discord_users(self) -> None:
+        MultiDiscordUser.objects.all().delete()
+        MultiDiscordUser.objects.bulk_create([
+            MultiDiscordUser(guild=guild, user=user, uid=FIRST_DISCORD_USER_ID + num)
+            for guild in self.guilds
+            for num, user in enumerate(self.users)
+        ])
+
+    @staticmethod
+    def _reset_redis() -> None:
+        redis = get_redis_connection("default")
+        for pattern in ('DISCORD_*', 'dmv:bulk:*'):
+            for key in redis.scan_iter(pattern):
+                redis.delete(key)
+        cache.delete_pattern('dmv:bucket:*')
+        DiscordClient._shared_clients.clear()
+
+    def _run(self, name: str, workers: int, work_items: list, func) -> BenchmarkResult:
+        """runs func for all work items with the given number of parallel workers
+        and waits out backoffs, like a retried task would
+
+        Returning False or raising counts as error
+        """
+        result = BenchmarkResult(name, workers)
+        work = Queue()
+        for item in work_items:
+            work.put(item)
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        item = work.get_nowait()
+                    except Empty:
+                        return
+                    started = perf_counter()
+                    while True:
+                        try:
+                            success = func(item)
+                        except DiscordApiBackoff as bo:
+                            with lock:
+                                result.backoffs += 1
+                            sleep(bo.retry_after / 1000)
+                            continue
+                        except BulkRetry as retry:
+                            with lock:
+                                result.backoffs += 1
+                            item = retry.kwargs
+                            sleep(retry.countdown)
+                            continue
+                        except Exception:
+                            logger.exception('%s failed for %s', name, item)
+                            with lock:
+                                result.errors += 1
+                        else:
+                            if success is False:
+                                with lock:
+                                    result.errors += 1
+                        break
+                    with lock:
+                        result.latencies.append(perf_counter() - started)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        started = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result.duration = perf_counter() - started
+        result.requests = self.fake_api.requests
+        result.rate_limited = self.fake_api.rate_limited
+        self.results.append(result)
+        logger.info('%s', result)
+        return result
+
+    def test_update_groups(self):
+        self._create_discord_users()
+        for workers in WORKER_COUNTS:
+            self._reset_redis()
+            self._reset_fake_api(with_members=True)
+            discord_users = list(
+                MultiDiscordUser.objects.select_related('user__profile__state', 'guild')
+            )
+
+            self._run(
+                'update_groups',
+                workers,
+                discord_users,
+                lambda discord_user: discord_user.update_groups()
+            )
+
+    def test_bulk_sync(self):
+        # the task proxy would resolve to another app in the worker threads
+        run_bulk_items = tasks.run_bulk_items._get_current_object()
+        self._create_discord_users()
+        for workers in WORKER_COUNTS:
+            self._reset_redis()
+            self._reset_fake_api(with_members=True)
+            queue = BulkWorkQueue()
+            for guild in self.guilds:
+                queue.push(guild.guild_id, [
+                    (method, user.pk)
+                    for user in self.users
+                    for method in ('update_groups', 'update_nickname')
+                ])
+            batches = list()
+            while queue.has_work():
+                for guild_id, items in queue.pop_round_robin(BULK_BATCH_SIZE).items():
+                    batches.append({'guild_id': guild_id, 'items': items})
+
+            with patch.object(run_bulk_items, 'retry', side_effect=bulk_retry):
+                self._run(
+                    'bulk_sync',
+                    workers,
+                    batches,
+                    lambda kwargs: run_bulk_items(**kwargs)
+                )
+
+    def test_add_user(self):
+        for workers in WORKER_COUNTS:
+            MultiDiscordUser.objects.all().delete()
+            self._reset_redis()
+            self._reset_fake_api(with_members=False)
+            guild = self.guilds[0]
+
+            self._run(
+                'add_user',
+                workers,
+                list(enumerate(self.users)),
+                lambda item: MultiDiscordUser.objects.add_user(
+                    user=item[1],
+                    authorization_code=f'{USER_TOKEN_PREFIX}{FIRST_DISCORD_USER_ID + item[0]}',
+                    guild=guild,
+                    is_interactive=True
+                )
+            )
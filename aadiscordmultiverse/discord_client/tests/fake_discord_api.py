@@ -0,0 +1,367 @@
+"""A local stand-in for the Discord API to run the client against offline.
+
+It keeps the roles and members of guilds in memory and emulates the rate limits
+of Discord: Every route has a bucket per guild, responses carry the
+x-ratelimit-* headers and exceeding a bucket or the global limit
+results in a 429 with retry_after. Latency can be added to every response.
+
+Users authenticate with the token "user-<user_id>".
+"""
+
+import json
+import random
+import re
+import threading
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from urllib.parse import parse_qs, urlsplit
+
+USER_TOKEN_PREFIX = 'user-'
+
+# method, route, bucket
+ROUTES = [
+    ('GET', r'users/@me', 'GET users/@me'),
+    ('GET', r'guilds/(?P<guild_id>\d+)', 'GET guilds/{guild_id}'),
+    ('GET', r'guilds/(?P<guild_id>\d+)/roles', 'GET guilds/{guild_id}/roles'),
+    ('POST', r'guilds/(?P<guild_id>\d+)/roles', 'POST guilds/{guild_id}/roles'),
+    (
+        'DELETE',
+        r'guilds/(?P<guild_id>\d+)/roles/(?P<role_id>\d+)',
+        'DELETE guilds/{guild_id}/roles/{role_id}'
+    ),
+    ('GET', r'guilds/(?P<guild_id>\d+)/members', 'GET guilds/{guild_id}/members'),
+    (
+        'GET',
+        r'guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)',
+        'GET guilds/{guild_id}/members/{user_id}'
+    ),
+    (
+        'PUT',
+        r'guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)',
+        'PUT guilds/{guild_id}/members/{user_id}'
+    ),
+    (
+        'PATCH',
+        r'guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)',
+        'PATCH guilds/{guild_id}/members/{user_id}'
+    ),
+    (
+        'DELETE',
+        r'guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)',
+        'DELETE guilds/{guild_id}/members/{user_id}'
+    ),
+    (
+        'PUT',
+        r'guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)/roles/(?P<role_id>\d+)',
+        'PUT guilds/{guild_id}/members/{user_id}/roles/{role_id}'
+    ),
+    (
+        'DELETE',
+        r'guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)/roles/(?P<role_id>\d+)',
+        'DELETE guilds/{guild_id}/members/{user_id}/roles/{role_id}'
+    ),
+]
+
+DISCORD_STATUS_CODE_UNKNOWN_MEMBER = 10007
+
+
+class FakeDiscordApi:
+    """In memory Discord API served over HTTP on localhost
+
+    Params:
+    - bucket_limit: requests per window of every bucket
+    - bucket_window: seconds after which a bucket resets
+    - global_limit: requests per second across all routes
+    - latency: seconds every response is delayed
+    - latency_jitter: max random seconds added to the latency
+    """
+
+    def __init__(
+        self,
+        bucket_limit: int = 10,
+        bucket_window: float = 1.0,
+        global_limit: int = 50,
+        latency: float = 0.02,
+        latency_jitter: float = 0.01
+    ) -> None:
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.global_limit = global_limit
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self._routes = [
+            (method, re.compile(f'^{pattern}$'), bucket) for method, pattern, bucket in ROUTES
+        ]
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._next_id = 900000000000000000
+        self.roles = dict()
+        self.members = dict()
+        self._buckets = dict()
+        self.reset_stats()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/api/'
+
+    def start(self) -> str:
+        """starts serving in a background thread and returns the base URL"""
+        api = self
+
+        class Handler(FakeDiscordApiHandler):
+            fake_api = api
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.rate_limited = 0
+            self._buckets.clear()
+
+    def add_guild(self, guild_id: int, role_names: list = None) -> None:
+        with self._lock:
+            self.roles[guild_id] = {
+                str(guild_id): self._role(guild_id, '@everyone')
+            }
+            self.members[guild_id] = dict()
+        for name in role_names or []:
+            self.create_role(guild_id, name)
+
+    def add_member(self, guild_id: int, user_id: int, role_ids: list = None, nick=None) -> dict:
+        member = {
+            'user': {'id': str(user_id), 'username': f'user{user_id}', 'discriminator': '0'},
+            'nick': nick,
+            'roles': [str(role_id) for role_id in role_ids or []],
+        }
+        with self._lock:
+            self.members[guild_id][str(user_id)] = member
+        return member
+
+    def create_role(self, guild_id: int, name: str) -> dict:
+        with self._lock:
+            self._next_id += 1
+            role = self._role(self._next_id, name)
+            self.roles[guild_id][role['id']] = role
+        return role
+
+    @staticmethod
+    def _role(role_id: int, name: str) -> dict:
+        return {'id': str(role_id), 'name': name, 'managed': False}
+
+    def match_route(self, method: str, route: str) -> tuple:
+        """returns the bucket and params of a route or None"""
+        for route_method, pattern, bucket in self._routes:
+            match = pattern.match(route)
+            if route_method == method and match:
+                return bucket, match.groupdict()
+        return None, None
+
+    def take_request(self, bucket: str, major: str) -> tuple:
+        """counts a request against the global limit and its bucket
+
+        Buckets are kept per major parameter, i.e. per guild or token
+
+        Returns the retry after in seconds or None and the rate limit headers
+        """
+        now = time()
+        with self._lock:
+            self.requests += 1
+            global_remaining, global_reset = self._take(('global',), self.global_limit, 1.0, now)
+            if global_remaining is None:
+                self.rate_limited += 1
+                return global_reset - now, True, {'x-ratelimit-global': 'true'}
+            remaining, reset_at = self._take(
+                (bucket, major), self.bucket_limit, self.bucket_window, now
+            )
+            headers = {
+                'x-ratelimit-limit': str(self.bucket_limit),
+                'x-ratelimit-remaining': str(remaining or 0),
+                'x-ratelimit-reset': f'{reset_at:.3f}',
+                'x-ratelimit-reset-after': f'{reset_at - now:.3f}',
+                'x-ratelimit-bucket': md5(bucket.encode('utf-8')).hexdigest()[:16],
+            }
+            if remaining is None:
+                self.rate_limited += 1
+                return reset_at - now, False, headers
+        return None, False, headers
+
+    def _take(self, key: tuple, limit: int, window: float, now: float) -> tuple:
+        """returns the remaining requests or None when exhausted and the reset"""
+        remaining, reset_at = self._buckets.get(key, (limit, now + window))
+        if reset_at <= now:
+            remaining, reset_at = limit, now + window
+        if remaining <= 0:
+            return None, reset_at
+        self._buckets[key] = (remaining - 1, reset_at)
+        return remaining - 1, reset_at
+
+    def delay(self) -> None:
+        sleep(self.latency + random.uniform(0, self.latency_jitter))
+
+
+class FakeDiscordApiHandler(BaseHTTPRequestHandler):
+    fake_api = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method: str) -> None:
+        api = self.fake_api
+        url = urlsplit(self.path)
+        route = url.path[len('/api/'):]
+        length = int(self.headers.get('content-length') or 0)
+        data = json.loads(self.rfile.read(length)) if length else dict()
+        bucket, params = api.match_route(method, route)
+        api.delay()
+        if not bucket:
+            self._respond(404, {'message': '404: Not Found', 'code': 0})
+            return
+
+        retry_after, is_global, headers = api.take_request(
+            bucket, params.get('guild_id') or self.headers.get('authorization', '')
+        )
+        if retry_after is not None:
+            headers['retry-after'] = str(max(1, round(retry_after)))
+            self._respond(
+                429,
+                {
+                    'message': 'You are being rate limited.',
+                    'retry_after': round(retry_after, 3),
+                    'global': is_global
+                },
+                headers
+            )
+            return
+
+        handler = getattr(self, f'_{bucket.split()[0].lower()}_{self._route_name(bucket)}')
+        status, body = handler(api, params, data, parse_qs(url.query))
+        self._respond(status, body, headers)
+
+    @staticmethod
+    def _route_name(bucket: str) -> str:
+        return re.sub(r'\W+', '_', bucket.split(' ', 1)[1].replace('@', '')).strip('_')
+
+    def _respond(self, status: int, body, headers: dict = None) -> None:
+        content = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _member(self, api, params) -> dict:
+        return api.members.get(int(params['guild_id']), dict()).get(params['user_id'])
+
+    @staticmethod
+    def _unknown_member() -> tuple:
+        return 404, {'message': 'Unknown Member', 'code': DISCORD_STATUS_CODE_UNKNOWN_MEMBER}
+
+    def _get_users_me(self, api, params, data, query):
+        token = self.headers.get('authorization', '').split(' ')[-1]
+        if not token.startswith(USER_TOKEN_PREFIX):
+            return 401, {'message': '401: Unauthorized', 'code': 0}
+        user_id = token[len(USER_TOKEN_PREFIX):]
+        return 200, {'id': user_id, 'username': f'user{user_id}', 'discriminator': '0'}
+
+    def _get_guilds_guild_id(self, api, params, data, query):
+        return 200, {'id': params['guild_id'], 'name': f'Guild {params["guild_id"]}'}
+
+    def _get_guilds_guild_id_roles(self, api, params, data, query):
+        return 200, list(api.roles[int(params['guild_id'])].values())
+
+    def _post_guilds_guild_id_roles(self, api, params, data, query):
+        return 200, api.create_role(int(params['guild_id']), data.get('name', 'new role'))
+
+    def _delete_guilds_guild_id_roles_role_id(self, api, params, data, query):
+        api.roles[int(params['guild_id'])].pop(params['role_id'], None)
+        return 204, None
+
+    def _get_guilds_guild_id_members(self, api, params, data, query):
+        limit = int(query.get('limit', ['1'])[0])
+        after = int(query.get('after', ['0'])[0])
+        members = sorted(
+            (
+                member for member in api.members[int(params['guild_id'])].values()
+                if int(member['user']['id']) > after
+            ),
+            key=lambda member: int(member['user']['id'])
+        )
+        return 200, members[:limit]
+
+    def _get_guilds_guild_id_members_user_id(self, api, params, data, query):
+        member = self._member(api, params)
+        return (200, member) if member else self._unknown_member()
+
+    def _put_guilds_guild_id_members_user_id(self, api, params, data, query):
+        if self._member(api, params):
+            return 204, None
+        member = api.add_member(
+            int(params['guild_id']),
+            int(params['user_id']),
+            role_ids=data.get('roles'),
+            nick=data.get('nick')
+        )
+        return 201, member
+
+    def _patch_guilds_guild_id_members_user_id(self, api, params, data, query):
+        member = self._member(api, params)
+        if not member:
+            return self._unknown_member()
+        if 'roles' in data:
+            member['roles'] = [str(role_id) for role_id in data['roles']]
+        if 'nick' in data:
+            member['nick'] = data['nick']
+        return 200, member
+
+    def _delete_guilds_guild_id_members_user_id(self, api, params, data, query):
+        if not self._member(api, params):
+            return self._unknown_member()
+        api.members[int(params['guild_id'])].pop(params['user_id'])
+        return 204, None
+
+    def _put_guilds_guild_id_members_user_id_roles_role_id(self, api, params, data, query):
+        member = self._member(api, params)
+        if not member:
+            return self._unknown_member()
+        if params['role_id'] not in member['roles']:
+            member['roles'].append(params['role_id'])
+        return 204, None
+
+    def _delete_guilds_guild_id_members_user_id_roles_role_id(self, api, params, data, query):
+        member = self._member(api, params)
+        if not member:
+            return self._unknown_member()
+        if params['role_id'] in member['roles']:
+            member['roles'].remove(params['role_id'])
+        return 204, None
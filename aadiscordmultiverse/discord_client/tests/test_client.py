@@ -1,19 +1,26 @@
 import json
+from time import time
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
 import requests
 import requests_mock
+from django_redis import get_redis_connection
 from redis import Redis
 from requests.exceptions import HTTPError
 
+from django.core.cache import cache
+
 from allianceauth import __title__ as AUTH_TITLE, __url__, __version__
 
 from ...utils import set_logger_to_file
 from ..client import (
     DEFAULT_BACKOFF_DELAY, DURATION_CONTINGENCY, DiscordClient, DiscordRoles,
 )
-from ..exceptions import DiscordRateLimitExhausted, DiscordTooManyRequestsError
+from ..exceptions import (
+    DiscordCircuitOpen, DiscordRateLimitExhausted, DiscordTooManyRequestsError,
+)
+from ..rate_limiting import RateLimits
 from . import (
     ALL_ROLES, ROLE_ALPHA, ROLE_BRAVO, TEST_BOT_TOKEN, TEST_GUILD_ID,
     TEST_ROLE_ID, TEST_USER_ID, TEST_USER_NAME, create_matched_role,
@@ -259,6 +266,120 @@ class TestGuildMember(TestCase):
         with self.assertRaises(HTTPError):
             self.client.guild_member(TEST_GUILD_ID, TEST_USER_ID)
 
+    def test_return_guild_member_from_cache(self, requests_mocker):
+        expected = create_user_info()
+        my_mock_redis = MagicMock(**{'get.return_value': json.dumps(expected).encode()})
+        client = DiscordClient2(TEST_BOT_TOKEN, my_mock_redis)
+
+        result = client.guild_member(TEST_GUILD_ID, TEST_USER_ID)
+
+        self.assertDictEqual(result, expected)
+        self.assertFalse(requests_mocker.called)
+
+    def test_cache_guild_member_from_api(self, requests_mocker):
+        expected = create_user_info()
+        requests_mocker.get(
+            f'{API_BASE_URL}guilds/{TEST_GUILD_ID}/members/{TEST_USER_ID}',
+            request_headers=self.headers,
+            json=expected
+        )
+        my_mock_redis = MagicMock(**{'get.return_value': None, 'pttl.return_value': -1})
+        client = DiscordClient2(TEST_BOT_TOKEN, my_mock_redis)
+
+        client.guild_member(TEST_GUILD_ID, TEST_USER_ID)
+
+        _, kwargs = my_mock_redis.set.call_args
+        self.assertEqual(
+            kwargs['name'],
+            DiscordClient._guild_member_cache_key(TEST_GUILD_ID, TEST_USER_ID)
+        )
+        self.assertDictEqual(json.loads(kwargs['value']), expected)
+
+    def test_ignore_cache_if_requested(self, requests_mocker):
+        expected = create_user_info()
+        requests_mocker.get(
+            f'{API_BASE_URL}guilds/{TEST_GUILD_ID}/members/{TEST_USER_ID}',
+            request_headers=self.headers,
+            json=expected
+        )
+        my_mock_redis = MagicMock(**{
+            'get.return_value': json.dumps({'user': {}}).encode(),
+            'pttl.return_value': -1,
+        })
+        client = DiscordClient2(TEST_BOT_TOKEN, my_mock_redis)
+
+        result = client.guild_member(TEST_GUILD_ID, TEST_USER_ID, use_cache=False)
+
+        self.assertDictEqual(result, expected)
+
+
+@requests_mock.Mocker()
+class TestGuildNicksSnapshot(TestCase):
+
+    def setUp(self):
+        self.redis = get_redis_connection("default")
+        self.client = DiscordClient2(TEST_BOT_TOKEN, self.redis)
+        self.redis.delete(DiscordClient._guild_nicks_cache_key(TEST_GUILD_ID))
+        self.redis.delete(DiscordClient._guild_member_cache_key(TEST_GUILD_ID, 1))
+        self.redis.delete(DiscordClient._guild_member_cache_key(TEST_GUILD_ID, 3))
+
+    @patch(MODULE_PATH + '.DiscordClient._GUILD_MEMBERS_MAX_LIMIT', 2)
+    def test_snapshot_fetches_all_pages(self, requests_mocker):
+        url = f'{API_BASE_URL}guilds/{TEST_GUILD_ID}/members?limit=2&after='
+        requests_mocker.get(url + '0', json=[
+            {'user': create_user_info(1), 'nick': 'alpha'},
+            {'user': create_user_info(2), 'nick': None},
+        ])
+        requests_mocker.get(url + '2', json=[
+            {'user': create_user_info(3), 'nick': 'charlie'},
+        ])
+
+        self.assertEqual(self.client.snapshot_guild_nicks(TEST_GUILD_ID), 3)
+
+        self.assertTrue(self.client.guild_member_has_nick(
+            TEST_GUILD_ID, 1, 'alpha', use_snapshot=True
+        ))
+        self.assertTrue(self.client.guild_member_has_nick(
+            TEST_GUILD_ID, 2, '', use_snapshot=True
+        ))
+        self.assertFalse(self.client.guild_member_has_nick(
+            TEST_GUILD_ID, 3, 'bravo', use_snapshot=True
+        ))
+        self.assertFalse(self.client.guild_member_has_nick(
+            TEST_GUILD_ID, 4, 'delta', use_snapshot=True
+        ))
+        self.assertFalse(self.client.guild_member_has_nick(TEST_GUILD_ID, 1, 'alpha'))
+
+        self.client.delete_guild_nicks_snapshot(TEST_GUILD_ID)
+
+        self.assertFalse(self.client.guild_member_has_nick(
+            TEST_GUILD_ID, 1, 'alpha', use_snapshot=True
+        ))
+
+    def test_modified_nick_is_no_longer_known(self, requests_mocker):
+        self.redis.hset(
+            DiscordClient._guild_nicks_cache_key(TEST_GUILD_ID), '1', 'alpha'
+        )
+        requests_mocker.patch(
+            f'{API_BASE_URL}guilds/{TEST_GUILD_ID}/members/1', status_code=204
+        )
+
+        self.client.modify_guild_member(TEST_GUILD_ID, 1, nick='bravo')
+
+        self.assertFalse(
+            self.client.guild_member_has_nick(TEST_GUILD_ID, 1, 'alpha', use_snapshot=True)
+        )
+
+    def test_member_cache_is_preferred(self, requests_mocker):
+        self.redis.hset(
+            DiscordClient._guild_nicks_cache_key(TEST_GUILD_ID), '1', 'alpha'
+        )
+        self.client._set_guild_member_cache(
+            TEST_GUILD_ID, 1, {'user': create_user_info(1), 'nick': 'bravo'}
+        )
+
+        self.assertTrue(self.client.guild_member_has_nick(TEST_GUILD_ID, 1, 'bravo'))
+
 
 class TestGuildGetName(TestCase):
 
@@ -609,6 +730,28 @@ class TestGuildModifyMember(TestCase):
         )
         self.assertTrue(result)
 
+    def test_can_update_nick_and_cache_returned_member(self, requests_mocker):
+        member = create_user_info()
+        requests_mocker.register_uri(
+            'patch',
+            self.request_url,
+            request_headers=self.headers,
+            status_code=200,
+            json=member
+        )
+        my_mock_redis = MagicMock(**{'get.return_value': None, 'pttl.return_value': -1})
+        client = DiscordClient2(TEST_BOT_TOKEN, my_mock_redis)
+
+        result = client.modify_guild_member(
+            guild_id=TEST_GUILD_ID,
+            user_id=TEST_USER_ID,
+            nick=TEST_USER_NAME
+        )
+
+        self.assertTrue(result)
+        _, kwargs = my_mock_redis.set.call_args
+        self.assertDictEqual(json.loads(kwargs['value']), member)
+
     def test_returns_none_if_member_is_unknown(self, requests_mocker):
 
         def data_matcher(request):
@@ -641,7 +784,7 @@ class TestGuildModifyMember(TestCase):
             self.request_url,
             request_headers=self.headers,
             additional_matcher=data_matcher,
-            status_code=200,
+            status_code=202,
         )
         result = self.client.modify_guild_member(
             guild_id=TEST_GUILD_ID,
@@ -1046,6 +1189,303 @@ class TestApiRequestBasics(TestCase):
             self.client._api_request('xxx', 'users/@me')
 
 
+@patch(MODULE_PATH + '.DMV_API_RETRY_BUDGET', 5.0)
+@patch(MODULE_PATH + '.DMV_API_RETRY_MAX', 2)
+@patch(MODULE_PATH + '.sleep')
+@requests_mock.Mocker()
+class TestApiRequestRetries(TestCase):
+
+    def setUp(self):
+        self.client = DiscordClient2(TEST_BOT_TOKEN, mock_redis)
+        self.url = f'{API_BASE_URL}users/@me'
+
+    def test_retries_idempotent_request_on_5xx(self, mock_sleep, requests_mocker):
+        requests_mocker.get(self.url, [
+            {'status_code': 502},
+            {'status_code': 200, 'json': {'id': 1}},
+        ])
+
+        r = self.client._api_request('get', 'users/@me')
+
+        self.assertEqual(r.json(), {'id': 1})
+        self.assertEqual(requests_mocker.call_count, 2)
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_retries_on_timeout(self, mock_sleep, requests_mocker):
+        requests_mocker.get(self.url, [
+            {'exc': requests.exceptions.ConnectTimeout},
+            {'status_code': 200, 'json': {'id': 1}},
+        ])
+
+        r = self.client._api_request('get', 'users/@me')
+
+        self.assertEqual(r.json(), {'id': 1})
+
+    def test_gives_up_after_max_retries(self, mock_sleep, requests_mocker):
+        requests_mocker.get(self.url, status_code=503)
+
+        with self.assertRaises(HTTPError):
+            self.client._api_request('get', 'users/@me')
+        self.assertEqual(requests_mocker.call_count, 3)
+
+    def test_does_not_retry_post(self, mock_sleep, requests_mocker):
+        requests_mocker.post(self.url, exc=requests.exceptions.ConnectionError)
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.client._api_request('post', 'users/@me')
+        self.assertEqual(requests_mocker.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    def test_stops_when_budget_is_spent(self, mock_sleep, requests_mocker):
+        requests_mocker.get(self.url, status_code=500)
+
+        with patch(MODULE_PATH + '.DMV_API_RETRY_BUDGET', 0.0), \
+                self.assertRaises(HTTPError):
+            self.client._api_request('get', 'users/@me')
+        self.assertEqual(requests_mocker.call_count, 1)
+
+    def test_delay_grows_exponentially_with_jitter(self, mock_sleep, requests_mocker):
+        for attempt in range(5):
+            delay = DiscordClient._retry_delay('get', 0, 0.0)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, 0.25)
+        self.assertIsNone(DiscordClient._retry_delay('get', 2, 0.0))
+
+
+class TestRouteTimeouts(TestCase):
+
+    @patch(MODULE_PATH + '.DISCORD_API_TIMEOUT_READ', 30)
+    @patch(MODULE_PATH + '.DISCORD_API_TIMEOUT_CONNECT', 3)
+    def test_default_timeouts(self):
+        self.assertEqual(DiscordClient._route_timeout('GET guilds/{guild_id}'), (3, 30))
+
+    @patch(MODULE_PATH + '.DISCORD_API_TIMEOUT_CONNECT', 3)
+    def test_built_in_route_timeouts(self):
+        self.assertEqual(
+            DiscordClient._route_timeout('GET guilds/{guild_id}/members'), (3, 60)
+        )
+        self.assertEqual(
+            DiscordClient._route_timeout('PATCH guilds/{guild_id}/members/{user_id}'),
+            (3, 10)
+        )
+
+    @patch(MODULE_PATH + '.DMV_API_ROUTE_TIMEOUTS', {
+        'GET guilds/{guild_id}/members': 120,
+        'GET guilds/{guild_id}': (1, 2),
+    })
+    @patch(MODULE_PATH + '.DISCORD_API_TIMEOUT_CONNECT', 3)
+    def test_route_timeouts_from_settings(self):
+        self.assertEqual(
+            DiscordClient._route_timeout('GET guilds/{guild_id}/members'), (3, 120)
+        )
+        self.assertEqual(DiscordClient._route_timeout('GET guilds/{guild_id}'), (1, 2))
+
+    @patch(MODULE_PATH + '.DISCORD_API_TIMEOUT_READ', 30)
+    @patch(MODULE_PATH + '.DISCORD_API_TIMEOUT_CONNECT', 3)
+    @patch(MODULE_PATH + '.requests.get')
+    def test_request_uses_route_timeout(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {}
+        client = DiscordClient(TEST_BOT_TOKEN, mock_redis, is_rate_limited=False)
+
+        client._api_request('get', 'guilds/1/members', bucket='GET guilds/{guild_id}/members')
+
+        _, kwargs = mock_get.call_args
+        self.assertEqual(kwargs['timeout'], (3, 60))
+
+
+@patch(MODULE_PATH + '.DMV_CIRCUIT_BREAKER_COOLDOWN', 30)
+@patch(MODULE_PATH + '.DMV_CIRCUIT_BREAKER_THRESHOLD', 2)
+@requests_mock.Mocker()
+class TestCircuitBreaker(TestCase):
+
+    def setUp(self):
+        self.redis = get_redis_connection("default")
+        self.redis.delete(
+            DiscordClient._KEY_CIRCUIT_FAILURES,
+            DiscordClient._KEY_CIRCUIT_OPEN,
+            DiscordClient._KEY_CIRCUIT_PROBE,
+        )
+        self.client = DiscordClient(TEST_BOT_TOKEN, self.redis, is_rate_limited=False)
+        self.url = f'{API_BASE_URL}users/@me'
+
+    def test_trips_after_consecutive_failures(self, requests_mocker):
+        requests_mocker.get(self.url, status_code=502)
+        for _ in range(2):
+            with self.assertRaises(HTTPError):
+                self.client._api_request('get', 'users/@me')
+
+        with self.assertRaises(DiscordCircuitOpen) as cm:
+            self.client._api_request('get', 'users/@me')
+        self.assertGreater(cm.exception.retry_after, 0)
+        self.assertEqual(requests_mocker.call_count, 2)
+
+    def test_success_resets_failures(self, requests_mocker):
+        requests_mocker.get(self.url, [
+            {'status_code': 502},
+            {'status_code': 200, 'json': {}},
+            {'status_code': 502},
+            {'status_code': 200, 'json': {}},
+        ])
+        for _ in range(2):
+            with self.assertRaises(HTTPError):
+                self.client._api_request('get', 'users/@me')
+            self.client._api_request('get', 'users/@me')
+
+    def test_lets_single_probe_through_after_cooldown(self, requests_mocker):
+        requests_mocker.get(self.url, json={})
+        self.redis.set(DiscordClient._KEY_CIRCUIT_FAILURES, 2)
+        self.redis.set(DiscordClient._KEY_CIRCUIT_PROBE, 1, px=10000)
+
+        # another worker is probing
+        with self.assertRaises(DiscordCircuitOpen):
+            self.client._api_request('get', 'users/@me')
+
+        self.redis.delete(DiscordClient._KEY_CIRCUIT_PROBE)
+        self.client._api_request('get', 'users/@me')
+
+        # probe succeeded, circuit is closed again
+        self.assertFalse(self.redis.exists(DiscordClient._KEY_CIRCUIT_FAILURES))
+        self.client._api_request('get', 'users/@me')
+
+    def test_failed_probe_opens_circuit_again(self, requests_mocker):
+        requests_mocker.get(self.url, exc=requests.exceptions.ConnectTimeout)
+        self.redis.set(DiscordClient._KEY_CIRCUIT_FAILURES, 2)
+
+        with self.assertRaises(requests.exceptions.ConnectTimeout):
+            self.client._api_request('get', 'users/@me')
+
+        self.assertGreater(self.redis.pttl(DiscordClient._KEY_CIRCUIT_OPEN), 0)
+        self.assertFalse(self.redis.exists(DiscordClient._KEY_CIRCUIT_PROBE))
+
+
+@patch(MODULE_PATH + '.DMV_RATE_LIMIT_PACING_MAX_SLEEP', 2.0)
+@patch(MODULE_PATH + '.DMV_RATE_LIMIT_PACING', True)
+@patch(MODULE_PATH + '.sleep')
+@requests_mock.Mocker()
+class TestRateLimitPacing(TestCase):
+
+    def setUp(self):
+        self.redis = get_redis_connection("default")
+        for key in self.redis.scan_iter('DISCORD_PACE_*'):
+            self.redis.delete(key)
+        cache.delete_pattern("dmv:bucket:*")
+        RateLimits.bucket_cache.clear()
+        self.client = DiscordClient(TEST_BOT_TOKEN, self.redis)
+        self.route = f'guilds/{TEST_GUILD_ID}/members/{TEST_USER_ID}'
+        self.bucket = 'PATCH guilds/{guild_id}/members/{user_id}'
+
+    def _mock_response(self, requests_mocker, remaining, reset_after):
+        requests_mocker.patch(
+            f'{API_BASE_URL}{self.route}',
+            status_code=204,
+            headers={
+                'x-ratelimit-limit': '10',
+                'x-ratelimit-remaining': str(remaining),
+                'x-ratelimit-reset-after': str(reset_after),
+                'x-ratelimit-reset': str(time() + reset_after),
+            }
+        )
+
+    def test_spaces_requests_across_window(self, mock_sleep, requests_mocker):
+        self._mock_response(requests_mocker, remaining=4, reset_after=2.0)
+
+        # the first response tells the interval, the second request takes the
+        # current slot and the others wait for theirs, as no time passes here
+        for _ in range(4):
+            self.client._api_request('patch', self.route, bucket=self.bucket)
+
+        waits = [args[0] for args, _ in mock_sleep.call_args_list]
+        self.assertEqual(len(waits), 2)
+        self.assertAlmostEqual(waits[0], 0.5, delta=0.1)
+        self.assertAlmostEqual(waits[1], 1.0, delta=0.1)
+
+    def test_raises_when_next_slot_is_far(self, mock_sleep, requests_mocker):
+        self._mock_response(requests_mocker, remaining=0, reset_after=10.0)
+        self.client._api_request('patch', self.route, bucket=self.bucket)
+
+        with self.assertRaises(DiscordRateLimitExhausted) as cm:
+            self.client._pace_request('test', self.bucket, self.route)
+        self.assertGreater(cm.exception.retry_after, 9000)
+        mock_sleep.assert_not_called()
+
+    def test_does_not_pace_interactive_requests(self, mock_sleep, requests_mocker):
+        self._mock_response(requests_mocker, remaining=4, reset_after=2.0)
+        client = DiscordClient(TEST_BOT_TOKEN, self.redis, is_interactive=True)
+
+        for _ in range(3):
+            client._api_request('patch', self.route, bucket=self.bucket)
+
+        mock_sleep.assert_not_called()
+
+    def test_paces_guilds_separately(self, mock_sleep, requests_mocker):
+        self._mock_response(requests_mocker, remaining=0, reset_after=10.0)
+        self.client._api_request('patch', self.route, bucket=self.bucket)
+
+        self.client._pace_request('test', self.bucket, f'guilds/1/members/{TEST_USER_ID}')
+
+
+class TestSharedClient(TestCase):
+
+    def setUp(self):
+        DiscordClient._shared_clients.clear()
+
+    def tearDown(self):
+        DiscordClient._shared_clients.clear()
+
+    def test_returns_same_client_for_same_token_and_options(self):
+        client = DiscordClient.shared(TEST_BOT_TOKEN)
+
+        self.assertIs(DiscordClient.shared(TEST_BOT_TOKEN), client)
+        self.assertEqual(client.access_token, TEST_BOT_TOKEN)
+
+    @patch(MODULE_PATH + '.get_redis_connection')
+    def test_sets_up_client_once(self, mock_get_redis_connection):
+        mock_get_redis_connection.return_value = MagicMock(spec=Redis)
+
+        for _ in range(3):
+            DiscordClient.shared(TEST_BOT_TOKEN)
+
+        self.assertEqual(mock_get_redis_connection.call_count, 1)
+
+    def test_returns_own_client_for_other_token_or_options(self):
+        client = DiscordClient.shared(TEST_BOT_TOKEN)
+
+        self.assertIsNot(DiscordClient.shared('other-token'), client)
+        self.assertIsNot(DiscordClient.shared(TEST_BOT_TOKEN, is_interactive=True), client)
+        self.assertIsNot(DiscordClient.shared(TEST_BOT_TOKEN, is_rate_limited=False), client)
+        self.assertIsNot(
+            DiscordClient.shared(TEST_BOT_TOKEN, rate_limit_namespace='big'), client
+        )
+
+
+class TestRateLimitNamespace(TestCase):
+
+    def setUp(self):
+        self.redis = get_redis_connection("default")
+        self.redis.delete(
+            DiscordClient._KEY_GLOBAL_BACKOFF_UNTIL,
+            f'{DiscordClient._KEY_GLOBAL_BACKOFF_UNTIL}:big',
+        )
+
+    def test_backoff_is_kept_per_namespace(self):
+        client_big = DiscordClient(TEST_BOT_TOKEN, self.redis, rate_limit_namespace='big')
+        client_default = DiscordClient(TEST_BOT_TOKEN, self.redis)
+        self.redis.set(f'{DiscordClient._KEY_GLOBAL_BACKOFF_UNTIL}:big', 1, px=10000)
+
+        with self.assertRaises(DiscordTooManyRequestsError):
+            client_big._handle_ongoing_api_backoff('test')
+        client_default._handle_ongoing_api_backoff('test')
+
+    def test_default_client_keeps_keys(self):
+        client = DiscordClient(TEST_BOT_TOKEN, self.redis)
+
+        self.assertEqual(
+            client._rate_limit_key(DiscordClient._KEY_GLOBAL_BACKOFF_UNTIL),
+            DiscordClient._KEY_GLOBAL_BACKOFF_UNTIL
+        )
+
+
 @patch(MODULE_PATH + '.DiscordClient._redis_decr_or_set')
 @requests_mock.Mocker()
 class TestRateLimitMechanic(TestCase):
@@ -0,0 +1,157 @@
+from time import time
+from unittest.mock import patch
+
+import requests_mock
+from django_redis import get_redis_connection
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from ..client import DiscordClient
+from ..exceptions import DiscordRateLimitExhausted, DiscordTooManyRequestsError
+from ..metrics import Metrics, metrics
+from ..rate_limiting import RateLimits
+from . import TEST_BOT_TOKEN, TEST_GUILD_ID, TEST_USER_ID
+
+MODULE_PATH = 'aadiscordmultiverse.discord_client.metrics'
+API_BASE_URL = 'https://discord.com/api/'
+TEST_BUCKET = 'PATCH guilds/{guild_id}/members/{user_id}'
+
+
+@patch(MODULE_PATH + '.DMV_METRICS_ENABLED', True)
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_counters_add_up(self):
+        metrics.inc('dmv_task_results_total', guild_id=1, result='success')
+        metrics.inc('dmv_task_results_total', 2, guild_id=1, result='success')
+        metrics.inc('dmv_discord_api_backoff_seconds_total', 1.5, reason='rate_limit')
+
+        self.assertEqual(
+            metrics.samples(),
+            {
+                'dmv_task_results_total{guild_id="1",result="success"}': 3.0,
+                'dmv_discord_api_backoff_seconds_total{reason="rate_limit"}': 1.5,
+            }
+        )
+
+    def test_histogram_counts_cumulative_buckets(self):
+        metrics.observe('dmv_discord_api_request_duration_seconds', 0.3, buckets=(0.1, 0.5, 1.0))
+        metrics.observe('dmv_discord_api_request_duration_seconds', 0.7, buckets=(0.1, 0.5, 1.0))
+
+        samples = metrics.samples()
+        name = 'dmv_discord_api_request_duration_seconds'
+        self.assertNotIn(f'{name}_bucket{{le="0.1"}}', samples)
+        self.assertEqual(samples[f'{name}_bucket{{le="0.5"}}'], 1)
+        self.assertEqual(samples[f'{name}_bucket{{le="1.0"}}'], 2)
+        self.assertEqual(samples[f'{name}_bucket{{le="+Inf"}}'], 2)
+        self.assertEqual(samples[f'{name}_count'], 2)
+        self.assertAlmostEqual(samples[f'{name}_sum'], 1.0)
+
+    def test_export_in_prometheus_format(self):
+        metrics.set('dmv_discord_bucket_remaining', 4, route=TEST_BUCKET)
+        metrics.observe(
+            'dmv_discord_api_request_duration_seconds', 0.2, buckets=(0.1, 10.0), status=200
+        )
+
+        self.assertEqual(
+            metrics.export(),
+            '# HELP dmv_discord_api_request_duration_seconds '
+            'Duration of requests to the Discord API by route and status\n'
+            '# TYPE dmv_discord_api_request_duration_seconds histogram\n'
+            'dmv_discord_api_request_duration_seconds_bucket{status="200",le="10.0"} 1\n'
+            'dmv_discord_api_request_duration_seconds_bucket{status="200",le="+Inf"} 1\n'
+            'dmv_discord_api_request_duration_seconds_count{status="200"} 1\n'
+            'dmv_discord_api_request_duration_seconds_sum{status="200"} 0.2\n'
+            '# HELP dmv_discord_bucket_remaining '
+            'Requests remaining in the rate limit bucket as last reported by Discord\n'
+            '# TYPE dmv_discord_bucket_remaining gauge\n'
+            'dmv_discord_bucket_remaining{route="PATCH guilds/{guild_id}/members/{user_id}"} 4\n'
+        )
+
+    def test_escapes_label_values(self):
+        self.assertEqual(
+            Metrics.sample_name('test', {'route': 'a "b"\\c'}),
+            'test{route="a \\"b\\"\\\\c"}'
+        )
+
+    def test_records_nothing_when_disabled(self):
+        with patch(MODULE_PATH + '.DMV_METRICS_ENABLED', False):
+            metrics.inc('dmv_task_results_total', guild_id=1, result='success')
+
+        self.assertEqual(metrics.samples(), {})
+
+
+@patch(MODULE_PATH + '.DMV_METRICS_ENABLED', True)
+@requests_mock.Mocker()
+class TestClientMetrics(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.redis = get_redis_connection("default")
+        for key in self.redis.scan_iter('DISCORD_*'):
+            self.redis.delete(key)
+        cache.delete_pattern("dmv:bucket:*")
+        RateLimits.bucket_cache.clear()
+        self.client = DiscordClient(TEST_BOT_TOKEN, self.redis)
+        self.route = f'guilds/{TEST_GUILD_ID}/members/{TEST_USER_ID}'
+
+    def test_records_request_and_bucket(self, requests_mocker):
+        requests_mocker.patch(
+            f'{API_BASE_URL}{self.route}',
+            status_code=204,
+            headers={
+                'x-ratelimit-limit': '10',
+                'x-ratelimit-remaining': '7',
+                'x-ratelimit-reset-after': '1.0',
+                'x-ratelimit-reset': str(time() + 1.0),
+            }
+        )
+
+        self.client._api_request('patch', self.route, bucket=TEST_BUCKET)
+
+        samples = metrics.samples()
+        labels = f'route="{TEST_BUCKET}",status="204"'
+        self.assertEqual(
+            samples[f'dmv_discord_api_request_duration_seconds_count{{{labels}}}'], 1
+        )
+        self.assertEqual(samples[f'dmv_discord_bucket_remaining{{route="{TEST_BUCKET}"}}'], 7)
+        self.assertEqual(samples[f'dmv_discord_bucket_limit{{route="{TEST_BUCKET}"}}'], 10)
+
+    def test_records_429_and_backoff(self, requests_mocker):
+        requests_mocker.patch(
+            f'{API_BASE_URL}{self.route}',
+            status_code=429,
+            headers={'x-ratelimit-scope': 'shared'},
+            json={'retry_after': 1500}
+        )
+
+        with self.assertRaises(DiscordTooManyRequestsError):
+            self.client._api_request('patch', self.route, bucket=TEST_BUCKET)
+
+        samples = metrics.samples()
+        self.assertEqual(
+            samples[
+                f'dmv_discord_api_rate_limited_total{{route="{TEST_BUCKET}",scope="shared"}}'
+            ],
+            1
+        )
+        labels = f'reason="too_many_requests",route="{TEST_BUCKET}"'
+        self.assertEqual(samples[f'dmv_discord_api_backoffs_total{{{labels}}}'], 1)
+        self.assertEqual(samples[f'dmv_discord_api_backoff_seconds_total{{{labels}}}'], 2.0)
+
+    def test_records_exhausted_rate_limit(self, requests_mocker):
+        RateLimits.update_slug_bucket(TEST_BUCKET, 10, 10, current=0, timeout=10)
+
+        with self.assertRaises(DiscordRateLimitExhausted):
+            self.client._api_request('patch', self.route, bucket=TEST_BUCKET)
+
+        self.assertEqual(
+            metrics.samples()[
+                f'dmv_discord_api_backoffs_total{{reason="rate_limit",route="{TEST_BUCKET}"}}'
+            ],
+            1
+        )
+        self.assertFalse(requests_mocker.called)
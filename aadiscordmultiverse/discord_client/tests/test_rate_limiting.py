@@ -0,0 +1,91 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from ..exceptions import DiscordRateLimitExhausted
+from ..rate_limiting import RateLimiter, RateLimits, rate_limiter
+
+TEST_SLUG = 'PATCH guilds/{guild_id}/members/{user_id}'
+
+
+class TestInteractiveReserve(TestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter()
+        self.limiter.bucket_cache.clear()
+        cache.delete_pattern("dmv:bucket:*")
+
+    def test_reserved_requests(self):
+        self.assertEqual(RateLimiter.reserved_requests(10, 0.2), 2)
+        self.assertEqual(RateLimiter.reserved_requests(5, 0.2), 1)
+        self.assertEqual(RateLimiter.reserved_requests(5, 0.0), 0)
+
+    def test_reserved_requests_leave_one_request_on_small_buckets(self):
+        self.assertEqual(
+            [RateLimiter.reserved_requests(limit, 0.2) for limit in range(1, 5)],
+            [0, 1, 1, 1]
+        )
+        self.assertEqual(
+            [RateLimiter.reserved_requests(limit, 0.9) for limit in range(1, 5)],
+            [0, 1, 2, 3]
+        )
+
+    def test_bulk_request_can_use_bucket_of_one(self):
+        self.limiter.update_slug_bucket(TEST_SLUG, 1, 1, current=1, timeout=10)
+
+        self.limiter.check_bucket(TEST_SLUG, reserve=0.2)
+
+    def test_bulk_request_can_not_use_reserve(self):
+        self.limiter.update_slug_bucket(TEST_SLUG, 10, 10, current=2, timeout=10)
+
+        with self.assertRaises(DiscordRateLimitExhausted) as cm:
+            self.limiter.check_bucket(TEST_SLUG, reserve=0.2)
+        self.assertGreater(cm.exception.retry_after, 0)
+
+    def test_interactive_request_can_use_reserve(self):
+        self.limiter.update_slug_bucket(TEST_SLUG, 10, 10, current=2, timeout=10)
+
+        self.limiter.check_bucket(TEST_SLUG)
+
+    def test_bulk_request_can_use_bucket_above_reserve(self):
+        self.limiter.update_slug_bucket(TEST_SLUG, 10, 10, current=3, timeout=10)
+
+        self.limiter.check_bucket(TEST_SLUG, reserve=0.2)
+
+    def test_global_limit_keeps_reserve_for_interactive(self):
+        for _ in range(8):
+            self.limiter.check_global(10, reserve=0.2)
+
+        with self.assertRaises(DiscordRateLimitExhausted):
+            self.limiter.check_global(10, reserve=0.2)
+
+        self.limiter.check_global(10)
+        with self.assertRaises(DiscordRateLimitExhausted):
+            self.limiter.check_global(10)
+
+
+class TestRateLimitNamespaces(TestCase):
+
+    def setUp(self):
+        cache.delete_pattern("dmv:bucket:*")
+
+    def test_returns_shared_limiter_per_namespace(self):
+        self.assertIs(rate_limiter(), RateLimits)
+        self.assertIs(rate_limiter('big'), rate_limiter('big'))
+        self.assertIsNot(rate_limiter('big'), RateLimits)
+
+    def test_namespaces_have_own_buckets(self):
+        limiter_big = RateLimiter('big')
+        limiter_small = RateLimiter('small')
+        limiter_big.update_slug_bucket(TEST_SLUG, 10, 10, current=0, timeout=10)
+
+        with self.assertRaises(DiscordRateLimitExhausted):
+            limiter_big.check_bucket(TEST_SLUG)
+        limiter_small.check_bucket(TEST_SLUG)
+
+    def test_namespaces_have_own_global_limit(self):
+        limiter_big = RateLimiter('big')
+        limiter_big.check_global(1)
+
+        with self.assertRaises(DiscordRateLimitExhausted):
+            limiter_big.check_global(1)
+        RateLimiter().check_global(1)
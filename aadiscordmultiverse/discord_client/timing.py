@@ -0,0 +1,24 @@
+"""Timing hooks for the profiling of sync tasks
+
+The client marks its HTTP requests, the Redis calls of rate limits, pacing,
+backoffs and metrics and its blocking sleeps with `timed`. These are only
+measured while a task profile is active in the current context,
+all other calls only pay for a context lookup.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# profile of the task running in the current context, set while it is sampled
+current_profile = ContextVar('dmv_task_profile', default=None)
+
+
+@contextmanager
+def timed(category: str):
+    """Time the enclosed call for the profile of the current task, if any"""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.timing(category):
+        yield
@@ -1,6 +1,10 @@
+from itertools import islice
+from time import monotonic
+
 from django.conf import settings
 from django.contrib.auth.models import Group, Permission, User
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
 from allianceauth.authentication.models import State
 from allianceauth.eveonline.models import (
@@ -34,10 +38,25 @@ class Command(BaseCommand):
             help="Delete old discord users if they have been migrated. requires --migrateusers",
         )
 
+        parser.add_argument(
+            "--batch",
+            action="store_true",
+            help="Migrate the users in batches, each batch in one transaction. For large installs",
+        )
+
+        parser.add_argument(
+            "--batchsize",
+            type=int,
+            default=1000,
+            help="Number of users per batch with --batch",
+        )
+
     def handle(self, *args, **options):
         create_server = options["createserver"]
         migrate_users = options["migrateusers"]
         delete_users = options["deleteusers"]
+        batch = options["batch"]
+        batch_size = options["batchsize"]
 
         if not create_server and not migrate_users:
             self.stderr.write(f"you need to define atleast one option... ")
@@ -50,6 +69,10 @@ class Command(BaseCommand):
             self.stderr.write(f"    --deleteusers  - requires --migrateusers")
             return
 
+        if batch_size < 1:
+            self.stderr.write("    --batchsize  - needs to be at least 1")
+            return
+
         self.stdout.write("Running checks!")
         # discord options
         DISCORD_GUILD_ID = getattr(settings, "DISCORD_GUILD_ID", False)
@@ -79,14 +102,26 @@ class Command(BaseCommand):
                 if states.exists():
                     self.stdout.write(f"Adding perms for {states.count()} found states to the new server")
                     dmv.state_access.set(states)
-                    for state in states:
-                        state.permissions.add(perm_dmv)
+                    StatePermission = State.permissions.through
+                    StatePermission.objects.bulk_create(
+                        [
+                            StatePermission(state_id=state_id, permission_id=perm_dmv.pk)
+                            for state_id in states.values_list("pk", flat=True).distinct()
+                        ],
+                        ignore_conflicts=True,
+                    )
 
                 if groups.exists():
                     self.stdout.write(f"Adding perms for {groups.count()} found groups to the new server")
                     dmv.group_access.set(groups)
-                    for group in groups:
-                        group.permissions.add(perm_dmv)
+                    GroupPermission = Group.permissions.through
+                    GroupPermission.objects.bulk_create(
+                        [
+                            GroupPermission(group_id=group_id, permission_id=perm_dmv.pk)
+                            for group_id in groups.values_list("pk", flat=True).distinct()
+                        ],
+                        ignore_conflicts=True,
+                    )
 
             else:
                 self.stderr.write("Discord Guild ID already exists, we cant make it again.")
@@ -96,33 +131,35 @@ class Command(BaseCommand):
                         guild_id=DISCORD_GUILD_ID
                 )
                 discord_users = DiscordUser.objects.all()
-                self.stdout.write(f"Starting migration of {discord_users.count()} users")
+                total = discord_users.count()
+                self.stdout.write(f"Starting migration of {total} users")
                 if delete_users:
                     self.stdout.write(f"WILL delete the old discord service users")
                 else:
                     self.stdout.write(f"WILL NOT delete the old discord service users. to do this re-run the script with `--deleteusers`")
-                skipped=0
-                for du in discord_users:
-                    dmvu = MultiDiscordUser.objects.filter(
-                        guild_id=DISCORD_GUILD_ID,
-                        uid=du.uid
-                    )
-                    if not dmvu.exists():
-                        MultiDiscordUser.objects.create(
-                            guild=dmv,
-                            user=du.user,
-                            uid=du.uid,
-                            username=du.username,
-                            discriminator=du.discriminator,
-                            activated=du.activated
+                if batch:
+                    self._migrate_users_batched(dmv, total, delete_users, batch_size)
+                else:
+                    skipped=0
+                    for du in discord_users:
+                        dmvu = MultiDiscordUser.objects.filter(
+                            guild_id=DISCORD_GUILD_ID,
+                            uid=du.uid
                         )
-                    else:
-                        skipped += 1
+                        if not dmvu.exists():
+                            MultiDiscordUser.objects.create(
+                                guild=dmv,
+                                user=du.user,
+                                uid=du.uid,
+                                username=du.username,
+                                discriminator=du.discriminator,
+                                activated=du.activated
+                            )
+                        else:
+                            skipped += 1
                         if delete_users:
                             du.delete()
-                    if delete_users:
-                        du.delete()
-                self.stdout.write(f"Finished migration of users, Skipped creation of {skipped} existing users")
+                    self.stdout.write(f"Finished migration of users, Skipped creation of {skipped} existing users")
             else:
                 self.stdout.write(f"Skipping users, to migrate users use `--migrateusers`")
         else:
@@ -130,3 +167,59 @@ class Command(BaseCommand):
 
         self.stdout.write(f"Completed migration, you can diable the inbuilt discord service now.")
         self.stdout.write(f"Please verify/adjust the configuration from the auth admin interface.")
+
+    def _migrate_users_batched(
+        self, dmv, total: int, delete_users: bool, batch_size: int
+    ):
+        """Migrate the discord users in batches
+
+        Existing users of the server are skipped by their uid. Each batch is
+        created and deleted in one transaction, so an interrupted run
+        can be repeated and continues with the users left.
+        """
+        existing_uids = set(
+            MultiDiscordUser.objects.filter(guild=dmv).values_list("uid", flat=True)
+        )
+        legacy_users = (
+            DiscordUser.objects
+            .order_by("pk")
+            .values_list("pk", "uid", "username", "discriminator", "activated")
+            .iterator(chunk_size=batch_size)
+        )
+        created = skipped = processed = 0
+        started = monotonic()
+        while True:
+            rows = list(islice(legacy_users, batch_size))
+            if not rows:
+                break
+            new_users = list()
+            for user_id, uid, username, discriminator, activated in rows:
+                if uid in existing_uids:
+                    skipped += 1
+                    continue
+                existing_uids.add(uid)
+                new_users.append(
+                    MultiDiscordUser(
+                        guild=dmv,
+                        user_id=user_id,
+                        uid=uid,
+                        username=username,
+                        discriminator=discriminator,
+                        activated=activated
+                    )
+                )
+            with transaction.atomic():
+                MultiDiscordUser.objects.bulk_create(new_users, ignore_conflicts=True)
+                if delete_users:
+                    DiscordUser.objects.filter(pk__in=[row[0] for row in rows]).delete()
+            created += len(new_users)
+            processed += len(rows)
+            elapsed = monotonic() - started
+            self.stdout.write(
+                f"Migrated {processed}/{total} users - {processed / elapsed:.0f} users/s"
+                if elapsed else f"Migrated {processed}/{total} users"
+            )
+        self.stdout.write(
+            f"Finished migration of users in {monotonic() - started:.1f}s, "
+            f"Created {created} users, Skipped creation of {skipped} existing users"
+        )
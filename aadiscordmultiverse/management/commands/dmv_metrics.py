@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from ...discord_client.metrics import metrics
+
+
+class Command(BaseCommand):
+    help = 'Print the metrics of Discord API calls and sync tasks in the Prometheus format'
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Clear all metrics after printing them",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(metrics.export(), ending='')
+        if options["reset"]:
+            metrics.reset()
+            self.stderr.write("Metrics have been reset")
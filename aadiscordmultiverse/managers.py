@@ -1,4 +1,6 @@
 import logging
+from datetime import timedelta
+from typing import Iterable, NamedTuple, Optional
 from urllib.parse import urlencode
 
 from requests.exceptions import HTTPError
@@ -6,17 +8,19 @@ from requests_oauthlib import OAuth2Session
 
 from django.conf import settings
 from django.contrib.auth.models import Group, User
+from django.core.cache import cache
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils.functional import cached_property
 from django.utils.timezone import now
 
-from allianceauth.eveonline.models import (
-    EveAllianceInfo, EveCorporationInfo, EveFactionInfo,
-)
 from allianceauth.services.hooks import NameFormatter
+from allianceauth.services.models import NameFormatConfig
 
 from .app_settings import (
     DISCORD_APP_ID, DISCORD_APP_SECRET, DISCORD_BOT_TOKEN,
-    DISCORD_CALLBACK_URL,
+    DISCORD_CALLBACK_URL, DMV_BOTS,
 )
 from .discord_client import DiscordClient
 from .discord_client.exceptions import (
@@ -26,6 +30,77 @@ from .discord_client.helpers import match_or_create_roles_from_names
 
 logger = logging.getLogger(__name__)
 
+# service hooks used for formatting nicknames by guild_id and server name
+_nick_services = dict()
+
+
+class GuildNicknameFormatter:
+    """Formats the nicknames of users on a guild.
+
+    The name format config of a state is only looked up once,
+    so one formatter can format the nicknames of many users.
+    """
+
+    def __init__(self, service) -> None:
+        self.service = service
+        # name format config by state_id
+        self._configs = dict()
+
+    def config(self, state_id: int) -> Optional[NameFormatConfig]:
+        if state_id not in self._configs:
+            self._configs[state_id] = NameFormatConfig.objects.filter(
+                service_name=self.service.name, states__pk=state_id
+            ).first()
+        return self._configs[state_id]
+
+    def format(self, user: User) -> Optional[str]:
+        """returns the formatted nickname of a user or None if the user has no main"""
+        if not user.profile.main_character:
+            return None
+        return _GuildNameFormatter(self, user).format_name()
+
+
+class _GuildNameFormatter(NameFormatter):
+    """NameFormatter using the configs of a GuildNicknameFormatter"""
+
+    def __init__(self, guild_formatter: GuildNicknameFormatter, user: User):
+        super().__init__(guild_formatter.service, user)
+        self._guild_formatter = guild_formatter
+
+    @cached_property
+    def formatter_config(self):
+        return self._guild_formatter.config(self.user.profile.state_id)
+
+
+class BotCredentials(NamedTuple):
+    """Token and application of a bot"""
+    name: str
+    token: str
+    app_id: str
+    app_secret: str
+
+    @classmethod
+    def from_name(cls, bot_name: str = '') -> 'BotCredentials':
+        """returns the credentials of a bot from DMV_BOTS
+        or of the default bot when no or an unknown name is given
+        """
+        if bot_name:
+            bot = DMV_BOTS.get(bot_name)
+            if bot:
+                return cls(
+                    name=bot_name,
+                    token=bot.get('token', ''),
+                    app_id=bot.get('app_id', ''),
+                    app_secret=bot.get('app_secret', '')
+                )
+            logger.error('Bot %s is not configured in DMV_BOTS, using default bot', bot_name)
+        return cls(
+            name='',
+            token=DISCORD_BOT_TOKEN,
+            app_id=DISCORD_APP_ID,
+            app_secret=DISCORD_APP_SECRET
+        )
+
 
 class DiscordManagedServerQuerySet(models.QuerySet):
     def visible_to(self, user):
@@ -47,7 +122,7 @@ class DiscordManagedServerQuerySet(models.QuerySet):
             # States access everyone has a state
             queries.append(
                 models.Q(
-                    state_access=user.profile.state
+                    state_access=user.profile.state_id
                 )
             )
             # Groups access, is ok if no groups.
@@ -64,40 +139,27 @@ class DiscordManagedServerQuerySet(models.QuerySet):
                 )
             )
             # Corp access
-            try:
+            # matched through the join, so no lookups of the corp, alliance
+            # and faction models are needed on every check
+            queries.append(
+                models.Q(
+                    corporation_access__corporation_id=main_character.corporation_id
+                )
+            )
+            # Alliance access if part of an alliance
+            if main_character.alliance_id:
                 queries.append(
                     models.Q(
-                        corporation_access=EveCorporationInfo.objects.get(
-                            corporation_id=main_character.corporation_id
-                        )
+                        alliance_access__alliance_id=main_character.alliance_id
                     )
                 )
-            except EveCorporationInfo.DoesNotExist:
-                pass
-            # Alliance access if part of an alliance
-            try:
-                if main_character.alliance_id:
-                    queries.append(
-                        models.Q(
-                            alliance_access=EveAllianceInfo.objects.get(
-                                alliance_id=main_character.alliance_id
-                            )
-                        )
-                    )
-            except EveAllianceInfo.DoesNotExist:
-                pass
             # Faction access if part of a faction
-            try:
-                if main_character.faction_id:
-                    queries.append(
-                        models.Q(
-                            faction_access=EveFactionInfo.objects.get(
-                                faction_id=main_character.faction_id
-                            )
-                        )
+            if main_character.faction_id:
+                queries.append(
+                    models.Q(
+                        faction_access__faction_id=main_character.faction_id
                     )
-            except EveFactionInfo.DoesNotExist:
-                pass
+                )
 
             logger.debug(
                 f"{len(queries)} queries for {main_character}'s visible characters.")
@@ -138,12 +200,16 @@ class MultiDiscordUserManager(models.Manager):
         'guilds.join',
     ]
 
+    # seconds an access token of an activation is kept for the activation task
+    ACTIVATION_TIMEOUT = 900
+
     def add_user(
         self,
         user: User,
         authorization_code: str,
         is_rate_limited: bool = True,
-        guild=None
+        guild=None,
+        is_interactive: bool = False
     ) -> bool:
         """adds a new Discord user
 
@@ -151,125 +217,171 @@ class MultiDiscordUserManager(models.Manager):
         - user: Auth user to join
         - authorization_code: authorization code returns from oauth
         - is_rate_limited: When False will disable default rate limiting (use with care)
+        - is_interactive: When True may use the rate limit reserved for interactive requests
 
         Returns: True on success, else False or raises exception
         """
         try:
-            if guild.sync_names:
-                nickname = self.user_formatted_nick(user, guild)
-            else:
-                nickname = None
-
-            group_names = self.user_group_names(
+            access_token = self._exchange_auth_code_for_token(
+                authorization_code, bot_name=guild.bot_name)
+            return self.add_user_with_token(
                 user=user,
-                groups_included=guild.get_all_roles_to_sync(),
-                state_name=user.profile.state.name
+                access_token=access_token,
+                guild=guild,
+                is_rate_limited=is_rate_limited,
+                is_interactive=is_interactive
             )
-            access_token = self._exchange_auth_code_for_token(
-                authorization_code)
-            user_client = DiscordClient(
-                access_token, is_rate_limited=is_rate_limited)
-            discord_user = user_client.current_user()
-            user_id = discord_user['id']
-            bot_client = self._bot_client(is_rate_limited=is_rate_limited)
-
-            if not guild.user_can_access_guild(user, guild):
-                return False
-
-            if group_names:
-                role_ids = match_or_create_roles_from_names(
-                    client=bot_client,
-                    guild_id=guild.guild_id,
-                    role_names=group_names
-                ).ids()
-            else:
-                role_ids = None
 
-            logger.info(f"DMV DEBUG: group_names = {group_names}")
-            logger.info(f"DMV DEBUG: role_ids = {role_ids}")
-            logger.info(f"DMV DEBUG: discord_user = {discord_user}")
-            logger.info(f"DMV DEBUG: user_id = {user_id}")
-
-            created = bot_client.add_guild_member(
-                guild_id=guild.guild_id,
-                user_id=user_id,
-                access_token=access_token,
-                role_ids=role_ids,
-                nick=nickname
+        except (HTTPError, ConnectionError, DiscordApiBackoff) as ex:
+            logger.exception(
+                'Failed to add user %s to Discord server: %s', user, ex
             )
-            if created is not False:
-                if created is None:
-                    logger.debug(
-                        "User %s with Discord ID %s is already a member. Forcing a Refresh",
-                        user,
-                        user_id,
-                    )
+            logger.error(f"DMV DEBUG: {vars(ex)}")
+            return False
 
-                    # Force an update cause the discord API won't do it for us.
-                    if role_ids:
-                        role_ids = list(role_ids)
+    def add_user_with_token(
+        self,
+        user: User,
+        access_token: str,
+        guild,
+        is_rate_limited: bool = True,
+        is_interactive: bool = False
+    ) -> bool:
+        """adds a new Discord user with the access token from oauth
 
-                    updated = bot_client.modify_guild_member(
-                        guild_id=guild.guild_id,
-                        user_id=user_id,
-                        role_ids=role_ids,
-                        nick=nickname
-                    )
+        Returns: True on success, else False or raises API exceptions
+        """
+        if guild.sync_names:
+            nickname = self.user_formatted_nick(user, guild)
+        else:
+            nickname = None
 
-                    if not updated:
-                        # Could not update the new user so fail.
-                        logger.warning(
-                            "Failed to add user %s with Discord ID %s to Discord server",
-                            user,
-                            user_id,
-                        )
-                        return False
-
-                self.update_or_create(
-                    user=user,
-                    guild=guild,
-                    defaults={
-                        'uid': user_id,
-                        'username': discord_user['username'][:32],
-                        'discriminator': discord_user['discriminator'][:4],
-                        'activated': now()
-                    }
-                )
-                logger.info(
-                    "Added user %s with Discord ID %s to Discord server", user, user_id
-                )
-                return True
+        group_names = self.user_group_names(
+            user=user,
+            groups_included=guild.get_all_roles_to_sync(),
+            state_name=user.profile.state.name
+        )
+        user_client = DiscordClient(
+            access_token,
+            is_rate_limited=is_rate_limited,
+            is_interactive=is_interactive
+        )
+        discord_user = user_client.current_user()
+        user_id = discord_user['id']
+        bot_client = self._bot_client(
+            is_rate_limited=is_rate_limited,
+            is_interactive=is_interactive,
+            bot_name=guild.bot_name
+        )
+
+        if not guild.user_can_access_guild(user, guild):
+            return False
 
-            else:
-                logger.warning(
-                    "Failed to add user %s with Discord ID %s to Discord server",
+        if group_names:
+            role_ids = match_or_create_roles_from_names(
+                client=bot_client,
+                guild_id=guild.guild_id,
+                role_names=group_names
+            ).ids()
+        else:
+            role_ids = None
+
+        logger.info(f"DMV DEBUG: group_names = {group_names}")
+        logger.info(f"DMV DEBUG: role_ids = {role_ids}")
+        logger.info(f"DMV DEBUG: discord_user = {discord_user}")
+        logger.info(f"DMV DEBUG: user_id = {user_id}")
+
+        created = bot_client.add_guild_member(
+            guild_id=guild.guild_id,
+            user_id=user_id,
+            access_token=access_token,
+            role_ids=role_ids,
+            nick=nickname
+        )
+        if created is not False:
+            if created is None:
+                logger.debug(
+                    "User %s with Discord ID %s is already a member. Forcing a Refresh",
                     user,
                     user_id,
                 )
-                return False
 
-        except (HTTPError, ConnectionError, DiscordApiBackoff) as ex:
-            logger.exception(
-                'Failed to add user %s to Discord server: %s', user, ex
+                # Force an update cause the discord API won't do it for us.
+                if role_ids:
+                    role_ids = list(role_ids)
+
+                updated = bot_client.modify_guild_member(
+                    guild_id=guild.guild_id,
+                    user_id=user_id,
+                    role_ids=role_ids,
+                    nick=nickname
+                )
+
+                if not updated:
+                    # Could not update the new user so fail.
+                    logger.warning(
+                        "Failed to add user %s with Discord ID %s to Discord server",
+                        user,
+                        user_id,
+                    )
+                    return False
+
+            self.update_or_create(
+                user=user,
+                guild=guild,
+                defaults={
+                    'uid': user_id,
+                    'username': discord_user['username'][:32],
+                    'discriminator': discord_user['discriminator'][:4],
+                    'activated': now()
+                }
+            )
+            logger.info(
+                "Added user %s with Discord ID %s to Discord server", user, user_id
+            )
+            return True
+
+        else:
+            logger.warning(
+                "Failed to add user %s with Discord ID %s to Discord server",
+                user,
+                user_id,
             )
-            logger.error(f"DMV DEBUG: {vars(ex)}")
             return False
 
-    @staticmethod
-    def user_formatted_nick(user: User, guild) -> str:
+    def user_formatted_nick(self, user: User, guild) -> str:
         """returns the name of the given users main character with name formatting
         or None if user has no main
         """
+        return self.nickname_formatter(guild).format(user)
+
+    def user_formatted_nicks(self, users: Iterable[User], guild) -> dict:
+        """returns the formatted nicknames of many users by user pk
+
+        Users should come with their profile and main character selected.
+        """
+        formatter = self.nickname_formatter(guild)
+        return {user.pk: formatter.format(user) for user in users}
 
-        if user.profile.main_character:
+    @staticmethod
+    def nickname_formatter(guild) -> GuildNicknameFormatter:
+        """returns a new nickname formatter for a guild"""
+        key = (guild.guild_id, guild.server_name)
+        service = _nick_services.get(key)
+        if service is None:
             from aadiscordmultiverse.auth_hooks import \
                 MultiDiscordService  # nopep8
 
-            tmp_type = type(
-                f"MultiDiscordService{guild.guild_id}", (MultiDiscordService,), {}, gid=guild.guild_id, guild_name=guild.server_name)
-            return NameFormatter(tmp_type(), user).format_name()
-        else:
-            return None
+            service_class = type(
+                f"MultiDiscordService{guild.guild_id}",
+                (MultiDiscordService,),
+                {},
+                gid=guild.guild_id,
+                guild_name=guild.server_name
+            )
+            service = service_class()
+            _nick_services[key] = service
+        return GuildNicknameFormatter(service)
 
     @staticmethod
     def user_group_names(user: User, groups_included=Group.objects.none(), state_name: str = None) -> list:
@@ -296,45 +408,77 @@ class MultiDiscordUserManager(models.Manager):
         return self.filter(user=user, guild_id=guild_id).exists()
 
     @classmethod
-    def generate_bot_add_url(cls) -> str:
+    def generate_bot_add_url(cls, bot_name: str = '') -> str:
         params = urlencode({
-            'client_id': DISCORD_APP_ID,
+            'client_id': BotCredentials.from_name(bot_name).app_id,
             'scope': 'bot applications.commands',
             'permissions': str(cls.BOT_PERMISSIONS)
 
         })
         return f'{DiscordClient.OAUTH_BASE_URL}?{params}'
 
-    def generate_oauth_redirect_url(self, guild_id) -> str:
+    def generate_oauth_redirect_url(self, guild_id, bot_name: str = '') -> str:
         oauth = OAuth2Session(
-            DISCORD_APP_ID, redirect_uri=DISCORD_CALLBACK_URL, scope=self.SCOPES
+            BotCredentials.from_name(bot_name).app_id,
+            redirect_uri=DISCORD_CALLBACK_URL,
+            scope=self.SCOPES
         )
         url, state = oauth.authorization_url(
             DiscordClient.OAUTH_BASE_URL, state=guild_id)
         return url
 
     @staticmethod
-    def _exchange_auth_code_for_token(authorization_code: str) -> str:
+    def _exchange_auth_code_for_token(authorization_code: str, bot_name: str = '') -> str:
+        bot = BotCredentials.from_name(bot_name)
         oauth = OAuth2Session(
-            DISCORD_APP_ID, redirect_uri=DISCORD_CALLBACK_URL)
+            bot.app_id, redirect_uri=DISCORD_CALLBACK_URL)
         token = oauth.fetch_token(
             DiscordClient.OAUTH_TOKEN_URL,
-            client_secret=DISCORD_APP_SECRET,
+            client_secret=bot.app_secret,
             code=authorization_code
         )
         logger.debug("Received token from OAuth")
         return token['access_token']
 
+    def start_activation(self, user: User, authorization_code: str, guild) -> None:
+        """Exchange the authorization code for an access token and keep the token
+        for the activation task, which adds the user to the guild.
+        Raises the exceptions of the exchange.
+        """
+        access_token = self._exchange_auth_code_for_token(
+            authorization_code, bot_name=guild.bot_name)
+        cache.set(
+            self._activation_key(guild.guild_id, user.pk),
+            access_token,
+            timeout=self.ACTIVATION_TIMEOUT
+        )
+
+    def activation_token(self, guild_id: int, user_pk: int) -> Optional[str]:
+        """returns the access token of a pending activation or None"""
+        return cache.get(self._activation_key(guild_id, user_pk))
+
+    def activation_pending(self, user: User, guild_id: int) -> bool:
+        """True while an activation of the user is waiting for its task"""
+        return self.activation_token(guild_id, user.pk) is not None
+
+    def finish_activation(self, guild_id: int, user_pk: int) -> None:
+        cache.delete(self._activation_key(guild_id, user_pk))
+
+    @staticmethod
+    def _activation_key(guild_id: int, user_pk: int) -> str:
+        return f'dmv:activation:{guild_id}:{user_pk}'
+
     @classmethod
-    def server_name(cls, gid, use_cache: bool = True) -> str:
+    def server_name(cls, gid, use_cache: bool = True, bot_name: str = '') -> str:
         """returns the name of the current Discord server
         or an empty string if the name could not be retrieved
 
         Params:
         - use_cache: When set False will force an API call to get the server name
+        - bot_name: Name of the bot the server is managed by
         """
         try:
-            server_name = cls._bot_client().guild_name(
+            server_name = cls._bot_client(bot_name=bot_name).guild_name(
                 guild_id=gid, use_cache=use_cache
             )
         except (HTTPError, DiscordClientException):
@@ -360,6 +504,60 @@ class MultiDiscordUserManager(models.Manager):
     #     )
 
     @staticmethod
-    def _bot_client(is_rate_limited: bool = True) -> DiscordClient:
-        """returns a bot client for access to the Discord API"""
-        return DiscordClient(DISCORD_BOT_TOKEN, is_rate_limited=is_rate_limited)
+    def _bot_client(
+        is_rate_limited: bool = True, is_interactive: bool = False, bot_name: str = ''
+    ) -> DiscordClient:
+        """returns a bot client for access to the Discord API
+
+        Params:
+        - bot_name: Name of a bot from DMV_BOTS, else the default bot is used
+        """
+        bot = BotCredentials.from_name(bot_name)
+        return DiscordClient.shared(
+            bot.token,
+            is_rate_limited=is_rate_limited,
+            is_interactive=is_interactive,
+            rate_limit_namespace=bot.name
+        )
+
+
+class BulkSyncJobManager(models.Manager):
+    """Manager for BulkSyncJob"""
+
+    def running(self, guild_id: int, name: str):
+        """returns the running job with the given name for a guild or None"""
+        return self.filter(
+            guild_id=guild_id, name=name, status=self.model.Status.RUNNING
+        ).first()
+
+    def stale(self, max_age: int):
+        """returns running jobs that have not made progress in max_age seconds"""
+        return self.filter(
+            status=self.model.Status.RUNNING,
+            updated__lt=now() - timedelta(seconds=max_age)
+        )
+
+    def checkpoint(
+        self, job_pk: int, done: int, failed: int, cursor: int, skipped: int = 0
+    ) -> bool:
+        """Record the progress of a processed batch and finish the job when complete
+
+        Returns True when the job has been finished by this batch
+        """
+        self.filter(pk=job_pk).update(
+            done=F("done") + done,
+            skipped=F("skipped") + skipped,
+            failed=F("failed") + failed,
+            cursor=Greatest(F("cursor"), cursor),
+            updated=now()
+        )
+        return bool(
+            self.filter(
+                pk=job_pk,
+                status=self.model.Status.RUNNING,
+                total__lte=F("done") + F("skipped") + F("failed")
+            ).update(
+                status=self.model.Status.FINISHED,
+                finished=now()
+            )
+        )
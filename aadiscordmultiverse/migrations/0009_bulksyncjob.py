@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aadiscordmultiverse', '0008_serveractivefilter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkSyncJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Bulk task that started this job', max_length=64)),
+                ('methods', models.CharField(help_text='Comma separated user methods run for every user', max_length=128)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('finished', 'Finished')], db_index=True, default='running', max_length=16)),
+                ('total', models.PositiveIntegerField(default=0, help_text='Number of work items in this job')),
+                ('done', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('cursor', models.PositiveIntegerField(default=0, help_text='PK of the last user checkpointed')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('finished', models.DateTimeField(blank=True, default=None, null=True)),
+                ('guild', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='aadiscordmultiverse.discordmanagedserver')),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aadiscordmultiverse', '0009_bulksyncjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulksyncjob',
+            name='skipped',
+            field=models.PositiveIntegerField(default=0, help_text='Work items that found nothing to change'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aadiscordmultiverse', '0010_bulksyncjob_skipped'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discordmanagedserver',
+            name='bot_name',
+            field=models.CharField(blank=True, default='', help_text='Name of a dedicated bot from DMV_BOTS that manages this server. Leave empty to use the default bot.', max_length=32),
+        ),
+    ]
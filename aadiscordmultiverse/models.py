@@ -5,6 +5,7 @@ from typing import Union
 from requests.exceptions import HTTPError
 
 from django.contrib.auth.models import Group, User
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import gettext_lazy
 
@@ -15,12 +16,19 @@ from allianceauth.eveonline.models import (
 from allianceauth.groupmanagement.models import ReservedGroupName
 from allianceauth.notifications import notify
 
+from .app_settings import DMV_BOTS
 from .discord_client import DiscordApiBackoff, DiscordClient, DiscordRoles
 from .discord_client.helpers import match_or_create_roles_from_names
-from .managers import DiscordManagedServerManager, MultiDiscordUserManager
+from .managers import (
+    BulkSyncJobManager, DiscordManagedServerManager, MultiDiscordUserManager,
+)
 
 logger = logging.getLogger(__name__)
 
+# returned by updates of MultiDiscordUser that found nothing to change
+# evaluates to True like a successful update
+UNCHANGED = 'unchanged'
+
 
 class DiscordManagedServer(models.Model):
 
@@ -44,6 +52,14 @@ class DiscordManagedServer(models.Model):
         help_text='Sync Auth Main Name to Discord.'
     )
 
+    bot_name = models.CharField(
+        max_length=32,
+        default='',
+        blank=True,
+        help_text='Name of a dedicated bot from DMV_BOTS that manages this server. '
+        'Leave empty to use the default bot.'
+    )
+
     class Meta:
         permissions = (
             ("access_discord_multiverse",
@@ -112,6 +128,12 @@ class DiscordManagedServer(models.Model):
     def __str__(self):
         return f"{self.guild_id}: {self.server_name}"
 
+    def clean(self):
+        if self.bot_name and self.bot_name not in DMV_BOTS:
+            raise ValidationError(
+                {'bot_name': f'Bot {self.bot_name} is not configured in DMV_BOTS.'}
+            )
+
     @classmethod
     def user_can_access_guild(cls, user: User, guild: Union[int, 'DiscordManagedServer']) -> bool:
         """Check if a user can access a guild
@@ -171,14 +193,17 @@ class MultiDiscordUser(models.Model):
     def __repr__(self):
         return f'{type(self).__name__}(user=\'{self.user}\', uid={self.uid})'
 
-    def update_nickname(self, nickname: str = None) -> bool:
+    def update_nickname(self, nickname: str = None, use_snapshot: bool = False) -> bool:
         """Update nickname with formatted name of main character
 
         Params:
         - nickname: optional nickname to be used instead of user's main
+        - use_snapshot: skip the update when the nicks snapshot of the guild
+          already has this nickname, only for the bulk job that took the snapshot
 
         Returns:
         - True on success
+        - UNCHANGED if the user already has this nickname
         - None if user is no longer a member of the Discord server
         - False on error or raises exception
         """
@@ -191,7 +216,15 @@ class MultiDiscordUser(models.Model):
             nickname = MultiDiscordUser.objects.user_formatted_nick(
                 self.user, self.guild)
         if nickname:
-            client = MultiDiscordUser.objects._bot_client()
+            client = MultiDiscordUser.objects._bot_client(bot_name=self.guild.bot_name)
+            if client.guild_member_has_nick(
+                guild_id=self.guild_id,
+                user_id=self.uid,
+                nick=nickname,
+                use_snapshot=use_snapshot
+            ):
+                logger.info('No need to update nickname for user %s', self.user)
+                return UNCHANGED
             success = client.modify_guild_member(
                 guild_id=self.guild_id,
                 user_id=self.uid,
@@ -206,23 +239,92 @@ class MultiDiscordUser(models.Model):
         else:
             return False
 
-    def update_groups(self, state_name: str = None) -> bool:
+    def update_groups(
+        self,
+        state_name: str = None,
+        group_names: list = None,
+        reserved_role_names: list = None
+    ) -> bool:
         """update groups for a user based on his current group memberships.
         Will add or remove roles of a user as needed.
 
         Params:
         - state_name: optional state name to be used
+        - group_names: optional pre-calculated names of all roles the user should have
+        - reserved_role_names: optional pre-loaded names of all reserved groups
 
         Returns:
         - True on success
+        - UNCHANGED if the user already has the correct roles
         - None if user is no longer a member of the Discord server
         - False on error or raises exception
         """
-        client = MultiDiscordUser.objects._bot_client()
+        client = MultiDiscordUser.objects._bot_client(bot_name=self.guild.bot_name)
         member_roles = self._determine_member_roles(client)
         if member_roles is None:
             return None
-        return self._update_roles_if_needed(client, state_name, member_roles)
+        return self._update_roles_if_needed(
+            client, state_name, member_roles, group_names, reserved_role_names
+        )
+
+    def update_groups_delta(self, group_pks: list) -> bool:
+        """Add or remove only the roles of the given groups, so they match the
+        current group memberships of the user. Needs no lookup of the member.
+
+        Groups not synced to this guild are ignored
+        and roles of reserved groups are never removed.
+
+        Params:
+        - group_pks: PKs of the groups that have changed
+
+        Returns:
+        - True on success
+        - None if user is no longer a member of the Discord server
+        - False on error or raises exception
+        """
+        groups = self.guild.get_all_roles_to_sync().filter(pk__in=group_pks).distinct()
+        member_group_pks = set(
+            self.user.groups.filter(pk__in=group_pks).values_list("pk", flat=True)
+        )
+        client = MultiDiscordUser.objects._bot_client(bot_name=self.guild.bot_name)
+        guild_roles = DiscordRoles(client.guild_roles(guild_id=self.guild_id))
+        protected_role_names = {
+            DiscordRoles.sanitize_role_name(name)
+            for name in ReservedGroupName.objects.values_list("name", flat=True)
+        }
+        protected_role_names.add(
+            DiscordRoles.sanitize_role_name(self.user.profile.state.name)
+        )
+        result = True
+        for group in groups:
+            role_name = DiscordRoles.sanitize_role_name(group.name)
+            if group.pk in member_group_pks:
+                role, _ = client.match_or_create_role_from_name(
+                    guild_id=self.guild_id, role_name=role_name, guild_roles=guild_roles
+                )
+                if not role:
+                    continue
+                success = client.add_guild_member_role(
+                    guild_id=self.guild_id, user_id=self.uid, role_id=role['id']
+                )
+            else:
+                role = guild_roles.role_by_name(role_name)
+                if not role or role_name in protected_role_names:
+                    continue
+                success = client.remove_guild_member_role(
+                    guild_id=self.guild_id, user_id=self.uid, role_id=role['id']
+                )
+            if success is None:
+                return None
+            if not success:
+                logger.warning(
+                    'Failed to update role %s for %s', role_name, self.user
+                )
+                result = False
+
+        if result:
+            logger.info('Role changes for %s have been applied', self.user)
+        return result
 
     def _determine_member_roles(self, client: DiscordClient) -> DiscordRoles:
         """Determine the roles of the current member / user."""
@@ -238,6 +340,13 @@ class MultiDiscordUser(models.Model):
                     client.guild_roles(guild_id=self.guild_id, use_cache=False)
                 )
                 if not guild_roles.has_roles(member_info['roles']):
+                    # the cached member may still have roles deleted since
+                    member_info = client.guild_member(
+                        guild_id=self.guild_id, user_id=self.uid, use_cache=False
+                    )
+                    if member_info is None:
+                        return None
+                if not guild_roles.has_roles(member_info.get('roles', [])):
                     raise RuntimeError(
                         'Member {} has unknown roles: {}'.format(
                             self.user,
@@ -249,25 +358,33 @@ class MultiDiscordUser(models.Model):
         raise RuntimeError('member_info from %s is not valid' % self.user)
 
     def _update_roles_if_needed(
-        self, client: DiscordClient, state_name: str, member_roles: DiscordRoles
+        self,
+        client: DiscordClient,
+        state_name: str,
+        member_roles: DiscordRoles,
+        group_names: list = None,
+        reserved_role_names: list = None
     ) -> bool:
         """Update the roles of this member/user if needed."""
-        requested_roles = match_or_create_roles_from_names(
-            client=client,
-            guild_id=self.guild_id,
-            role_names=MultiDiscordUser.objects.user_group_names(
+        if group_names is None:
+            group_names = MultiDiscordUser.objects.user_group_names(
                 user=self.user,
                 groups_included=self.guild.get_all_roles_to_sync(),
                 state_name=state_name
             )
+        requested_roles = match_or_create_roles_from_names(
+            client=client,
+            guild_id=self.guild_id,
+            role_names=group_names
         )
         logger.debug(
             'Requested roles for user %s: %s', self.user, requested_roles.ids()
         )
         logger.debug('Current roles user %s: %s',
                      self.user, member_roles.ids())
-        reserved_role_names = ReservedGroupName.objects.values_list(
-            "name", flat=True)
+        if reserved_role_names is None:
+            reserved_role_names = ReservedGroupName.objects.values_list(
+                "name", flat=True)
         member_roles_reserved = member_roles.subset(
             role_names=reserved_role_names)
         member_roles_managed = member_roles.subset(managed_only=True)
@@ -287,7 +404,7 @@ class MultiDiscordUser(models.Model):
                 logger.warning('Failed to update roles for %s', self.user)
             return success
         logger.info('No need to update roles for user %s', self.user)
-        return True
+        return UNCHANGED
 
     def update_username(self) -> bool:
         """Updates the username incl. the discriminator
@@ -298,7 +415,7 @@ class MultiDiscordUser(models.Model):
         - None if user is no longer a member of the Discord server
         - False on error or raises exception
         """
-        client = MultiDiscordUser.objects._bot_client()
+        client = MultiDiscordUser.objects._bot_client(bot_name=self.guild.bot_name)
         user_info = client.guild_member(
             guild_id=self.guild_id, user_id=self.uid)
         if user_info is None:
@@ -323,7 +440,8 @@ class MultiDiscordUser(models.Model):
         self,
         notify_user: bool = False,
         is_rate_limited: bool = True,
-        handle_api_exceptions: bool = False
+        handle_api_exceptions: bool = False,
+        is_interactive: bool = False
     ) -> bool:
         """Deletes the Discount user both on the server and locally
 
@@ -333,6 +451,7 @@ class MultiDiscordUser(models.Model):
         - is_rate_limited: When False will disable default rate limiting (use with care)
         - handle_api_exceptions: When True method will return False
         when an API exception occurs
+        - is_interactive: When True may use the rate limit reserved for interactive requests
 
         Returns True when successful, otherwise False or raises exceptions
         Return None if user does no longer exist
@@ -340,7 +459,10 @@ class MultiDiscordUser(models.Model):
         try:
             _user = self.user
             client = MultiDiscordUser.objects._bot_client(
-                is_rate_limited=is_rate_limited)
+                is_rate_limited=is_rate_limited,
+                is_interactive=is_interactive,
+                bot_name=self.guild.bot_name
+            )
             success = client.remove_guild_member(
                 guild_id=self.guild_id, user_id=self.uid
             )
@@ -381,6 +503,88 @@ class MultiDiscordUser(models.Model):
                 raise ex
 
 
+class BulkSyncJob(models.Model):
+    """Progress of a bulk sync run for all users of a guild.
+
+    Runs are checkpointed after every batch, so a job can be resumed from
+    its cursor after a worker restart.
+    """
+
+    class Status(models.TextChoices):
+        RUNNING = 'running', gettext_lazy('Running')
+        FINISHED = 'finished', gettext_lazy('Finished')
+
+    objects = BulkSyncJobManager()
+
+    guild = models.ForeignKey(
+        DiscordManagedServer,
+        on_delete=models.CASCADE,
+    )
+    name = models.CharField(
+        max_length=64,
+        help_text='Bulk task that started this job'
+    )
+    methods = models.CharField(
+        max_length=128,
+        help_text='Comma separated user methods run for every user'
+    )
+    status = models.CharField(
+        max_length=16,
+        choices=Status.choices,
+        default=Status.RUNNING,
+        db_index=True
+    )
+    total = models.PositiveIntegerField(
+        default=0,
+        help_text='Number of work items in this job'
+    )
+    done = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(
+        default=0,
+        help_text='Work items that found nothing to change'
+    )
+    failed = models.PositiveIntegerField(default=0)
+    cursor = models.PositiveIntegerField(
+        default=0,
+        help_text='PK of the last user checkpointed'
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(default=None, null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created',)
+
+    def __str__(self):
+        return f'{self.name} [{self.guild_id}] {self.processed}/{self.total}'
+
+    @property
+    def processed(self) -> int:
+        """Number of work items processed"""
+        return self.done + self.skipped + self.failed
+
+    @property
+    def progress(self) -> float:
+        """Percentage of work items processed"""
+        if not self.total:
+            return 100.0
+        return min(100.0, 100 * self.processed / self.total)
+
+    @property
+    def throughput(self) -> float:
+        """Work items processed per minute"""
+        end = self.finished if self.finished else self.updated
+        seconds = (end - self.created).total_seconds()
+        if seconds <= 0:
+            return 0.0
+        return 60 * self.processed / seconds
+
+    def work_items(self, user_pks: list) -> list:
+        """Work items of this job for the given users"""
+        methods = self.methods.split(',')
+        return [(method, user_pk) for user_pk in user_pks for method in methods]
+
+
 class FilterBase(models.Model):
 
     name = models.CharField(max_length=500)
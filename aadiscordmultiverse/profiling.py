@@ -0,0 +1,131 @@
+"""Breakdown of where the time of sync tasks goes
+
+Sampled task runs record the time spent in DB queries, HTTP requests to Discord,
+the Redis calls of rate limits, pacing, backoffs and metrics,
+blocking sleeps of the Discord client and on the CPU.
+The rest is time the worker thread was busy with something else,
+e.g. other Redis calls or waiting for the GIL.
+"""
+
+import json
+import logging
+import random
+from contextlib import contextmanager
+from time import perf_counter, thread_time
+
+from django.db import connection
+
+from .app_settings import DMV_TASK_PROFILING_SAMPLE_RATE
+from .discord_client.metrics import metrics
+from .discord_client.timing import current_profile
+
+logger = logging.getLogger(__name__)
+
+# categories timed by hooks, CPU and other time are derived
+CATEGORIES = ('db', 'redis', 'http', 'sleep')
+
+
+class TaskProfile:
+    """Time and number of calls per category of one task run"""
+
+    def __init__(self) -> None:
+        self.seconds = dict.fromkeys(CATEGORIES, 0.0)
+        self.calls = dict.fromkeys(CATEGORIES, 0)
+        # CPU time of the thread spent inside the timed calls
+        self.cpu_in_calls = 0.0
+        # category and seconds of nested calls of the calls being timed
+        self._timing = []
+
+    @contextmanager
+    def timing(self, category: str):
+        # calls made from within a timed call of the same category,
+        # e.g. a Redis call of the rate limiter inside the rate limit checks,
+        # are already accounted for
+        if self._timing and self._timing[-1][0] == category:
+            yield
+            return
+        # time of calls of other categories nested in this one,
+        # e.g. a sleep while waiting for a rate limit, is only counted for them
+        frame = [category, 0.0]
+        self._timing.append(frame)
+        started = perf_counter()
+        cpu_started = thread_time()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - started
+            self._timing.pop()
+            self.seconds[category] += elapsed - frame[1]
+            self.calls[category] += 1
+            if self._timing:
+                self._timing[-1][1] += elapsed
+            else:
+                self.cpu_in_calls += thread_time() - cpu_started
+
+    def time_query(self, execute, sql, params, many, context):
+        with self.timing('db'):
+            return execute(sql, params, many, context)
+
+    def breakdown(self, wall: float, cpu: float) -> dict:
+        """returns seconds by category incl. CPU and other time"""
+        result = {'wall': wall, **self.seconds, 'cpu': max(0.0, cpu - self.cpu_in_calls)}
+        result['other'] = max(0.0, wall - sum(self.seconds.values()) - result['cpu'])
+        return result
+
+
+@contextmanager
+def task_profile(task, **labels):
+    """Profile a sampled run of a task
+
+    The breakdown is logged as JSON and added to the metrics.
+
+    Params:
+    - task: the running celery task
+    - labels: included in the log, e.g. the guild_id
+    """
+    if (
+        not DMV_TASK_PROFILING_SAMPLE_RATE
+        or random.random() >= DMV_TASK_PROFILING_SAMPLE_RATE
+    ):
+        yield
+        return
+
+    profile = TaskProfile()
+    token = current_profile.set(profile)
+    started = perf_counter()
+    cpu_started = thread_time()
+    try:
+        with connection.execute_wrapper(profile.time_query):
+            yield profile
+    finally:
+        current_profile.reset(token)
+        _report_profile(
+            task.name.rsplit('.', 1)[-1],
+            profile,
+            profile.breakdown(perf_counter() - started, thread_time() - cpu_started),
+            labels
+        )
+
+
+def _report_profile(task_name: str, profile: TaskProfile, breakdown: dict, labels: dict) -> None:
+    logger.info(
+        'Task profile: %s',
+        json.dumps({
+            'task': task_name,
+            **labels,
+            'seconds': {category: round(value, 6) for category, value in breakdown.items()},
+            'calls': profile.calls,
+        })
+    )
+    if metrics.is_enabled:
+        batch = metrics.batch()
+        batch.inc('dmv_task_profiles_total', task=task_name)
+        for category, value in breakdown.items():
+            if category != 'wall':
+                batch.inc(
+                    'dmv_task_profile_seconds_total',
+                    float(value),
+                    task=task_name,
+                    category=category
+                )
+        batch.execute()
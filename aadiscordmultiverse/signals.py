@@ -1,24 +1,50 @@
+from functools import partial
+from time import time_ns
+
+from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models.signals import m2m_changed, pre_save
 from django.dispatch import receiver
 
 from allianceauth.services.hooks import get_extension_logger
 
-from .models import DiscordManagedServer
+from .app_settings import DMV_DELTA_ROLE_UPDATES
+from .models import DiscordManagedServer, MultiDiscordUser
 from .tasks import (
-    check_all_users_in_guild, update_all_guild_user_groups,
+    BULK_TASK_PRIORITY, SINGLE_TASK_PRIORITY, check_all_users_in_guild,
+    mark_delta_synced, update_all_guild_user_groups,
     update_all_guild_user_nicks, update_all_guild_users_with_groups,
+    update_groups_delta,
 )
 
 logger = get_extension_logger(__name__)
 
 
+def _run_on_commit(task, *args, priority: int = BULK_TASK_PRIORITY) -> None:
+    """Start a task once the current transaction is committed,
+    so the request saving the server does not wait for the fan-out
+    and the task sees the saved config.
+    """
+    transaction.on_commit(
+        lambda: task.apply_async(args=args, priority=priority)
+    )
+
+
 @receiver(m2m_changed, sender=DiscordManagedServer.included_groups.through)
 def new_groups(sender, instance, action, reverse, model, pk_set, **kwargs):
-    if action in ["post_add", "post_remove"]:
-        update_all_guild_users_with_groups(
-            instance.guild_id,
-            pk_set
-        )
+    if action in ["post_add", "post_remove"] and pk_set:
+        if reverse:
+            # servers were changed from the group side
+            for guild_id in sorted(pk_set):
+                _run_on_commit(
+                    update_all_guild_users_with_groups, guild_id, [instance.pk]
+                )
+        else:
+            _run_on_commit(
+                update_all_guild_users_with_groups,
+                instance.guild_id,
+                sorted(pk_set)
+            )
 
 
 @receiver(pre_save, sender=DiscordManagedServer)
@@ -27,28 +53,84 @@ def model_update(sender, instance, raw, using, update_fields, **kwargs):
         old = sender.objects.get(pk = instance.pk)
         # update when the "Managed Groups" option is changed on or off
         if not instance.include_all_managed_groups == old.include_all_managed_groups:
-            update_all_guild_user_groups(
-                instance.guild_id,
-            )
+            _run_on_commit(update_all_guild_user_groups, instance.guild_id)
 
         # update when the "Sync Names" option is changed to on
         if instance.sync_names and not old.sync_names:
-            update_all_guild_user_nicks(
-                instance.guild_id,
-            )
+            _run_on_commit(update_all_guild_user_nicks, instance.guild_id)
     except DiscordManagedServer.DoesNotExist:
         # new create
         pass
 
 
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """Apply group changes of users as single role changes on Discord"""
+    if not DMV_DELTA_ROLE_UPDATES:
+        return
+    if action in ["post_add", "post_remove"] and pk_set:
+        if reverse:
+            user_pks, group_pks = sorted(pk_set), [instance.pk]
+        else:
+            user_pks, group_pks = [instance.pk], sorted(pk_set)
+    elif action == "pre_clear":
+        if reverse:
+            user_pks = list(instance.user_set.values_list("pk", flat=True))
+            group_pks = [instance.pk]
+        else:
+            user_pks = [instance.pk]
+            group_pks = list(instance.groups.values_list("pk", flat=True))
+    else:
+        return
+
+    synced_group_pks = dict()
+    for discord_user in MultiDiscordUser.objects.filter(
+        user_id__in=user_pks
+    ).select_related("guild", "user__profile__state"):
+        guild = discord_user.guild
+        if guild.guild_id not in synced_group_pks:
+            synced_group_pks[guild.guild_id] = sorted(
+                set(
+                    guild.get_all_roles_to_sync().filter(
+                        pk__in=group_pks
+                    ).values_list("pk", flat=True)
+                )
+            )
+        if synced_group_pks[guild.guild_id]:
+            transaction.on_commit(
+                partial(
+                    _queue_groups_delta,
+                    guild.guild_id,
+                    discord_user.user_id,
+                    discord_user.user.profile.state.name,
+                    synced_group_pks[guild.guild_id]
+                )
+            )
+
+
+def _queue_groups_delta(guild_id: int, user_pk: int, state_name: str, group_pks: list) -> None:
+    """Queue the role changes of a committed group change of a user
+    and skip the full sync from the services hook for it
+    """
+    mark_delta_synced(guild_id, user_pk, state_name)
+    update_groups_delta.apply_async(
+        args=(guild_id, user_pk, group_pks),
+        # a delta still running must not swallow a newer change of the same groups
+        kwargs={'version': time_ns()},
+        priority=SINGLE_TASK_PRIORITY
+    )
+
+
 def perms_change(sender, instance, action, reverse, model, pk_set, **kwargs):
     """
         Perms have chagned CHECK EVERYONE!
     """
     if action in ["post_remove"]:
-        check_all_users_in_guild.delay(
-            instance.guild_id
-        )
+        if reverse:
+            for guild_id in sorted(pk_set or []):
+                _run_on_commit(check_all_users_in_guild, guild_id)
+        else:
+            _run_on_commit(check_all_users_in_guild, instance.guild_id)
 
 
 # all the m2m's
@@ -1,27 +1,154 @@
 import logging
+from collections import Counter, defaultdict
+from datetime import timedelta
+from functools import partial
 from logging import Logger
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Callable
 
-from celery import chain, shared_task
-from requests.exceptions import HTTPError
+from celery import shared_task
+from requests.exceptions import HTTPError, RequestException
 
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
 from django.db.models.query import QuerySet
+from django.utils.timezone import now
+from django.utils.translation import gettext_lazy
 
+from allianceauth.groupmanagement.models import ReservedGroupName
+from allianceauth.notifications import notify
 from allianceauth.services.tasks import QueueOnce
 
-from .app_settings import DISCORD_TASKS_MAX_RETRIES, DISCORD_TASKS_RETRY_PAUSE
+from .app_settings import (
+    DISCORD_TASKS_MAX_RETRIES, DISCORD_TASKS_RETRY_PAUSE, DMV_BULK_BATCH_SIZE,
+    DMV_BULK_DISPATCHER_LEASE, DMV_BULK_JOB_STALE_SECONDS,
+    DMV_SYNC_DEBOUNCE_SECONDS,
+)
+from .bulk import BulkWorkQueue
 from .discord_client.exceptions import DiscordApiBackoff
-from .models import DiscordManagedServer, MultiDiscordUser
+from .discord_client.metrics import metrics
+from .models import (
+    UNCHANGED, BulkSyncJob, DiscordManagedServer, MultiDiscordUser,
+)
+from .profiling import task_profile
 
 if TYPE_CHECKING:
     from discord import Bot
 
 logger: Logger = logging.getLogger(__name__)
 
+# Default priority for single tasks like update group and sync nickname
+SINGLE_TASK_PRIORITY = 3
+
 # task priority of bulk tasks
 BULK_TASK_PRIORITY = 6
 
+# task priority of activations, a user is waiting for them
+ACTIVATION_TASK_PRIORITY = 1
+
+# methods of MultiDiscordUser that can be run as bulk work
+BULK_METHODS = ('update_groups', 'update_nickname', 'update_username')
+
+# cache key held by the running bulk dispatcher
+BULK_DISPATCHER_LEASE_KEY = 'dmv:bulk:dispatcher'
+
+# seconds a user stays marked as synced by role deltas
+DELTA_MARK_TIMEOUT = 60
+
+
+def _debounce_key(task_name: str, guild_id: int, user_pk: int) -> str:
+    return f"dmv:debounce:{task_name}:{guild_id}:{user_pk}"
+
+
+def debounce_user_task(task, guild_id: int, user_pk: int, priority: int) -> bool:
+    """Schedule a user task for a guild, collapsing bursts into a single run
+
+    The first call within the debounce window schedules the task to run
+    at the end of the window, all further calls are dropped until the task starts.
+    The task is scheduled without any overrides, so it will use the
+    latest state from the DB when it runs.
+
+    Params:
+    - task: celery task taking `guild_id` and `user_pk`
+    or only `user_pk` if guild_id is None
+
+    Returns True when a new task was scheduled
+    """
+    key = _debounce_key(task.name, guild_id, user_pk)
+    if not cache.add(key, 1, timeout=DMV_SYNC_DEBOUNCE_SECONDS * 2):
+        logger.debug(
+            "%s already pending for user %s on guild %s", task.name, user_pk, guild_id
+        )
+        return False
+    kwargs = {'user_pk': user_pk}
+    if guild_id is not None:
+        kwargs['guild_id'] = guild_id
+    task.apply_async(
+        kwargs=kwargs,
+        countdown=DMV_SYNC_DEBOUNCE_SECONDS,
+        priority=priority
+    )
+    return True
+
+
+def _delta_mark_key(guild_id: int, user_pk: int) -> str:
+    return f"dmv:delta:{guild_id}:{user_pk}"
+
+
+def mark_delta_synced(guild_id: int, user_pk: int, state_name: str) -> None:
+    """Mark a group change of a user on a guild as handled by role deltas,
+    so the full group sync triggered by the same change can be skipped
+    """
+    cache.set(_delta_mark_key(guild_id, user_pk), state_name, timeout=DELTA_MARK_TIMEOUT)
+
+
+def clear_delta_mark(guild_id: int, user_pk: int) -> None:
+    """Let the next full group sync of a user on a guild run again"""
+    cache.delete(_delta_mark_key(guild_id, user_pk))
+
+
+def is_delta_synced(guild_id: int, user_pk: int, state_name: str) -> bool:
+    """Returns True when recent group changes of a user are handled by role deltas
+    and the state of the user has not changed since
+    """
+    return cache.get(_delta_mark_key(guild_id, user_pk)) == state_name
+
+
+def _result_name(success) -> str:
+    """returns the name of the result of a MultiDiscordUser method for metrics"""
+    if success is None:
+        return 'removed'
+    if success == UNCHANGED:
+        return 'unchanged'
+    return 'success' if success else 'failed'
+
+
+def _record_task_results(task, guild_id: int, results: dict) -> None:
+    """Count results of a user sync task by guild in the metrics
+
+    Params:
+    - results: number of results by (method, result)
+    """
+    if not metrics.is_enabled or not results:
+        return
+    task_name = task.name.rsplit('.', 1)[-1]
+    batch = metrics.batch()
+    for (method, result), count in results.items():
+        batch.inc(
+            'dmv_task_results_total',
+            count,
+            task=task_name,
+            guild_id=guild_id,
+            method=method,
+            result=result
+        )
+    batch.execute()
+
+
+def _clear_debounce(task, guild_id: int, user_pk: int) -> None:
+    """Allow new debounced runs to be scheduled once this one has started"""
+    if DMV_SYNC_DEBOUNCE_SECONDS:
+        cache.delete(_debounce_key(task.name, guild_id, user_pk))
+
 
 @shared_task(
     bind=True, base=QueueOnce, max_retries=None
@@ -33,6 +160,7 @@ def update_groups(self, guild_id: int, user_pk: int, state_name: str = None) ->
     - user_pk: PK of given user
     - state_name: optional state name to be used
     """
+    _clear_debounce(update_groups, guild_id, user_pk)
     _task_perform_user_action(
         self,
         guild_id,
@@ -42,6 +170,32 @@ def update_groups(self, guild_id: int, user_pk: int, state_name: str = None) ->
     )
 
 
+@shared_task(
+    bind=True, base=QueueOnce, max_retries=None
+)
+def update_groups_delta(
+    self, guild_id: int, user_pk: int, group_pks: list, version: int = 0
+) -> None:
+    """Add or remove the roles of changed groups on Discord for given user.
+    Falls back to a full group sync when the changes can not be applied.
+
+    Params:
+    - user_pk: PK of given user
+    - group_pks: PKs of the groups the user has joined or left
+    - version: version of the change, gives every change its own once lock
+    """
+    success = _task_perform_user_action(
+        self,
+        guild_id,
+        user_pk,
+        'update_groups_delta',
+        group_pks=group_pks
+    )
+    if success is False:
+        clear_delta_mark(guild_id, user_pk)
+        update_groups.apply_async(args=[guild_id, user_pk], priority=SINGLE_TASK_PRIORITY)
+
+
 @shared_task(
     bind=True, base=QueueOnce, max_retries=None
 )
@@ -52,6 +206,7 @@ def update_nickname(self, guild_id: int, user_pk: int, nickname: str = None) ->
     - user_pk: PK of given user
     - nickname: optional nickname to be used instead of user's main
     """
+    _clear_debounce(update_nickname, guild_id, user_pk)
     _task_perform_user_action(self, guild_id, user_pk,
                               'update_nickname', nickname=nickname)
 
@@ -81,128 +236,646 @@ def delete_user(self, guild_id: int, user_pk: int, notify_user: bool = False) ->
                               'delete_user', notify_user=notify_user)
 
 
-def _task_perform_user_action(self, guild_id: int, user_pk: int, method: str, **kwargs) -> None:
-    """perform a user related action incl. managing all exceptions"""
-    logger.info("Starting %s for user with pk %s on guild id %s", method, user_pk, guild_id)
-    user = User.objects.get(pk=user_pk)
-    if MultiDiscordUser.objects.user_has_account(user, guild_id):
-        discord_user = MultiDiscordUser.objects.get(
-            user=user, guild_id=guild_id)
-        logger.info("Running %s for user %s on guild %s", method, user, guild_id)
-        try:
-            success = getattr(discord_user, method)(**kwargs)
+@shared_task(
+    bind=True, base=QueueOnce, max_retries=None
+)
+def activate_user(self, guild_id: int, user_pk: int) -> None:
+    """Add a user to a guild with the access token kept by the OAuth callback.
+    Backoffs are retried as long as the token is kept.
 
+    Params:
+    - user_pk: PK of given user
+    """
+    user = User.objects.select_related(
+        "profile__state", "profile__main_character"
+    ).filter(pk=user_pk).first()
+    guild = DiscordManagedServer.objects.filter(guild_id=guild_id).first()
+    if not user or not guild:
+        logger.info('User %s or guild %s no longer exists, skipping activation', user_pk, guild_id)
+        MultiDiscordUser.objects.finish_activation(guild_id, user_pk)
+        return
+
+    access_token = MultiDiscordUser.objects.activation_token(guild_id, user_pk)
+    if not access_token:
+        logger.warning('Activation of user %s on guild %s has expired', user, guild_id)
+        success = False
+    else:
+        try:
+            success = MultiDiscordUser.objects.add_user_with_token(
+                user=user, access_token=access_token, guild=guild, is_interactive=True
+            )
         except DiscordApiBackoff as bo:
             logger.info(
-                "API back off for %s wth user %s on guild %s due to %r, retrying in %s seconds",
-                method,
+                "API back off for activation of user %s on guild %s due to %r, "
+                "retrying in %s seconds",
                 user,
                 guild_id,
                 bo,
                 bo.retry_after_seconds
             )
+            _record_task_results(self, guild_id, {('add_user', 'retried'): 1})
             raise self.retry(countdown=bo.retry_after_seconds)
 
+        except RequestException:
+            logger.warning(
+                'Failed to activate user %s on guild %s', user, guild_id, exc_info=True
+            )
+            success = False
+
+        except Exception:
+            # the user must not be left waiting for an activation that died
+            logger.exception(
+                'Unexpected error while activating user %s on guild %s', user, guild_id
+            )
+            success = False
+
+    MultiDiscordUser.objects.finish_activation(guild_id, user_pk)
+    _record_task_results(self, guild_id, {('add_user', _result_name(success)): 1})
+    if success:
+        logger.info('Successfully activated Discord account for user %s', user)
+        notify(
+            user=user,
+            title=gettext_lazy('Discord Account Activated'),
+            message=gettext_lazy(
+                'Your Discord account has been successfully activated on %(server)s.'
+            ) % {'server': guild.server_name or guild_id},
+            level='success'
+        )
+    else:
+        notify(
+            user=user,
+            title=gettext_lazy('Discord Account Not Activated'),
+            message=gettext_lazy(
+                'An error occurred while trying to activate your Discord account '
+                'on %(server)s. Please try again.'
+            ) % {'server': guild.server_name or guild_id},
+            level='danger'
+        )
+
+
+def _task_perform_user_action(self, guild_id: int, user_pk: int, method: str, **kwargs):
+    """perform a user related action incl. managing all exceptions
+
+    Returns the result of the method, False when it failed for good
+    or None when the user has no account on the guild
+    """
+    with task_profile(self, guild_id=guild_id, method=method):
+        return _perform_user_action(self, guild_id, user_pk, method, **kwargs)
+
+
+def _perform_user_action(self, guild_id: int, user_pk: int, method: str, **kwargs):
+    logger.info("Starting %s for user with pk %s on guild id %s", method, user_pk, guild_id)
+    discord_user = MultiDiscordUser.objects.filter(
+        user_id=user_pk, guild_id=guild_id
+    ).select_related(
+        "user__profile__state", "user__profile__main_character", "guild"
+    ).first()
+    if discord_user:
+        logger.info("Running %s for user %s on guild %s", method, discord_user.user, guild_id)
+        try:
+            action = getattr(discord_user, method)
         except AttributeError:
             raise ValueError(f'{method} not a valid method for DiscordUser')
 
-        except (HTTPError, ConnectionError):
+        def retry(countdown: int):
+            raise self.retry(countdown=countdown)
+
+        return _run_user_action(self, discord_user, method, partial(action, **kwargs), retry)
+
+    else:
+        logger.debug(
+            'User %s does not have a guild %s discord account, skipping %s',
+            user_pk,
+            guild_id,
+            method
+        )
+        _record_task_results(self, guild_id, {(method, 'skipped'): 1})
+
+
+def _run_user_action(
+    self, discord_user: MultiDiscordUser, method: str, action: Callable, retry: Callable
+):
+    """Run an action for a Discord user incl. managing all exceptions
+
+    Params:
+    - method: name of the action for logs and metrics
+    - action: runs the action and returns the result of the MultiDiscordUser method
+    - retry: called with a countdown in seconds when the action is to be retried
+
+    Returns the result of the action or False when it failed for good
+    """
+    user = discord_user.user
+    guild_id = discord_user.guild_id
+    try:
+        success = action()
+
+    except DiscordApiBackoff as bo:
+        logger.info(
+            "API back off for %s wth user %s on guild %s due to %r, retrying in %s seconds",
+            method,
+            user,
+            guild_id,
+            bo,
+            bo.retry_after_seconds
+        )
+        _record_task_results(self, guild_id, {(method, 'retried'): 1})
+        return retry(bo.retry_after_seconds)
+
+    except RequestException:
+        if self.request.retries < DISCORD_TASKS_MAX_RETRIES:
             logger.warning(
                 '%s failed for user %s on guild %s, retrying in %d secs',
                 method,
                 user,
+                guild_id,
                 DISCORD_TASKS_RETRY_PAUSE,
                 exc_info=True
             )
-            if self.request.retries < DISCORD_TASKS_MAX_RETRIES:
-                raise self.retry(countdown=DISCORD_TASKS_RETRY_PAUSE)
-            else:
-                logger.error(
-                    '%s failed for user %s after max retries',
-                    method,
-                    user,
-                    guild_id,
-                    exc_info=True
-                )
-        except Exception:
+            _record_task_results(self, guild_id, {(method, 'retried'): 1})
+            return retry(DISCORD_TASKS_RETRY_PAUSE)
+        else:
             logger.error(
-                '%s for user %s on guild %s failed due to unexpected exception',
+                '%s failed for user %s on guild %s after max retries',
                 method,
                 user,
                 guild_id,
                 exc_info=True
             )
+            _record_task_results(self, guild_id, {(method, 'failed'): 1})
+            return False
 
-        else:
-            if success is None and method != 'delete_user':
-                delete_user.delay(guild_id, user.pk, notify_user=True)
+    except Exception:
+        logger.error(
+            '%s for user %s on guild %s failed due to unexpected exception',
+            method,
+            user,
+            guild_id,
+            exc_info=True
+        )
+        _record_task_results(self, guild_id, {(method, 'failed'): 1})
+        return False
 
     else:
-        logger.debug(
-            'User %s does not have a guild %s discord account, skipping %s', user, guild_id, method
+        _record_task_results(self, guild_id, {(method, _result_name(success)): 1})
+        if success is None and method != 'delete_user':
+            delete_user.delay(guild_id, user.pk, notify_user=True)
+        return success
+
+
+@shared_task(
+    bind=True, base=QueueOnce, max_retries=None
+)
+def sync_user_all_guilds(self, user_pk: int, state_name: str = None) -> None:
+    """Update roles and nicknames on every Discord the given user has an account on
+
+    Loads the user's data once and issues the Discord calls guild by guild.
+    Guilds that hit an API backoff or error are handed over to the
+    single guild tasks, so they are retried without repeating the others.
+
+    Params:
+    - user_pk: PK of given user
+    - state_name: optional state name to be used
+    """
+    _clear_debounce(sync_user_all_guilds, None, user_pk)
+    user = User.objects.select_related(
+        "profile__state", "profile__main_character"
+    ).filter(pk=user_pk).first()
+    if not user:
+        logger.info('User with pk %s no longer exists, skipping sync', user_pk)
+        return
+    discord_users = list(
+        MultiDiscordUser.objects.filter(
+            user=user
+        ).select_related(
+            "guild"
+        ).prefetch_related(
+            "guild__included_groups"
+        )
+    )
+    if not discord_users:
+        logger.debug('User %s does not have any discord accounts', user)
+        return
+
+    if not state_name:
+        state_name = user.profile.state.name
+    user_groups = list(user.groups.all())
+    reserved_role_names = list(
+        ReservedGroupName.objects.values_list("name", flat=True)
+    )
+    if any(du.guild.include_all_managed_groups for du in discord_users):
+        managed_group_ids = set(
+            Group.objects.filter(
+                authgroup__internal=True
+            ).values_list("id", flat=True)
+        )
+    else:
+        managed_group_ids = set()
+
+    for discord_user in discord_users:
+        discord_user.user = user
+        guild = discord_user.guild
+        synced_group_ids = {group.id for group in guild.included_groups.all()}
+        if guild.include_all_managed_groups:
+            synced_group_ids |= managed_group_ids
+        group_names = [
+            group.name for group in user_groups if group.id in synced_group_ids
+        ] + [state_name]
+        _run_user_action(
+            self,
+            discord_user,
+            'sync_user',
+            partial(
+                _sync_user_on_guild,
+                discord_user,
+                state_name=state_name,
+                group_names=group_names,
+                reserved_role_names=reserved_role_names
+            ),
+            partial(_hand_over_user_sync, guild, user_pk, state_name)
         )
 
 
-@shared_task()
-def update_all_groups(guild_id) -> None:
-    """Update roles for all known users with a Discord account."""
-    discord_users_qs = MultiDiscordUser.objects.filter(
+def _sync_user_on_guild(
+    discord_user: MultiDiscordUser,
+    state_name: str,
+    group_names: list,
+    reserved_role_names: list
+):
+    """Update roles and the nickname of a user on one guild"""
+    success = discord_user.update_groups(
+        state_name=state_name,
+        group_names=group_names,
+        reserved_role_names=reserved_role_names
+    )
+    if success is not None and discord_user.guild.sync_names:
+        success = discord_user.update_nickname()
+    return success
+
+
+def _hand_over_user_sync(
+    guild: DiscordManagedServer, user_pk: int, state_name: str, countdown: int
+) -> None:
+    """Retry a failed guild of sync_user_all_guilds with the single guild tasks"""
+    update_groups.apply_async(
+        kwargs={'guild_id': guild.guild_id, 'user_pk': user_pk, 'state_name': state_name},
+        countdown=countdown,
+        priority=SINGLE_TASK_PRIORITY
+    )
+    if guild.sync_names:
+        update_nickname.apply_async(
+            kwargs={'guild_id': guild.guild_id, 'user_pk': user_pk},
+            countdown=countdown,
+            priority=SINGLE_TASK_PRIORITY
+        )
+
+
+def queue_bulk_work(guild_id: int, items: list, job_pk: int = 0) -> None:
+    """Queue work items for a guild and make sure the bulk dispatcher is running
+
+    Params:
+    - items: list of (method, user_pk) with method being a bulk method of MultiDiscordUser
+    - job_pk: BulkSyncJob to report the progress of the items to
+    """
+    if BulkWorkQueue().push(guild_id, items, job_pk=job_pk):
+        _start_bulk_dispatcher()
+
+
+def _start_bulk_dispatcher() -> None:
+    """Start the dispatcher unless it already holds the lease"""
+    if cache.add(BULK_DISPATCHER_LEASE_KEY, 1, timeout=DMV_BULK_DISPATCHER_LEASE):
+        dispatch_bulk_work.apply_async(priority=BULK_TASK_PRIORITY)
+
+
+def _start_bulk_job(guild_id: int, name: str, methods: list) -> None:
+    """Queue the methods for all Discord users of a guild as a tracked job
+
+    A job already running under the same name is not started twice,
+    unless it is stale in which case it is resumed instead.
+    """
+    job = BulkSyncJob.objects.running(guild_id, name)
+    if job:
+        if job.updated < now() - timedelta(seconds=DMV_BULK_JOB_STALE_SECONDS):
+            _resume_bulk_job(job)
+        else:
+            logger.info(
+                "Bulk job %s for guild %s is already running, not starting again",
+                name,
+                guild_id
+            )
+        return
+
+    user_pks = list(
+        MultiDiscordUser.objects.filter(
+            guild_id=guild_id
+        ).order_by("user_id").values_list("user_id", flat=True)
+    )
+    if not user_pks:
+        return
+    if 'update_nickname' in methods:
+        _snapshot_guild_nicks(guild_id)
+    job = BulkSyncJob.objects.create(
+        guild_id=guild_id,
+        name=name,
+        methods=",".join(methods),
+        total=len(user_pks) * len(methods)
+    )
+    logger.info(
+        "Starting bulk job %s for %d Discord users on guild %s",
+        name,
+        len(user_pks),
+        guild_id
+    )
+    queue_bulk_work(guild_id, job.work_items(user_pks), job_pk=job.pk)
+
+
+def _snapshot_guild_nicks(guild_id: int) -> None:
+    """Take a snapshot of the current member nicks of a guild, so nickname updates
+    can skip all members that already have the correct one.
+    The job runs without it if that fails.
+    """
+    bot_name = DiscordManagedServer.objects.filter(
         guild_id=guild_id
-    ).select_related("user", "guild")
-    _bulk_update_groups_for_users(discord_users_qs)
+    ).values_list("bot_name", flat=True).first() or ''
+    try:
+        MultiDiscordUser.objects._bot_client(bot_name=bot_name).snapshot_guild_nicks(guild_id)
+    except (DiscordApiBackoff, RequestException):
+        logger.warning(
+            "Failed to take snapshot of member nicks for guild %s", guild_id, exc_info=True
+        )
 
 
-@shared_task()
-def update_groups_bulk(user_pks: list) -> None:
-    """Update roles for list of users with a Discord account in bulk."""
-    discord_users_qs = MultiDiscordUser.objects\
-        .filter(user__pk__in=user_pks)\
-        .select_related("user", "guild")
-    _bulk_update_groups_for_users(discord_users_qs)
+def _resume_bulk_job(job: BulkSyncJob) -> None:
+    """Queue the work of a job again, starting with the user at its cursor
 
+    The user at the cursor is included, since only some of its methods
+    may have been run when the job was interrupted.
+    """
+    removed = BulkWorkQueue().remove_job(job.guild_id, job.pk)
+    user_pks = list(
+        MultiDiscordUser.objects.filter(
+            guild_id=job.guild_id, user_id__gte=job.cursor
+        ).order_by("user_id").values_list("user_id", flat=True)
+    )
+    items = job.work_items(user_pks)
+    logger.info(
+        "Resuming bulk job %s for guild %s at user %s with %d items, %d were still queued",
+        job.name,
+        job.guild_id,
+        job.cursor,
+        len(items),
+        removed
+    )
+    BulkSyncJob.objects.filter(pk=job.pk).update(
+        total=job.processed + len(items), updated=now()
+    )
+    if items:
+        queue_bulk_work(job.guild_id, items, job_pk=job.pk)
+    else:
+        if BulkSyncJob.objects.checkpoint(job.pk, 0, 0, job.cursor):
+            _finish_bulk_job(job.pk)
+
+
+@shared_task
+def resume_bulk_jobs() -> None:
+    """Resume bulk jobs that stopped making progress, e.g. after a worker restart
 
-def _bulk_update_groups_for_users(discord_users_qs: QuerySet) -> None:
+    Should be run periodically.
+    """
+    for job in BulkSyncJob.objects.stale(DMV_BULK_JOB_STALE_SECONDS):
+        _resume_bulk_job(job)
+    # the dispatcher may have been lost with its lease still active
+    if BulkWorkQueue().has_work():
+        _start_bulk_dispatcher()
+
+
+def _queue_bulk_for_users(discord_users_qs: QuerySet, method: str) -> None:
+    """Queue one bulk method for all given Discord users"""
+    items_by_guild = defaultdict(list)
+    # distinct, since joins like user__groups yield a row per matching group
+    for guild_id, user_pk in discord_users_qs.values_list(
+        "guild_id", "user_id"
+    ).order_by("guild_id", "user_id").distinct():
+        items_by_guild[guild_id].append((method, user_pk))
     logger.info(
-        "Starting to bulk update discord roles for %d users", discord_users_qs.count()
+        "Queueing bulk %s for %d users",
+        method,
+        sum(len(items) for items in items_by_guild.values())
     )
-    update_groups_chain = list()
-    for discord_user in discord_users_qs:
-        update_groups_chain.append(update_groups.si(discord_user.guild_id, discord_user.user.pk))
+    for guild_id, items in items_by_guild.items():
+        queue_bulk_work(guild_id, items)
 
-    chain(update_groups_chain).apply_async(priority=BULK_TASK_PRIORITY)
 
+@shared_task
+def dispatch_bulk_work() -> None:
+    """Hand out the next batch of queued bulk work
 
-@shared_task()
-def update_all_nicknames(guild_id) -> None:
-    """Update nicknames for all known users with a Discord account."""
-    discord_users_qs = MultiDiscordUser.objects.filter(
-        guild_id=guild_id
-    ).select_related(
-        "user",
-        "guild"
+    The batch is taken round robin from all guilds with pending work
+    and run as one task per guild. The dispatcher runs again once the
+    largest part of the batch is done or has failed, until all queues are empty.
+    """
+    queue = BulkWorkQueue()
+    batch = queue.pop_round_robin(DMV_BULK_BATCH_SIZE)
+    if not batch:
+        cache.delete(BULK_DISPATCHER_LEASE_KEY)
+        # work may have been queued while we were holding the lease
+        if queue.has_work():
+            _start_bulk_dispatcher()
+        else:
+            logger.info("Bulk work queues are empty")
+        return
+
+    cache.set(BULK_DISPATCHER_LEASE_KEY, 1, timeout=DMV_BULK_DISPATCHER_LEASE)
+    logger.info(
+        "Dispatching %d bulk items for %d guilds",
+        sum(len(items) for items in batch.values()),
+        len(batch)
     )
-    _bulk_update_nicknames_for_users(discord_users_qs)
+    largest_guild_id = max(batch, key=lambda guild_id: len(batch[guild_id]))
+    # also dispatch when that task fails, so one guild can not stall the others
+    next_dispatch = dispatch_bulk_work.si()
+    for guild_id, items in batch.items():
+        run_items = run_bulk_items.si(guild_id=guild_id, items=items)
+        if guild_id == largest_guild_id:
+            run_items.apply_async(
+                link=next_dispatch, link_error=next_dispatch, priority=BULK_TASK_PRIORITY
+            )
+        else:
+            run_items.apply_async(priority=BULK_TASK_PRIORITY)
 
 
-@shared_task()
-def update_nicknames_bulk(user_pks: list) -> None:
-    """Update nicknames for list of users with a Discord account in bulk."""
-    discord_users_qs = MultiDiscordUser.objects\
-        .filter(user__pk__in=user_pks)\
-        .select_related("user", "guild")
-    _bulk_update_nicknames_for_users(discord_users_qs)
+@shared_task(bind=True, max_retries=None)
+def run_bulk_items(self, guild_id: int, items: list) -> None:
+    """Run a batch of bulk work items for one guild
 
+    The progress of jobs is checkpointed once the batch is done
+    or before it is retried.
+
+    Params:
+    - items: list of (method, user_pk, job_pk)
+    """
+    with task_profile(self, guild_id=guild_id, items=len(items)):
+        _run_bulk_items(self, guild_id, items)
+
+
+def _run_bulk_items(self, guild_id: int, items: list) -> None:
+    discord_users = {
+        du.user_id: du for du in MultiDiscordUser.objects.filter(
+            guild_id=guild_id,
+            user_id__in={user_pk for _, user_pk, _ in items}
+        ).select_related(
+            "user__profile__state", "user__profile__main_character", "guild"
+        )
+    }
+    # nicknames are formatted together, so the name format configs are only looked up once
+    nickname_users = [
+        discord_users[user_pk].user for method, user_pk, _ in items
+        if method == 'update_nickname' and user_pk in discord_users
+    ]
+    nicknames = dict()
+    if nickname_users:
+        guild = next(iter(discord_users.values())).guild
+        if guild.sync_names:
+            nicknames = MultiDiscordUser.objects.user_formatted_nicks(nickname_users, guild)
+    # job_pk: [done, failed, cursor, skipped]
+    progress = defaultdict(lambda: [0, 0, 0, 0])
+    # (method, result): count
+    results = Counter()
+    for num, (method, user_pk, job_pk) in enumerate(items):
+        if method not in BULK_METHODS:
+            raise ValueError(f'{method} not a valid bulk method for DiscordUser')
+
+        job_progress = progress[job_pk]
+        discord_user = discord_users.get(user_pk)
+        if not discord_user:
+            logger.debug(
+                'User %s does not have a guild %s discord account, skipping %s',
+                user_pk,
+                guild_id,
+                method
+            )
+            job_progress[0] += 1
+            job_progress[2] = max(job_progress[2], user_pk)
+            results[(method, 'skipped')] += 1
+            continue
+
+        try:
+            if method == 'update_nickname':
+                # only a job has taken a snapshot of the nicks for its items
+                success = discord_user.update_nickname(
+                    nickname=nicknames.get(user_pk), use_snapshot=bool(job_pk)
+                )
+            else:
+                success = getattr(discord_user, method)()
+
+        except DiscordApiBackoff as bo:
+            logger.info(
+                "API back off for bulk %s on guild %s due to %r, retrying %d items in %s seconds",
+                method,
+                guild_id,
+                bo,
+                len(items) - num,
+                bo.retry_after_seconds
+            )
+            _checkpoint_bulk_jobs(progress)
+            results[(method, 'retried')] += 1
+            _record_task_results(self, guild_id, results)
+            raise self.retry(
+                kwargs={'guild_id': guild_id, 'items': items[num:]},
+                countdown=bo.retry_after_seconds
+            )
+
+        except RequestException:
+            logger.warning(
+                'Bulk %s failed for user %s on guild %s',
+                method,
+                discord_user.user,
+                guild_id,
+                exc_info=True
+            )
+            job_progress[1] += 1
+            results[(method, 'failed')] += 1
+
+        except Exception:
+            logger.error(
+                'Bulk %s for user %s on guild %s failed due to unexpected exception',
+                method,
+                discord_user.user,
+                guild_id,
+                exc_info=True
+            )
+            job_progress[1] += 1
+            results[(method, 'failed')] += 1
+
+        else:
+            results[(method, _result_name(success))] += 1
+            if success is None:
+                delete_user.delay(guild_id, user_pk, notify_user=True)
+            if success is False:
+                job_progress[1] += 1
+            elif success == UNCHANGED:
+                job_progress[3] += 1
+            else:
+                job_progress[0] += 1
+
+        job_progress[2] = max(job_progress[2], user_pk)
 
-def _bulk_update_nicknames_for_users(discord_users_qs: QuerySet) -> None:
     logger.info(
-        "Starting to bulk update discord nicknames for %d users",
-        discord_users_qs.count()
+        "Bulk batch for guild %s done: %d applied, %d unchanged, %d failed",
+        guild_id,
+        sum(job_progress[0] for job_progress in progress.values()),
+        sum(job_progress[3] for job_progress in progress.values()),
+        sum(job_progress[1] for job_progress in progress.values())
     )
-    update_nicknames_chain = list()
-    for discord_user in discord_users_qs:
-        update_nicknames_chain.append(update_nickname.si(discord_user.guild_id, discord_user.user.pk))
+    _checkpoint_bulk_jobs(progress)
+    _record_task_results(self, guild_id, results)
 
-    chain(update_nicknames_chain).apply_async(priority=BULK_TASK_PRIORITY)
+
+def _checkpoint_bulk_jobs(progress: dict) -> None:
+    """Record the progress of a batch for all jobs it belongs to"""
+    for job_pk, (done, failed, cursor, skipped) in progress.items():
+        if job_pk and BulkSyncJob.objects.checkpoint(
+            job_pk, done, failed, cursor, skipped=skipped
+        ):
+            _finish_bulk_job(job_pk)
+
+
+def _finish_bulk_job(job_pk: int) -> None:
+    """Clean up after a finished job, the snapshot of nicks is only valid for it"""
+    job = BulkSyncJob.objects.select_related("guild").get(pk=job_pk)
+    if 'update_nickname' in job.methods.split(','):
+        MultiDiscordUser.objects._bot_client(
+            bot_name=job.guild.bot_name
+        ).delete_guild_nicks_snapshot(job.guild_id)
+
+
+@shared_task()
+def update_all_groups(guild_id) -> None:
+    """Update roles for all known users with a Discord account."""
+    _start_bulk_job(guild_id, 'update_all_groups', ['update_groups'])
+
+
+@shared_task()
+def update_groups_bulk(user_pks: list, guild_id: int = None) -> None:
+    """Update roles for list of users with a Discord account in bulk."""
+    discord_users_qs = MultiDiscordUser.objects.filter(user__pk__in=user_pks)
+    if guild_id:
+        discord_users_qs = discord_users_qs.filter(guild_id=guild_id)
+    _queue_bulk_for_users(discord_users_qs, 'update_groups')
+
+
+@shared_task()
+def update_all_nicknames(guild_id) -> None:
+    """Update nicknames for all known users with a Discord account."""
+    _start_bulk_job(guild_id, 'update_all_nicknames', ['update_nickname'])
+
+
+@shared_task()
+def update_nicknames_bulk(user_pks: list, guild_id: int = None) -> None:
+    """Update nicknames for list of users with a Discord account in bulk."""
+    discord_users_qs = MultiDiscordUser.objects.filter(user__pk__in=user_pks)
+    if guild_id:
+        discord_users_qs = discord_users_qs.filter(guild_id=guild_id)
+    _queue_bulk_for_users(discord_users_qs, 'update_nickname')
 
 
 def _task_perform_users_action(self, method: str, **kwargs) -> Any:
@@ -250,7 +923,9 @@ def _task_perform_users_action(self, method: str, **kwargs) -> Any:
 )
 def update_servername(self, guild_id: int) -> None:
     """Updates the Discord server name"""
-    _task_perform_users_action(self, method="server_name", use_cache=False)
+    _task_perform_users_action(
+        self, method="server_name", gid=guild_id, use_cache=False
+    )
 
 
 @shared_task()
@@ -258,54 +933,30 @@ def update_all_usernames(guild_id) -> None:
     """Update all usernames for all known users with a Discord account.
     Also updates the server name
     """
-    update_servername.delay()
-    discord_users_qs = MultiDiscordUser.objects.filter(guild_id=guild_id)
-    _bulk_update_usernames_for_users(discord_users_qs)
+    update_servername.delay(guild_id)
+    _start_bulk_job(guild_id, 'update_all_usernames', ['update_username'])
 
 
 @shared_task()
-def update_usernames_bulk(user_pks: list) -> None:
+def update_usernames_bulk(user_pks: list, guild_id: int = None) -> None:
     """Update usernames for list of users with a Discord account in bulk."""
-    discord_users_qs = MultiDiscordUser.objects\
-        .filter(user__pk__in=user_pks)\
-        .select_related()
-    _bulk_update_usernames_for_users(discord_users_qs)
-
-
-def _bulk_update_usernames_for_users(discord_users_qs: QuerySet) -> None:
-    logger.info(
-        "Starting to bulk update discord usernames for %d users",
-        discord_users_qs.count()
-    )
-    update_usernames_chain = list()
-    for discord_user in discord_users_qs:
-        update_usernames_chain.append(update_username.si(discord_user.user.pk))
-
-    chain(update_usernames_chain).apply_async(priority=BULK_TASK_PRIORITY)
+    discord_users_qs = MultiDiscordUser.objects.filter(user__pk__in=user_pks)
+    if guild_id:
+        discord_users_qs = discord_users_qs.filter(guild_id=guild_id)
+    _queue_bulk_for_users(discord_users_qs, 'update_username')
 
 
 @shared_task()
 def update_all(guild_id) -> None:
     """Updates groups and nicknames (when activated) for all users."""
-    discord_users_qs = MultiDiscordUser.objects.filter(
-        guild_id=guild_id
-    ).select_related("user")
     guild = DiscordManagedServer.objects.get(guild_id=guild_id)
-    logger.info(
-        'Starting to bulk update all for %s Discord users', discord_users_qs.count()
+    check_all_users_in_guild.apply_async(
+        args=[guild.guild_id], priority=BULK_TASK_PRIORITY
     )
-    update_all_chain = list()
-    update_all_chain.append(check_all_users.si())
-    for discord_user in discord_users_qs:
-        update_all_chain.append(update_groups.si(
-            guild.guild_id, discord_user.user.pk))
-        update_all_chain.append(update_username.si(
-            guild.guild_id, discord_user.user.pk))
-        if guild.sync_names:
-            update_all_chain.append(update_nickname.si(
-                guild.guild_id, discord_user.user.pk))
-
-    chain(update_all_chain).apply_async(priority=BULK_TASK_PRIORITY)
+    methods = ['update_groups', 'update_username']
+    if guild.sync_names:
+        methods.append('update_nickname')
+    _start_bulk_job(guild.guild_id, 'update_all', methods)
 
 
 @shared_task
@@ -313,8 +964,22 @@ def check_all_users():
     """
         Check all discord users still have valid access
     """
-    for du in MultiDiscordUser.objects.all():
-        if not DiscordManagedServer.user_can_access_guild(du.user, du.guild):
+    # users are checked once for all their guilds
+    user_pk = None
+    visible_guild_ids = set()
+    for du in MultiDiscordUser.objects.select_related(
+        "user__profile__state",
+        "user__profile__main_character",
+        "guild"
+    ).order_by("user_id"):
+        if du.user_id != user_pk:
+            user_pk = du.user_id
+            visible_guild_ids = set(
+                DiscordManagedServer.objects.visible_to(
+                    du.user
+                ).values_list("guild_id", flat=True)
+            )
+        if du.guild_id not in visible_guild_ids:
             logger.warning(f"DMV: User Lost Permissions - {du.user} no longer has permissions for {du.guild}")
             try:
                 delete_user(
@@ -334,27 +999,15 @@ def update_all_guild_user_groups(guild_id: int):
     """
         Update any users that need group updates.
     """
-    for du in MultiDiscordUser.objects.filter(
-        guild_id=guild_id
-    ).select_related(
-        "user",
-        "guild"
-    ):
-        update_groups.delay(du.guild.guild_id, du.user.pk)
+    _start_bulk_job(guild_id, 'update_all_groups', ['update_groups'])
 
 
 @shared_task
 def update_all_guild_user_nicks(guild_id: int):
     """
-        Update any users that need group updates.
+        Update any users that need nickname updates.
     """
-    for du in MultiDiscordUser.objects.filter(
-        guild_id=guild_id
-    ).select_related(
-        "user",
-        "guild"
-    ):
-        update_nickname.delay(du.guild.guild_id, du.user.pk)
+    _start_bulk_job(guild_id, 'update_all_nicknames', ['update_nickname'])
 
 
 @shared_task
@@ -362,14 +1015,13 @@ def update_all_guild_users_with_groups(guild_id: int, group_pks: list):
     """
         Update any users that need group updates.
     """
-    for du in MultiDiscordUser.objects.filter(
-        user__groups__pk__in=group_pks,
-        guild_id=guild_id
-    ).select_related(
-        "user",
-        "guild"
-    ):
-        update_groups.delay(du.guild.guild_id, du.user.pk)
+    _queue_bulk_for_users(
+        MultiDiscordUser.objects.filter(
+            user__groups__pk__in=group_pks,
+            guild_id=guild_id
+        ),
+        'update_groups'
+    )
 
 
 @shared_task
@@ -380,7 +1032,8 @@ def check_all_users_in_guild(guild_id: int):
     for du in MultiDiscordUser.objects.filter(
         guild_id=guild_id
     ).select_related(
-        "user",
+        "user__profile__state",
+        "user__profile__main_character",
         "guild"
     ):
         if not DiscordManagedServer.user_can_access_guild(du.user, du.guild):
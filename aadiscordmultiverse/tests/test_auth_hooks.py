@@ -0,0 +1,155 @@
+from unittest.mock import patch
+
+from django_redis import get_redis_connection
+
+from django.test import TestCase
+
+from allianceauth import hooks
+
+from .. import auth_hooks
+from ..auth_hooks import (
+    MultiDiscordService, add_del_callback, refresh_guild_hooks,
+)
+from ..models import DiscordManagedServer
+
+MODULE_PATH = 'aadiscordmultiverse.auth_hooks'
+
+
+def guild_hooks() -> dict:
+    """registered hooks of guilds by guild_id"""
+    return {
+        hook.guild_id: hook
+        for hook in hooks._hooks.get('services_hook', [])
+        if isinstance(hook, type) and issubclass(hook, MultiDiscordService)
+    }
+
+
+class TestAddDelCallback(TestCase):
+
+    def setUp(self):
+        self._services_hooks = list(hooks._hooks.get('services_hook', []))
+        self._guild_hooks = dict(auth_hooks._guild_hooks)
+
+    def tearDown(self):
+        hooks._hooks['services_hook'] = self._services_hooks
+        auth_hooks._guild_hooks.clear()
+        auth_hooks._guild_hooks.update(self._guild_hooks)
+
+    def test_registers_hook_for_new_guild(self):
+        DiscordManagedServer.objects.create(guild_id=4001, server_name='new', bot_name='big')
+
+        hook = guild_hooks()[4001]
+        self.assertEqual(hook.__name__, 'MultiDiscordService4001')
+        self.assertEqual(hook.guild_name, 'new')
+        self.assertEqual(hook.bot_name, 'big')
+
+    def test_registers_every_hook_once(self):
+        DiscordManagedServer.objects.create(guild_id=4001, server_name='one')
+        DiscordManagedServer.objects.create(guild_id=4002, server_name='two')
+
+        add_del_callback()
+
+        registered = [
+            hook.guild_id for hook in hooks._hooks['services_hook']
+            if isinstance(hook, type) and issubclass(hook, MultiDiscordService)
+        ]
+        self.assertEqual(registered.count(4001), 1)
+        self.assertEqual(registered.count(4002), 1)
+
+    def test_removes_hook_of_deleted_guild(self):
+        guild = DiscordManagedServer.objects.create(guild_id=4001, server_name='gone')
+
+        guild.delete()
+
+        self.assertNotIn(4001, guild_hooks())
+        self.assertNotIn(4001, auth_hooks._guild_hooks)
+
+    def test_updates_hook_of_renamed_guild(self):
+        guild = DiscordManagedServer.objects.create(guild_id=4001, server_name='old')
+        hook = guild_hooks()[4001]
+
+        guild.server_name = 'renamed'
+        guild.save()
+
+        self.assertIs(guild_hooks()[4001], hook)
+        self.assertEqual(hook.guild_name, 'renamed')
+
+    def test_does_not_instantiate_hooks(self):
+        DiscordManagedServer.objects.create(guild_id=4001, server_name='one')
+
+        with patch(MODULE_PATH + '.MultiDiscordService.__init__') as mock_init:
+            add_del_callback()
+
+        mock_init.assert_not_called()
+
+
+@patch(MODULE_PATH + '._hooks_checked_at', None)
+@patch(MODULE_PATH + '._hooks_generation', None)
+@patch(MODULE_PATH + '.add_del_callback')
+class TestRefreshGuildHooks(TestCase):
+
+    def setUp(self):
+        self.redis = get_redis_connection("default")
+        self.redis.delete(auth_hooks._KEY_HOOKS_GENERATION)
+
+    def test_refreshes_on_first_check(self, mock_add_del_callback):
+        refresh_guild_hooks()
+
+        mock_add_del_callback.assert_called_once_with()
+
+    def test_refreshes_when_generation_changed(self, mock_add_del_callback):
+        with patch(MODULE_PATH + '.DMV_HOOKS_REFRESH_INTERVAL', 0):
+            refresh_guild_hooks()
+            refresh_guild_hooks()
+            self.assertEqual(mock_add_del_callback.call_count, 1)
+
+            auth_hooks.bump_hooks_generation()
+            refresh_guild_hooks()
+
+        self.assertEqual(mock_add_del_callback.call_count, 2)
+
+    def test_checks_redis_once_per_interval(self, mock_add_del_callback):
+        with patch(MODULE_PATH + '.DMV_HOOKS_REFRESH_INTERVAL', 60):
+            refresh_guild_hooks()
+            auth_hooks.bump_hooks_generation()
+            refresh_guild_hooks()
+
+        self.assertEqual(mock_add_del_callback.call_count, 1)
+
+    def test_guild_change_bumps_generation_on_commit(self, mock_add_del_callback):
+        with self.captureOnCommitCallbacks(execute=True):
+            DiscordManagedServer.objects.create(guild_id=4001, server_name='one')
+
+        self.assertEqual(int(self.redis.get(auth_hooks._KEY_HOOKS_GENERATION)), 1)
+        mock_add_del_callback.assert_called_once_with()
+
+    def test_refreshes_at_start_of_request(self, mock_add_del_callback):
+        self.client.get('/')
+
+        mock_add_del_callback.assert_called_once_with()
+
+
+class TestMultiDiscordService(TestCase):
+
+    @patch(MODULE_PATH + '.MultiDiscordUser.objects._bot_client')
+    def test_creates_client_on_first_use(self, mock_bot_client):
+        hook_class = type(
+            'MultiDiscordService4001', (MultiDiscordService,), {}, gid=4001, bot_name='big'
+        )
+
+        hook = hook_class()
+        mock_bot_client.assert_not_called()
+
+        self.assertIs(hook.client, hook.client)
+        mock_bot_client.assert_called_once_with(bot_name='big')
+
+    @patch(MODULE_PATH + '._service_ctrl_template', None)
+    @patch(MODULE_PATH + '.get_template')
+    def test_resolves_template_once(self, mock_get_template):
+        MultiDiscordService()
+        hook = MultiDiscordService()
+
+        self.assertEqual(
+            hook.service_ctrl_template, 'aadiscordmultiverse/dmv_service_ctrl_bs5.html'
+        )
+        self.assertEqual(mock_get_template.call_count, 1)
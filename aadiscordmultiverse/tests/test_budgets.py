@@ -0,0 +1,311 @@
+"""Budgets for the DB queries and Redis commands of the hot paths
+
+The fixture is scaled to a large install with 1k users, 50 groups and 20 guilds,
+so N+1 patterns exceed the budgets instead of going unnoticed.
+
+To print the measured numbers of every path, e.g. when changing a budget, run:
+
+DMV_BUDGET_REPORT=1 python runtests.py aadiscordmultiverse.tests.test_budgets
+"""
+
+import os
+import re
+from collections import deque
+from contextlib import contextmanager
+from unittest.mock import MagicMock, patch
+
+import requests_mock
+from django_redis import get_redis_connection
+from redis.client import Pipeline, Redis
+
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase
+
+from allianceauth.authentication.models import UserProfile
+from allianceauth.eveonline.models import EveCharacter, EveCorporationInfo
+from allianceauth.tests.auth_utils import AuthUtils
+
+from .. import tasks
+from ..auth_hooks import MultiDiscordService
+from ..discord_client import DiscordClient, DiscordRoles
+from ..models import DiscordManagedServer, MultiDiscordUser
+
+NUMBER_OF_USERS = 1000
+NUMBER_OF_GROUPS = 50
+NUMBER_OF_GUILDS = 20
+GROUPS_PER_GUILD = 10
+GROUPS_PER_USER = 5
+FIRST_GUILD_ID = 100000000000000000
+FIRST_DISCORD_USER_ID = 200000000000000000
+BULK_CHUNK_SIZE = 50
+
+REPORT_BUDGETS = bool(os.environ.get('DMV_BUDGET_REPORT'))
+
+
+class RedisCommandCounter:
+    """Counts the Redis round trips of all clients while active.
+    A pipeline counts as one round trip.
+    """
+
+    def __init__(self) -> None:
+        self.commands = list()
+
+    @property
+    def count(self) -> int:
+        return len(self.commands)
+
+    def __enter__(self):
+        counter = self
+        original_execute_command = Redis.execute_command
+        original_pipeline_execute = Pipeline.execute
+
+        def execute_command(client, *args, **options):
+            counter.commands.append(str(args[0]))
+            return original_execute_command(client, *args, **options)
+
+        def pipeline_execute(pipe, *args, **kwargs):
+            counter.commands.append('PIPELINE')
+            return original_pipeline_execute(pipe, *args, **kwargs)
+
+        self._patchers = [
+            patch.object(Redis, 'execute_command', execute_command),
+            patch.object(Pipeline, 'execute', pipeline_execute),
+        ]
+        for patcher in self._patchers:
+            patcher.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for patcher in self._patchers:
+            patcher.stop()
+
+
+class QueryCounter:
+    """Counts the DB queries while active.
+    Unlike CaptureQueriesContext it is not capped by the size of the query log.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.queries = deque(maxlen=100)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+
+class BudgetTestCase(TestCase):
+    """Test case that can assert budgets for DB queries and Redis commands"""
+
+    @contextmanager
+    def assertBudget(self, name: str, queries: int, redis_commands: int):
+        with QueryCounter() as db, RedisCommandCounter() as redis:
+            yield
+        if REPORT_BUDGETS:
+            print(
+                f'\n{name}: {db.count} / {queries} queries, '
+                f'{redis.count} / {redis_commands} redis commands'
+            )
+        self.assertLessEqual(
+            db.count,
+            queries,
+            msg='{} exceeds its query budget, last queries:\n{}'.format(
+                name, '\n'.join(db.queries)
+            )
+        )
+        self.assertLessEqual(
+            redis.count,
+            redis_commands,
+            msg=f'{name} exceeds its Redis budget: {redis.commands}'
+        )
+
+
+def clear_discord_cache():
+    redis = get_redis_connection("default")
+    for key in redis.scan_iter("DISCORD_*"):
+        redis.delete(key)
+    cache.delete_pattern("dmv:bucket:*")
+    DiscordClient._shared_clients.clear()
+
+
+def discord_role(num: int, name: str) -> dict:
+    return {'id': str(num), 'name': name, 'managed': False}
+
+
+@requests_mock.Mocker()
+class TestHotPathBudgets(BudgetTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.access_group = Group.objects.create(name='budget access')
+        AuthUtils.add_permissions_to_groups(
+            [AuthUtils.get_permission_by_name('aadiscordmultiverse.access_discord_multiverse')],
+            [cls.access_group]
+        )
+        cls.groups = Group.objects.bulk_create([
+            Group(name=f'budget group {num}') for num in range(NUMBER_OF_GROUPS)
+        ])
+        cls.corporation = EveCorporationInfo.objects.create(
+            corporation_id=2001,
+            corporation_name='Budget Corp',
+            corporation_ticker='BUDG',
+            member_count=NUMBER_OF_USERS
+        )
+        characters = EveCharacter.objects.bulk_create([
+            EveCharacter(
+                character_id=1000 + num,
+                character_name=f'Budget Character {num}',
+                corporation_id=cls.corporation.corporation_id,
+                corporation_name=cls.corporation.corporation_name,
+                corporation_ticker=cls.corporation.corporation_ticker
+            )
+            for num in range(NUMBER_OF_USERS)
+        ])
+        User.objects.bulk_create([
+            User(username=f'budget_user_{num}') for num in range(NUMBER_OF_USERS)
+        ])
+        cls.users = list(User.objects.filter(username__startswith='budget_user_'))
+        member_state = AuthUtils.get_member_state()
+        UserProfile.objects.bulk_create([
+            UserProfile(user=user, main_character=character, state=member_state)
+            for user, character in zip(cls.users, characters)
+        ])
+        memberships = list()
+        for num, user in enumerate(cls.users):
+            memberships.append(
+                User.groups.through(user_id=user.pk, group_id=cls.access_group.pk)
+            )
+            for offset in range(GROUPS_PER_USER):
+                group = cls.groups[(num + offset) % NUMBER_OF_GROUPS]
+                memberships.append(User.groups.through(user_id=user.pk, group_id=group.pk))
+        User.groups.through.objects.bulk_create(memberships)
+
+        cls.guilds = DiscordManagedServer.objects.bulk_create([
+            DiscordManagedServer(
+                guild_id=FIRST_GUILD_ID + num,
+                server_name=f'budget guild {num}',
+                sync_names=True,
+                include_all_managed_groups=False
+            )
+            for num in range(NUMBER_OF_GUILDS)
+        ])
+        for num, guild in enumerate(cls.guilds):
+            guild.group_access.add(cls.access_group)
+            guild.included_groups.add(*[
+                cls.groups[(num + offset) % NUMBER_OF_GROUPS]
+                for offset in range(GROUPS_PER_GUILD)
+            ])
+        MultiDiscordUser.objects.bulk_create([
+            MultiDiscordUser(guild=guild, user=user, uid=FIRST_DISCORD_USER_ID + num)
+            for guild in cls.guilds
+            for num, user in enumerate(cls.users)
+        ])
+        cls.guild = cls.guilds[0]
+        cls.roles = [
+            discord_role(num + 1, name) for num, name in enumerate(
+                [group.name for group in cls.groups] + [member_state.name]
+            )
+        ]
+
+    def setUp(self):
+        clear_discord_cache()
+
+    def _mock_discord_api(self, requests_mocker) -> None:
+        role_ids = [role['id'] for role in self.roles[:GROUPS_PER_USER]]
+        requests_mocker.get(
+            re.compile(r'.*/guilds/\d+/members/\d+$'),
+            json={'user': {'id': '1', 'username': 'budget'}, 'roles': role_ids}
+        )
+        requests_mocker.get(re.compile(r'.*/guilds/\d+/roles$'), json=self.roles)
+        requests_mocker.patch(re.compile(r'.*/guilds/\d+/members/\d+$'), status_code=204)
+        requests_mocker.get(
+            re.compile(r'.*/guilds/\d+$'), json={'id': '1', 'name': 'budget guild'}
+        )
+
+    def _fresh_user(self, num: int = 0) -> User:
+        """user object without any cached permissions or relations"""
+        return User.objects.get(pk=self.users[num].pk)
+
+    def test_visible_to(self, requests_mocker):
+        user = self._fresh_user()
+
+        with self.assertBudget('visible_to', queries=7, redis_commands=0):
+            self.assertEqual(
+                DiscordManagedServer.objects.visible_to(user).distinct().count(),
+                NUMBER_OF_GUILDS
+            )
+
+    def test_user_can_access_guild(self, requests_mocker):
+        user = self._fresh_user()
+
+        with self.assertBudget('user_can_access_guild', queries=7, redis_commands=0):
+            self.assertTrue(DiscordManagedServer.user_can_access_guild(user, self.guild))
+
+    def test_task_perform_user_action(self, requests_mocker):
+        self._mock_discord_api(requests_mocker)
+
+        with self.assertBudget('_task_perform_user_action', queries=3, redis_commands=24):
+            tasks._task_perform_user_action(
+                MagicMock(), self.guild.guild_id, self.users[0].pk, 'update_groups'
+            )
+
+    def test_update_roles_if_needed(self, requests_mocker):
+        self._mock_discord_api(requests_mocker)
+        discord_user = MultiDiscordUser.objects.select_related(
+            'user__profile__state', 'guild'
+        ).get(guild=self.guild, user=self.users[0])
+        client = MultiDiscordUser.objects._bot_client()
+
+        with self.assertBudget('_update_roles_if_needed', queries=2, redis_commands=16):
+            discord_user._update_roles_if_needed(
+                client, None, DiscordRoles(self.roles[:GROUPS_PER_USER])
+            )
+
+    def test_render_services_ctrl(self, requests_mocker):
+        self._mock_discord_api(requests_mocker)
+        service_class = type(
+            'MultiDiscordServiceBudget',
+            (MultiDiscordService,),
+            {},
+            gid=self.guild.guild_id,
+            guild_name=self.guild.server_name
+        )
+        service = service_class()
+        request = RequestFactory().get('/services/')
+        request.user = self._fresh_user()
+
+        with self.assertBudget('render_services_ctrl', queries=8, redis_commands=10):
+            self.assertIn('budget guild', service.render_services_ctrl(request))
+
+    def test_bulk_chunk(self, requests_mocker):
+        self._mock_discord_api(requests_mocker)
+        items = [
+            ('update_groups', user.pk, 0) for user in self.users[:BULK_CHUNK_SIZE]
+        ]
+
+        with self.assertBudget(
+            'run_bulk_items',
+            queries=1 + 2 * BULK_CHUNK_SIZE,
+            redis_commands=17 * BULK_CHUNK_SIZE
+        ):
+            tasks.run_bulk_items(guild_id=self.guild.guild_id, items=items)
+
+    @patch('aadiscordmultiverse.tasks.delete_user')
+    def test_check_all_users(self, requests_mocker, mock_delete_user):
+        with self.assertBudget(
+            'check_all_users', queries=1 + 4 * NUMBER_OF_USERS, redis_commands=0
+        ):
+            tasks.check_all_users()
+
+        mock_delete_user.assert_not_called()
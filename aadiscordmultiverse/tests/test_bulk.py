@@ -0,0 +1,410 @@
+from datetime import timedelta
+from unittest.mock import call, patch
+
+from celery.exceptions import Retry
+from django_redis import get_redis_connection
+from requests.exceptions import HTTPError, Timeout
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils.timezone import now
+
+from allianceauth.tests.auth_utils import AuthUtils
+
+from .. import tasks
+from ..bulk import BulkWorkQueue
+from ..discord_client import DiscordClient
+from ..discord_client.exceptions import DiscordApiBackoff
+from ..discord_client.metrics import metrics
+from ..models import (
+    UNCHANGED, BulkSyncJob, DiscordManagedServer, MultiDiscordUser,
+)
+
+MODULE_PATH = 'aadiscordmultiverse.tasks'
+
+
+def clear_bulk_queues():
+    redis = get_redis_connection("default")
+    for key in redis.scan_iter("dmv:bulk:*"):
+        redis.delete(key)
+    cache.delete(tasks.BULK_DISPATCHER_LEASE_KEY)
+
+
+class TestBulkWorkQueue(TestCase):
+
+    def setUp(self):
+        clear_bulk_queues()
+        self.queue = BulkWorkQueue()
+
+    def test_interleaves_guilds(self):
+        self.queue.push(1, [('update_groups', pk) for pk in range(100)])
+        self.queue.push(2, [('update_groups', 1000), ('update_groups', 1001)])
+        self.queue.push(3, [('update_nickname', 2000)])
+
+        batch = self.queue.pop_round_robin(9)
+
+        self.assertEqual(
+            batch,
+            {
+                1: [
+                    ('update_groups', 0, 0),
+                    ('update_groups', 1, 0),
+                    ('update_groups', 2, 0)
+                ],
+                2: [('update_groups', 1000, 0), ('update_groups', 1001, 0)],
+                3: [('update_nickname', 2000, 0)],
+            }
+        )
+        self.assertEqual(self.queue.pending(1), 97)
+        self.assertEqual(self.queue.pending(2), 0)
+
+    def test_rotates_guilds_between_batches(self):
+        for guild_id in (1, 2, 3):
+            self.queue.push(guild_id, [('update_groups', pk) for pk in range(5)])
+
+        self.assertEqual(list(self.queue.pop_round_robin(2)), [1, 2])
+        self.assertEqual(list(self.queue.pop_round_robin(2)), [3, 1])
+
+    def test_guild_is_only_in_rotation_once(self):
+        self.queue.push(1, [('update_groups', 1)])
+        self.queue.push(1, [('update_groups', 2)])
+
+        self.assertEqual(
+            self.queue.pop_round_robin(10),
+            {1: [('update_groups', 1, 0), ('update_groups', 2, 0)]}
+        )
+        self.assertFalse(self.queue.has_work())
+
+    def test_remove_job(self):
+        self.queue.push(1, [('update_groups', 1), ('update_groups', 2)], job_pk=7)
+        self.queue.push(1, [('update_groups', 3)], job_pk=17)
+
+        self.assertEqual(self.queue.remove_job(1, 7), 2)
+
+        self.assertEqual(self.queue.pop_round_robin(10), {1: [('update_groups', 3, 17)]})
+
+    def test_empty(self):
+        self.assertEqual(self.queue.pop_round_robin(10), {})
+        self.assertEqual(self.queue.push(1, []), 0)
+        self.assertFalse(self.queue.has_work())
+
+
+@patch(MODULE_PATH + '.DMV_BULK_BATCH_SIZE', 4)
+@patch(MODULE_PATH + '.dispatch_bulk_work.apply_async')
+@patch(MODULE_PATH + '.run_bulk_items.si')
+class TestDispatchBulkWork(TestCase):
+
+    def setUp(self):
+        clear_bulk_queues()
+
+    def test_starts_dispatcher_once(self, mock_si, mock_dispatch):
+        tasks.queue_bulk_work(1, [('update_groups', 1)])
+        tasks.queue_bulk_work(2, [('update_groups', 2)])
+
+        self.assertEqual(mock_dispatch.call_count, 1)
+
+    def test_dispatches_one_task_per_guild(self, mock_si, mock_dispatch):
+        tasks.queue_bulk_work(1, [('update_groups', pk) for pk in range(10)])
+        tasks.queue_bulk_work(2, [('update_groups', 100)])
+
+        tasks.dispatch_bulk_work()
+
+        mock_si.assert_any_call(
+            guild_id=1, items=[('update_groups', 0, 0), ('update_groups', 1, 0)]
+        )
+        mock_si.assert_any_call(guild_id=2, items=[('update_groups', 100, 0)])
+        next_dispatch = tasks.dispatch_bulk_work.si()
+        self.assertEqual(
+            mock_si.return_value.apply_async.call_args_list,
+            [
+                call(
+                    link=next_dispatch,
+                    link_error=next_dispatch,
+                    priority=tasks.BULK_TASK_PRIORITY
+                ),
+                call(priority=tasks.BULK_TASK_PRIORITY),
+            ]
+        )
+
+    def test_releases_lease_when_done(self, mock_si, mock_dispatch):
+        cache.set(tasks.BULK_DISPATCHER_LEASE_KEY, 1)
+
+        tasks.dispatch_bulk_work()
+
+        self.assertIsNone(cache.get(tasks.BULK_DISPATCHER_LEASE_KEY))
+        mock_si.assert_not_called()
+
+
+@patch(MODULE_PATH + '.MultiDiscordUser.update_groups', autospec=True)
+class TestRunBulkItems(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(guild_id=1, server_name='one')
+        cls.user_1 = AuthUtils.create_user('bulk_user_1')
+        cls.user_2 = AuthUtils.create_user('bulk_user_2')
+        for num, user in enumerate((cls.user_1, cls.user_2)):
+            MultiDiscordUser.objects.create(guild=cls.guild, user=user, uid=num)
+
+    def test_runs_all_items(self, mock_update_groups):
+        mock_update_groups.return_value = True
+
+        tasks.run_bulk_items(
+            guild_id=1,
+            items=[('update_groups', self.user_1.pk, 0), ('update_groups', self.user_2.pk, 0)]
+        )
+
+        self.assertEqual(mock_update_groups.call_count, 2)
+
+    @patch(MODULE_PATH + '.run_bulk_items.retry')
+    def test_retries_remaining_items_on_backoff(self, mock_retry, mock_update_groups):
+        mock_update_groups.side_effect = [True, DiscordApiBackoff(3000)]
+        mock_retry.side_effect = Retry
+        items = [('update_groups', self.user_1.pk, 0), ('update_groups', self.user_2.pk, 0)]
+
+        with self.assertRaises(Retry):
+            tasks.run_bulk_items(guild_id=1, items=items)
+
+        mock_retry.assert_called_once_with(
+            kwargs={'guild_id': 1, 'items': items[1:]}, countdown=3
+        )
+
+    def test_rejects_unknown_methods(self, mock_update_groups):
+        with self.assertRaises(ValueError):
+            tasks.run_bulk_items(guild_id=1, items=[('delete_user', self.user_1.pk, 0)])
+
+    @patch('aadiscordmultiverse.discord_client.metrics.DMV_METRICS_ENABLED', True)
+    def test_records_results_in_metrics(self, mock_update_groups):
+        metrics.reset()
+        mock_update_groups.side_effect = [UNCHANGED, HTTPError()]
+
+        tasks.run_bulk_items(
+            guild_id=1,
+            items=[
+                ('update_groups', self.user_1.pk, 0),
+                ('update_groups', self.user_2.pk, 0),
+                ('update_groups', 0, 0)
+            ]
+        )
+
+        labels = 'guild_id="1",method="update_groups"'
+        task = 'task="run_bulk_items"'
+        self.assertEqual(
+            metrics.samples(),
+            {
+                f'dmv_task_results_total{{{labels},result="unchanged",{task}}}': 1,
+                f'dmv_task_results_total{{{labels},result="failed",{task}}}': 1,
+                f'dmv_task_results_total{{{labels},result="skipped",{task}}}': 1,
+            }
+        )
+
+    def test_checkpoints_jobs(self, mock_update_groups):
+        mock_update_groups.side_effect = [True, HTTPError()]
+        job = BulkSyncJob.objects.create(
+            guild=self.guild, name='update_all_groups', methods='update_groups', total=2
+        )
+
+        tasks.run_bulk_items(
+            guild_id=1,
+            items=[
+                ('update_groups', self.user_1.pk, job.pk),
+                ('update_groups', self.user_2.pk, job.pk)
+            ]
+        )
+
+        job.refresh_from_db()
+        self.assertEqual(job.done, 1)
+        self.assertEqual(job.failed, 1)
+        self.assertEqual(job.cursor, self.user_2.pk)
+        self.assertEqual(job.status, BulkSyncJob.Status.FINISHED)
+        self.assertIsNotNone(job.finished)
+
+    def test_counts_timeout_as_failed_and_continues(self, mock_update_groups):
+        user_3 = AuthUtils.create_user('bulk_user_3')
+        MultiDiscordUser.objects.create(guild=self.guild, user=user_3, uid=2)
+        mock_update_groups.side_effect = [True, Timeout(), True]
+        job = BulkSyncJob.objects.create(
+            guild=self.guild, name='update_all_groups', methods='update_groups', total=3
+        )
+
+        tasks.run_bulk_items(
+            guild_id=1,
+            items=[
+                ('update_groups', self.user_1.pk, job.pk),
+                ('update_groups', self.user_2.pk, job.pk),
+                ('update_groups', user_3.pk, job.pk)
+            ]
+        )
+
+        self.assertEqual(mock_update_groups.call_count, 3)
+        job.refresh_from_db()
+        self.assertEqual(job.done, 2)
+        self.assertEqual(job.failed, 1)
+        self.assertEqual(job.cursor, user_3.pk)
+        self.assertEqual(job.status, BulkSyncJob.Status.FINISHED)
+
+    def test_counts_unchanged_as_skipped(self, mock_update_groups):
+        mock_update_groups.side_effect = [UNCHANGED, True]
+        job = BulkSyncJob.objects.create(
+            guild=self.guild, name='update_all_groups', methods='update_groups', total=2
+        )
+
+        tasks.run_bulk_items(
+            guild_id=1,
+            items=[
+                ('update_groups', self.user_1.pk, job.pk),
+                ('update_groups', self.user_2.pk, job.pk)
+            ]
+        )
+
+        job.refresh_from_db()
+        self.assertEqual(job.done, 1)
+        self.assertEqual(job.skipped, 1)
+        self.assertEqual(job.status, BulkSyncJob.Status.FINISHED)
+
+    @patch(MODULE_PATH + '.MultiDiscordUser.update_nickname', autospec=True)
+    @patch(
+        'aadiscordmultiverse.managers.MultiDiscordUserManager.user_formatted_nick',
+        return_value='Formatted Alone'
+    )
+    def test_formats_nicknames_together(
+        self, mock_formatted_nick, mock_update_nickname, mock_update_groups
+    ):
+        DiscordManagedServer.objects.filter(guild_id=1).update(sync_names=True)
+        mock_update_nickname.return_value = True
+
+        with patch(
+            'aadiscordmultiverse.managers.MultiDiscordUserManager.user_formatted_nicks',
+            return_value={self.user_1.pk: 'Nick 1', self.user_2.pk: 'Nick 2'}
+        ) as mock_formatted_nicks:
+            tasks.run_bulk_items(
+                guild_id=1,
+                items=[
+                    ('update_nickname', self.user_1.pk, 0),
+                    ('update_nickname', self.user_2.pk, 0)
+                ]
+            )
+
+        mock_formatted_nicks.assert_called_once()
+        mock_formatted_nick.assert_not_called()
+        self.assertEqual(
+            [call.kwargs['nickname'] for call in mock_update_nickname.call_args_list],
+            ['Nick 1', 'Nick 2']
+        )
+
+    @patch(MODULE_PATH + '.MultiDiscordUser.update_nickname', autospec=True)
+    def test_only_job_uses_and_deletes_nicks_snapshot(
+        self, mock_update_nickname, mock_update_groups
+    ):
+        mock_update_nickname.return_value = True
+        redis = get_redis_connection("default")
+        snapshot_key = DiscordClient._guild_nicks_cache_key(1)
+        redis.hset(snapshot_key, '0', 'Nick 1')
+        job = BulkSyncJob.objects.create(
+            guild=self.guild, name='update_all_nicknames', methods='update_nickname', total=1
+        )
+
+        tasks.run_bulk_items(
+            guild_id=1,
+            items=[
+                ('update_nickname', self.user_1.pk, 0),
+                ('update_nickname', self.user_1.pk, job.pk)
+            ]
+        )
+
+        self.assertEqual(
+            [call.kwargs['use_snapshot'] for call in mock_update_nickname.call_args_list],
+            [False, True]
+        )
+        self.assertFalse(redis.exists(snapshot_key))
+
+    @patch(MODULE_PATH + '.run_bulk_items.retry')
+    def test_checkpoints_jobs_before_retry(self, mock_retry, mock_update_groups):
+        mock_update_groups.side_effect = [True, DiscordApiBackoff(3000)]
+        mock_retry.side_effect = Retry
+        job = BulkSyncJob.objects.create(
+            guild=self.guild, name='update_all_groups', methods='update_groups', total=2
+        )
+
+        with self.assertRaises(Retry):
+            tasks.run_bulk_items(
+                guild_id=1,
+                items=[
+                    ('update_groups', self.user_1.pk, job.pk),
+                    ('update_groups', self.user_2.pk, job.pk)
+                ]
+            )
+
+        job.refresh_from_db()
+        self.assertEqual(job.done, 1)
+        self.assertEqual(job.cursor, self.user_1.pk)
+        self.assertEqual(job.status, BulkSyncJob.Status.RUNNING)
+
+
+@patch(MODULE_PATH + '._start_bulk_dispatcher')
+class TestBulkSyncJobs(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(guild_id=1, server_name='one')
+        cls.users = [AuthUtils.create_user(f'job_user_{num}') for num in range(3)]
+        for num, user in enumerate(cls.users):
+            MultiDiscordUser.objects.create(guild=cls.guild, user=user, uid=num)
+
+    def setUp(self):
+        clear_bulk_queues()
+        self.queue = BulkWorkQueue()
+
+    def test_creates_job(self, mock_start):
+        tasks.update_all_groups(1)
+
+        job = BulkSyncJob.objects.get()
+        self.assertEqual(job.name, 'update_all_groups')
+        self.assertEqual(job.total, 3)
+        self.assertEqual(self.queue.pending(1), 3)
+
+    def test_does_not_start_running_job_again(self, mock_start):
+        tasks.update_all_groups(1)
+        tasks.update_all_groups(1)
+
+        self.assertEqual(BulkSyncJob.objects.count(), 1)
+        self.assertEqual(self.queue.pending(1), 3)
+
+    @patch(
+        'aadiscordmultiverse.discord_client.DiscordClient.snapshot_guild_nicks',
+        side_effect=Timeout
+    )
+    def test_starts_job_without_nicks_snapshot(self, mock_snapshot, mock_start):
+        tasks.update_all_nicknames(1)
+
+        mock_snapshot.assert_called_once_with(1)
+        self.assertEqual(BulkSyncJob.objects.get().name, 'update_all_nicknames')
+        self.assertEqual(self.queue.pending(1), 3)
+
+    def test_resumes_stale_job_from_cursor(self, mock_start):
+        job = BulkSyncJob.objects.create(
+            guild=self.guild,
+            name='update_all',
+            methods='update_groups,update_username',
+            total=6,
+            done=3,
+            cursor=self.users[1].pk
+        )
+        BulkSyncJob.objects.filter(pk=job.pk).update(updated=now() - timedelta(days=1))
+        self.queue.push(1, job.work_items([self.users[2].pk]), job_pk=job.pk)
+
+        tasks.resume_bulk_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.total, 7)
+        self.assertEqual(
+            self.queue.pop_round_robin(10),
+            {
+                1: [
+                    ('update_groups', self.users[1].pk, job.pk),
+                    ('update_username', self.users[1].pk, job.pk),
+                    ('update_groups', self.users[2].pk, job.pk),
+                    ('update_username', self.users[2].pk, job.pk),
+                ]
+            }
+        )
@@ -0,0 +1,100 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from allianceauth.services.modules.discord.models import DiscordUser
+from allianceauth.tests.auth_utils import AuthUtils
+
+from ..models import DiscordManagedServer, MultiDiscordUser
+
+GUILD_ID = 123
+
+
+def migrated_users():
+    return set(
+        MultiDiscordUser.objects.filter(guild_id=GUILD_ID).values_list(
+            "user_id", "uid", "username", "discriminator", "activated"
+        )
+    )
+
+
+@override_settings(DISCORD_GUILD_ID=GUILD_ID)
+class TestDmvCoreToDmv(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(guild_id=GUILD_ID, server_name='core')
+        activated = now()
+        cls.users = [AuthUtils.create_user(f'core_user_{num}') for num in range(5)]
+        for num, user in enumerate(cls.users):
+            DiscordUser.objects.create(
+                user=user,
+                uid=1000 + num,
+                username=f'discord_{num}',
+                discriminator=f'{num:04d}',
+                activated=activated if num % 2 else None
+            )
+
+    def migrate(self, *args):
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command('dmv_core_to_dmv', '--migrateusers', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_batched_migration_matches_row_by_row(self):
+        self.migrate()
+        expected = migrated_users()
+        MultiDiscordUser.objects.all().delete()
+
+        self.migrate('--batch', '--batchsize', '2')
+
+        self.assertEqual(len(expected), 5)
+        self.assertEqual(migrated_users(), expected)
+        self.assertEqual(DiscordUser.objects.count(), 5)
+
+    def test_skips_migrated_users_on_rerun(self):
+        MultiDiscordUser.objects.create(guild=self.guild, user=self.users[0], uid=1000)
+
+        stdout, _ = self.migrate('--batch', '--batchsize', '2')
+        self.migrate('--batch', '--batchsize', '2')
+
+        self.assertIn('Created 4 users, Skipped creation of 1 existing users', stdout)
+        self.assertEqual(MultiDiscordUser.objects.filter(guild=self.guild).count(), 5)
+        self.assertEqual(
+            sorted(MultiDiscordUser.objects.values_list("uid", flat=True)),
+            [1000 + num for num in range(5)]
+        )
+
+    def test_deletes_only_migrated_users(self):
+        bulk_create = MultiDiscordUser.objects.bulk_create
+
+        def fail_second_batch(objs, *args, **kwargs):
+            if mock_bulk_create.call_count == 2:
+                raise DatabaseError
+            return bulk_create(objs, *args, **kwargs)
+
+        with patch.object(
+            MultiDiscordUser.objects, 'bulk_create', side_effect=fail_second_batch
+        ) as mock_bulk_create, self.assertRaises(DatabaseError):
+            self.migrate('--deleteusers', '--batch', '--batchsize', '2')
+
+        migrated_uids = set(MultiDiscordUser.objects.values_list("uid", flat=True))
+        legacy_uids = set(DiscordUser.objects.values_list("uid", flat=True))
+        self.assertEqual(migrated_uids, {1000, 1001})
+        self.assertEqual(legacy_uids, {1002, 1003, 1004})
+
+    def test_keeps_users_without_deleteusers(self):
+        self.migrate('--batch', '--batchsize', '2')
+
+        self.assertEqual(DiscordUser.objects.count(), 5)
+
+    def test_rejects_batchsize_below_one(self):
+        stdout, stderr = self.migrate('--deleteusers', '--batch', '--batchsize', '0')
+
+        self.assertIn('--batchsize  - needs to be at least 1', stderr)
+        self.assertFalse(MultiDiscordUser.objects.exists())
+        self.assertEqual(DiscordUser.objects.count(), 5)
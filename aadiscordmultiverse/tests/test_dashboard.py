@@ -0,0 +1,196 @@
+from unittest.mock import patch
+
+from django_redis import get_redis_connection
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from allianceauth.tests.auth_utils import AuthUtils
+
+from ..bulk import BulkWorkQueue
+from ..dashboard import (
+    RECENT_JOBS, dashboard_context, metrics_state, redis_state,
+)
+from ..discord_client import DiscordClient
+from ..discord_client.metrics import metrics
+from ..discord_client.rate_limiting import RateLimits
+from ..models import BulkSyncJob, DiscordManagedServer
+
+MODULE_PATH = 'aadiscordmultiverse.dashboard'
+
+
+def clear_redis_state():
+    redis = get_redis_connection("default")
+    for key in redis.scan_iter('DISCORD_*'):
+        redis.delete(key)
+    for key in redis.scan_iter('dmv:bulk:*'):
+        redis.delete(key)
+    cache.delete_pattern("dmv:bucket:*")
+    RateLimits.bucket_cache.clear()
+    metrics.reset()
+
+
+@patch(MODULE_PATH + '.DMV_BOTS', {'big': {'token': 'big-token'}})
+class TestRedisState(TestCase):
+
+    def setUp(self):
+        clear_redis_state()
+        self.redis = get_redis_connection("default")
+
+    def test_reads_buckets_backoffs_and_queues(self):
+        RateLimits.set_bucket('get-guilds-guild-id-roles', 3, timeout=5)
+        self.redis.set(f'{DiscordClient._KEY_GLOBAL_BACKOFF_UNTIL}:big', 'x', px=4000)
+        self.redis.set(DiscordClient._KEY_CIRCUIT_OPEN, 1, px=2000)
+        BulkWorkQueue(self.redis).push(1, [('update_groups', 1), ('update_groups', 2)])
+
+        state = redis_state([1, 2], self.redis)
+
+        self.assertEqual(len(state['buckets']), 1)
+        self.assertEqual(state['buckets'][0]['key'], 'get-guilds-guild-id-roles')
+        self.assertEqual(state['buckets'][0]['remaining'], 3)
+        self.assertGreater(state['buckets'][0]['resets_in'], 4)
+        self.assertEqual(state['backoffs'][0], {'bot': '', 'global_backoff': 0})
+        self.assertEqual(state['backoffs'][1]['bot'], 'big')
+        self.assertGreater(state['backoffs'][1]['global_backoff'], 3)
+        self.assertGreater(state['circuit_open'], 1)
+        self.assertEqual(state['pending'], {1: 2, 2: 0})
+
+    def test_scans_buckets_and_reads_keys_in_one_pipeline(self):
+        RateLimits.set_bucket('get-guilds-guild-id-roles', 3, timeout=5)
+        RateLimits.set_bucket('get-guilds-guild-id', 2, timeout=5)
+
+        with patch.object(
+            self.redis, 'execute_command', wraps=self.redis.execute_command
+        ) as mock_execute_command, patch.object(
+            self.redis, 'pipeline', wraps=self.redis.pipeline
+        ) as mock_pipeline:
+            state = redis_state(range(20), self.redis)
+
+        self.assertEqual(
+            {call.args[0] for call in mock_execute_command.call_args_list}, {'SCAN'}
+        )
+        mock_pipeline.assert_called_once_with(transaction=False)
+        self.assertEqual(
+            [bucket['key'] for bucket in state['buckets']],
+            ['get-guilds-guild-id', 'get-guilds-guild-id-roles']
+        )
+        self.assertEqual(state['pending'], {guild_id: 0 for guild_id in range(20)})
+
+
+@patch('aadiscordmultiverse.discord_client.metrics.DMV_METRICS_ENABLED', True)
+class TestMetricsState(TestCase):
+
+    def setUp(self):
+        clear_redis_state()
+
+    def test_sums_429s_and_results(self):
+        route = 'PATCH guilds/{guild_id}/members/{user_id}'
+        metrics.inc('dmv_discord_api_rate_limited_total', 2, route=route, scope='user')
+        metrics.inc('dmv_discord_api_rate_limited_total', route='GET guilds', scope='shared')
+        metrics.inc(
+            'dmv_task_results_total',
+            task='update_groups', guild_id=1, method='update_groups', result='success'
+        )
+        metrics.inc(
+            'dmv_task_results_total',
+            task='run_bulk_items', guild_id=1, method='update_groups', result='success'
+        )
+        metrics.inc(
+            'dmv_task_results_total',
+            task='update_groups', guild_id=1, method='update_groups', result='failed'
+        )
+
+        state = metrics_state()
+
+        self.assertEqual(
+            state['rate_limited'],
+            [
+                {'route': route, 'scope': 'user', 'count': 2},
+                {'route': 'GET guilds', 'scope': 'shared', 'count': 1},
+            ]
+        )
+        self.assertEqual(state['results'], {1: {'success': 2, 'failed': 1}})
+
+
+# the manifest of the static files of Auth is not built for tests
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class TestDashboardView(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(guild_id=1, server_name='Dashboard Guild')
+        BulkSyncJob.objects.create(
+            guild=cls.guild, name='update_all_groups', methods='update_groups', total=10, done=4
+        )
+
+    def setUp(self):
+        clear_redis_state()
+
+    def test_superuser_can_view(self):
+        user = AuthUtils.create_user('dashboard_admin')
+        user.is_superuser = True
+        user.save()
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('dmv:dashboard'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Dashboard Guild')
+        self.assertContains(response, 'update_all_groups: Running')
+        self.assertContains(response, '4/10 (40%)')
+
+    def test_loads_recent_jobs_of_each_guild(self):
+        for guild_id in (2, 3):
+            guild = DiscordManagedServer.objects.create(guild_id=guild_id)
+            for num in range(RECENT_JOBS + 1):
+                BulkSyncJob.objects.create(
+                    guild=guild,
+                    name=f'job_{num}',
+                    methods='update_groups',
+                    status=BulkSyncJob.Status.FINISHED
+                )
+
+        # guilds, running jobs and the finished jobs of each guild
+        with self.assertNumQueries(2 + 3):
+            context = dashboard_context()
+
+        jobs = {row['guild'].guild_id: row['jobs'] for row in context['guilds']}
+        self.assertEqual(len(jobs[1]), 1)
+        self.assertEqual(len(jobs[2]), RECENT_JOBS)
+        self.assertEqual(len(jobs[3]), RECENT_JOBS)
+        self.assertEqual(
+            [job.name for job in jobs[2]],
+            [f'job_{num}' for num in range(RECENT_JOBS, 0, -1)]
+        )
+
+    def test_shows_only_recent_finished_jobs(self):
+        user = AuthUtils.create_user('dashboard_admin')
+        user.is_superuser = True
+        user.save()
+        self.client.force_login(user)
+        for num in range(RECENT_JOBS + 2):
+            BulkSyncJob.objects.create(
+                guild=self.guild,
+                name=f'finished_job_{num}',
+                methods='update_groups',
+                status=BulkSyncJob.Status.FINISHED
+            )
+
+        response = self.client.get(reverse('dmv:dashboard'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'update_all_groups: Running')
+        self.assertContains(response, f'finished_job_{RECENT_JOBS + 1}')
+        self.assertNotContains(response, 'finished_job_0')
+        self.assertNotContains(response, 'finished_job_1')
+
+    def test_other_users_can_not_view(self):
+        self.client.force_login(AuthUtils.create_user('dashboard_user'))
+
+        response = self.client.get(reverse('dmv:dashboard'))
+
+        self.assertEqual(response.status_code, 302)
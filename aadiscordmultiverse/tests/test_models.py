@@ -0,0 +1,207 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from allianceauth.groupmanagement.models import ReservedGroupName
+from allianceauth.services.models import NameFormatConfig
+from allianceauth.tests.auth_utils import AuthUtils
+
+from ..models import UNCHANGED, DiscordManagedServer, MultiDiscordUser
+
+MANAGER_PATH = 'aadiscordmultiverse.managers.MultiDiscordUserManager'
+
+
+@patch(MANAGER_PATH + '._bot_client')
+class TestUpdateGroupsDelta(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(
+            guild_id=1, server_name='one', include_all_managed_groups=False
+        )
+        ReservedGroupName.objects.create(
+            name='reserved', reason='test', created_by='test'
+        )
+        cls.group_alpha = Group.objects.create(name='alpha')
+        cls.group_bravo = Group.objects.create(name='bravo')
+        cls.group_reserved = Group.objects.create(name='reserved')
+        cls.group_unsynced = Group.objects.create(name='unsynced')
+        cls.guild.included_groups.add(
+            cls.group_alpha, cls.group_bravo, cls.group_reserved
+        )
+        cls.user = AuthUtils.create_user('delta_user')
+        cls.user.groups.add(cls.group_alpha)
+        cls.discord_user = MultiDiscordUser.objects.create(
+            guild=cls.guild, user=cls.user, uid=99
+        )
+
+    def setUp(self):
+        self.roles = [
+            {'id': 10, 'name': 'alpha', 'managed': False},
+            {'id': 11, 'name': 'bravo', 'managed': False},
+            {'id': 12, 'name': 'reserved', 'managed': False},
+        ]
+
+    def test_adds_and_removes_single_roles(self, mock_bot_client):
+        client = mock_bot_client.return_value
+        client.guild_roles.return_value = self.roles
+        client.match_or_create_role_from_name.return_value = (self.roles[0], False)
+        client.add_guild_member_role.return_value = True
+        client.remove_guild_member_role.return_value = True
+
+        result = self.discord_user.update_groups_delta(
+            [self.group_alpha.pk, self.group_bravo.pk, self.group_reserved.pk,
+             self.group_unsynced.pk]
+        )
+
+        self.assertTrue(result)
+        client.add_guild_member_role.assert_called_once_with(
+            guild_id=1, user_id=99, role_id=10
+        )
+        client.remove_guild_member_role.assert_called_once_with(
+            guild_id=1, user_id=99, role_id=11
+        )
+        client.guild_member.assert_not_called()
+        client.modify_guild_member.assert_not_called()
+
+    def test_returns_none_when_not_a_member(self, mock_bot_client):
+        client = mock_bot_client.return_value
+        client.guild_roles.return_value = self.roles
+        client.remove_guild_member_role.return_value = None
+
+        self.assertIsNone(self.discord_user.update_groups_delta([self.group_bravo.pk]))
+
+
+@patch(MANAGER_PATH + '.user_formatted_nick', return_value='Bruce Wayne')
+@patch(MANAGER_PATH + '._bot_client')
+class TestUpdateNickname(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(
+            guild_id=1, server_name='one', sync_names=True
+        )
+        cls.user = AuthUtils.create_user('nick_user')
+        cls.discord_user = MultiDiscordUser.objects.create(
+            guild=cls.guild, user=cls.user, uid=99
+        )
+
+    def test_skips_unchanged_nick(self, mock_bot_client, mock_formatted_nick):
+        client = mock_bot_client.return_value
+        client.guild_member_has_nick.return_value = True
+
+        self.assertEqual(self.discord_user.update_nickname(), UNCHANGED)
+        client.modify_guild_member.assert_not_called()
+
+    def test_updates_changed_nick(self, mock_bot_client, mock_formatted_nick):
+        client = mock_bot_client.return_value
+        client.guild_member_has_nick.return_value = False
+        client.modify_guild_member.return_value = True
+
+        self.assertIs(self.discord_user.update_nickname(), True)
+        client.modify_guild_member.assert_called_once_with(
+            guild_id=1, user_id=99, nick='Bruce Wayne'
+        )
+
+
+class TestUserFormattedNicks(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(
+            guild_id=1, server_name='one', sync_names=True
+        )
+        config = NameFormatConfig.objects.create(
+            service_name='dmv:one', format='[{corp_ticker}] {character_name}'
+        )
+        member_state = AuthUtils.get_member_state()
+        config.states.add(member_state)
+        cls.member_1 = AuthUtils.create_user('nick_member_1')
+        AuthUtils.add_main_character(cls.member_1, 'Bruce Wayne', 1001, corp_ticker='WYE')
+        AuthUtils.assign_state(
+            User.objects.get(pk=cls.member_1.pk), member_state, disconnect_signals=True
+        )
+        cls.member_2 = AuthUtils.create_user('nick_member_2')
+        AuthUtils.add_main_character(cls.member_2, 'Clark Kent', 1002, corp_ticker='DP')
+        AuthUtils.assign_state(
+            User.objects.get(pk=cls.member_2.pk), member_state, disconnect_signals=True
+        )
+        cls.guest = AuthUtils.create_user('nick_guest')
+        AuthUtils.add_main_character(cls.guest, 'Lex Luthor', 1003, corp_ticker='LEX')
+        cls.no_main = AuthUtils.create_user('nick_no_main')
+
+    def test_formats_nicks_of_many_users(self):
+        users = list(
+            User.objects.filter(
+                pk__in=[self.member_1.pk, self.member_2.pk, self.guest.pk, self.no_main.pk]
+            ).select_related('profile__main_character')
+        )
+
+        # one query for the config of each state
+        with self.assertNumQueries(2):
+            nicks = MultiDiscordUser.objects.user_formatted_nicks(users, self.guild)
+
+        self.assertEqual(
+            nicks,
+            {
+                self.member_1.pk: '[WYE] Bruce Wayne',
+                self.member_2.pk: '[DP] Clark Kent',
+                self.guest.pk: 'Lex Luthor',
+                self.no_main.pk: None,
+            }
+        )
+
+    def test_formats_nick_of_one_user(self):
+        self.assertEqual(
+            MultiDiscordUser.objects.user_formatted_nick(
+                User.objects.get(pk=self.member_1.pk), self.guild
+            ),
+            '[WYE] Bruce Wayne'
+        )
+
+    def test_reuses_service_of_guild(self):
+        formatter_1 = MultiDiscordUser.objects.nickname_formatter(self.guild)
+        formatter_2 = MultiDiscordUser.objects.nickname_formatter(self.guild)
+
+        self.assertIs(formatter_1.service, formatter_2.service)
+        self.assertEqual(formatter_1.service.name, 'dmv:one')
+
+
+@patch('aadiscordmultiverse.models.DMV_BOTS', {'big': {'token': 'big-token'}})
+class TestDiscordManagedServerBot(TestCase):
+
+    def test_accepts_configured_bot(self):
+        guild = DiscordManagedServer(guild_id=1, server_name='one', bot_name='big')
+        guild.full_clean()
+
+    def test_rejects_unknown_bot(self):
+        guild = DiscordManagedServer(guild_id=1, server_name='one', bot_name='unknown')
+        with self.assertRaises(ValidationError):
+            guild.full_clean()
+
+
+@patch('aadiscordmultiverse.managers.DMV_BOTS', {
+    'big': {'token': 'big-token', 'app_id': '123', 'app_secret': 'secret'}
+})
+class TestBotClient(TestCase):
+
+    def test_dedicated_bot(self):
+        client = MultiDiscordUser.objects._bot_client(bot_name='big')
+
+        self.assertEqual(client.access_token, 'big-token')
+        self.assertEqual(client.rate_limit_namespace, 'big')
+
+    @patch('aadiscordmultiverse.managers.DISCORD_BOT_TOKEN', 'default-token')
+    def test_default_bot(self):
+        for bot_name in ('', 'unknown'):
+            client = MultiDiscordUser.objects._bot_client(bot_name=bot_name)
+
+            self.assertEqual(client.access_token, 'default-token')
+            self.assertEqual(client.rate_limit_namespace, '')
+
+    def test_bot_add_url_uses_bot_application(self):
+        url = MultiDiscordUser.objects.generate_bot_add_url('big')
+
+        self.assertIn('client_id=123', url)
@@ -0,0 +1,136 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import requests.api
+import requests_mock
+from django_redis import get_redis_connection
+from redis import Redis
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from allianceauth.tests.auth_utils import AuthUtils
+
+from .. import tasks
+from ..discord_client import DiscordClient
+from ..discord_client.metrics import metrics
+from ..models import DiscordManagedServer, MultiDiscordUser
+from ..profiling import TaskProfile
+
+MODULE_PATH = 'aadiscordmultiverse.profiling'
+
+ORIGINAL_REDIS_EXECUTE_COMMAND = Redis.execute_command
+ORIGINAL_REQUESTS_REQUEST = requests.api.request
+
+
+def fake_update_groups(discord_user, **kwargs):
+    """does a bit of everything a real sync does"""
+    User.objects.count()
+    # the client waits for the rest of the global backoff
+    get_redis_connection("default").set(DiscordClient._KEY_GLOBAL_BACKOFF_UNTIL, 1, px=20)
+    DiscordClient('user-token').current_user()
+    return True
+
+
+@patch(MODULE_PATH + '.DMV_TASK_PROFILING_SAMPLE_RATE', 1.0)
+@patch('aadiscordmultiverse.tasks.MultiDiscordUser.update_groups', new=fake_update_groups)
+@requests_mock.Mocker()
+class TestTaskProfile(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(guild_id=1, server_name='one')
+        cls.user = AuthUtils.create_user('profiled_user')
+        MultiDiscordUser.objects.create(guild=cls.guild, user=cls.user, uid=1)
+
+    def setUp(self):
+        self.task = MagicMock()
+        self.task.name = 'aadiscordmultiverse.tasks.update_groups'
+
+    def _run_task(self) -> dict:
+        with self.assertLogs(MODULE_PATH, level='INFO') as logs:
+            tasks._task_perform_user_action(self.task, 1, self.user.pk, 'update_groups')
+        return json.loads(logs.records[0].getMessage().split(': ', 1)[1])
+
+    def test_logs_breakdown(self, requests_mocker):
+        requests_mocker.get(requests_mock.ANY, json={'id': '1', 'username': 'user'})
+
+        profile = self._run_task()
+
+        self.assertEqual(profile['task'], 'update_groups')
+        self.assertEqual(profile['guild_id'], 1)
+        self.assertEqual(profile['method'], 'update_groups')
+        self.assertEqual(profile['calls']['http'], 1)
+        self.assertEqual(profile['calls']['sleep'], 1)
+        self.assertGreaterEqual(profile['calls']['db'], 2)
+        self.assertGreaterEqual(profile['calls']['redis'], 1)
+        self.assertGreaterEqual(profile['seconds']['sleep'], 0.01)
+        self.assertGreaterEqual(
+            profile['seconds']['wall'],
+            sum(profile['seconds'][category] for category in ('db', 'redis', 'http', 'sleep'))
+        )
+
+    @patch('aadiscordmultiverse.discord_client.metrics.DMV_METRICS_ENABLED', True)
+    def test_adds_breakdown_to_metrics(self, requests_mocker):
+        requests_mocker.get(requests_mock.ANY, json={'id': '1', 'username': 'user'})
+        metrics.reset()
+
+        self._run_task()
+
+        samples = metrics.samples()
+        self.assertEqual(samples['dmv_task_profiles_total{task="update_groups"}'], 1)
+        self.assertGreaterEqual(
+            samples['dmv_task_profile_seconds_total{category="sleep",task="update_groups"}'],
+            0.01
+        )
+
+    def test_does_not_patch_libraries(self, requests_mocker):
+        requests_mocker.get(requests_mock.ANY, json={'id': '1', 'username': 'user'})
+
+        self._run_task()
+
+        self.assertIs(Redis.execute_command, ORIGINAL_REDIS_EXECUTE_COMMAND)
+        self.assertIs(requests.api.request, ORIGINAL_REQUESTS_REQUEST)
+
+    def test_not_sampled(self, requests_mocker):
+        requests_mocker.get(requests_mock.ANY, json={'id': '1', 'username': 'user'})
+
+        with patch(MODULE_PATH + '.DMV_TASK_PROFILING_SAMPLE_RATE', 0.0):
+            with self.assertNoLogs(MODULE_PATH, level='INFO'):
+                tasks._task_perform_user_action(self.task, 1, self.user.pk, 'update_groups')
+
+
+class TestTaskProfileBreakdown(TestCase):
+
+    def test_cpu_and_other_time(self):
+        profile = TaskProfile()
+        profile.seconds['http'] = 0.5
+        profile.cpu_in_calls = 0.1
+
+        breakdown = profile.breakdown(wall=1.0, cpu=0.3)
+
+        self.assertAlmostEqual(breakdown['cpu'], 0.2)
+        self.assertAlmostEqual(breakdown['other'], 0.3)
+
+    def test_nested_calls_are_counted_once(self):
+        profile = TaskProfile()
+
+        with profile.timing('redis'):
+            with profile.timing('redis'):
+                pass
+
+        self.assertEqual(profile.calls, {'db': 0, 'redis': 1, 'http': 0, 'sleep': 0})
+
+    @patch(MODULE_PATH + '.perf_counter')
+    def test_nested_calls_of_other_categories_are_counted_for_them(self, mock_perf_counter):
+        # redis starts, sleep starts, sleep ends, redis ends
+        mock_perf_counter.side_effect = [0.0, 1.0, 3.0, 4.0]
+        profile = TaskProfile()
+
+        with profile.timing('redis'):
+            with profile.timing('sleep'):
+                pass
+
+        self.assertEqual(profile.calls, {'db': 0, 'redis': 1, 'http': 0, 'sleep': 1})
+        self.assertEqual(profile.seconds['redis'], 2.0)
+        self.assertEqual(profile.seconds['sleep'], 2.0)
@@ -0,0 +1,136 @@
+from unittest.mock import ANY, patch
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase
+
+from allianceauth.tests.auth_utils import AuthUtils
+
+from .. import tasks
+from ..models import DiscordManagedServer, MultiDiscordUser
+
+MODULE_PATH = 'aadiscordmultiverse.signals'
+
+
+@patch(MODULE_PATH + '.update_all_guild_users_with_groups')
+class TestIncludedGroupsChanged(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(guild_id=1, server_name='one')
+        cls.group_alpha = Group.objects.create(name='alpha')
+        cls.group_bravo = Group.objects.create(name='bravo')
+
+    def test_starts_task_after_commit(self, mock_task):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.guild.included_groups.add(self.group_alpha, self.group_bravo)
+            mock_task.apply_async.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+        mock_task.apply_async.assert_called_once_with(
+            args=(1, sorted([self.group_alpha.pk, self.group_bravo.pk])),
+            priority=tasks.BULK_TASK_PRIORITY
+        )
+
+    def test_changed_from_group_side(self, mock_task):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group_alpha.dmv_included_groups.add(self.guild)
+
+        mock_task.apply_async.assert_called_once_with(
+            args=(1, [self.group_alpha.pk]),
+            priority=tasks.BULK_TASK_PRIORITY
+        )
+
+
+@patch('aadiscordmultiverse.tasks.queue_bulk_work')
+class TestUpdateAllGuildUsersWithGroups(TestCase):
+
+    def test_users_in_several_groups_are_queued_once(self, mock_queue):
+        guild = DiscordManagedServer.objects.create(guild_id=1, server_name='one')
+        groups = [Group.objects.create(name=name) for name in ('alpha', 'bravo')]
+        user = AuthUtils.create_user('signal_user')
+        user.groups.add(*groups)
+        MultiDiscordUser.objects.create(guild=guild, user=user, uid=1)
+
+        tasks.update_all_guild_users_with_groups(1, [group.pk for group in groups])
+
+        mock_queue.assert_called_once_with(1, [('update_groups', user.pk)])
+
+
+@patch(MODULE_PATH + '.DMV_DELTA_ROLE_UPDATES', True)
+@patch(MODULE_PATH + '.update_groups_delta')
+class TestUserGroupsChanged(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(
+            guild_id=1, server_name='one', include_all_managed_groups=False
+        )
+        cls.group_alpha = Group.objects.create(name='alpha')
+        cls.group_unsynced = Group.objects.create(name='unsynced')
+        cls.guild.included_groups.add(cls.group_alpha)
+        cls.user = AuthUtils.create_user('delta_signal_user')
+        MultiDiscordUser.objects.create(guild=cls.guild, user=cls.user, uid=1)
+
+    def setUp(self):
+        cache.delete(tasks._delta_mark_key(1, self.user.pk))
+
+    def test_queues_delta_for_synced_group(self, mock_task):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group_alpha, self.group_unsynced)
+
+        mock_task.apply_async.assert_called_once_with(
+            args=(1, self.user.pk, [self.group_alpha.pk]),
+            kwargs={'version': ANY},
+            priority=tasks.SINGLE_TASK_PRIORITY
+        )
+        self.assertTrue(
+            tasks.is_delta_synced(1, self.user.pk, self.user.profile.state.name)
+        )
+
+    def test_queues_delta_when_groups_are_cleared(self, mock_task):
+        self.user.groups.add(self.group_alpha)
+        mock_task.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.clear()
+
+        mock_task.apply_async.assert_called_once_with(
+            args=(1, self.user.pk, [self.group_alpha.pk]),
+            kwargs={'version': ANY},
+            priority=tasks.SINGLE_TASK_PRIORITY
+        )
+
+    def test_no_delta_for_unsynced_group(self, mock_task):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group_unsynced)
+
+        mock_task.apply_async.assert_not_called()
+        self.assertFalse(
+            tasks.is_delta_synced(1, self.user.pk, self.user.profile.state.name)
+        )
+
+    def test_marks_synced_only_after_commit(self, mock_task):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.groups.add(self.group_alpha)
+
+        self.assertFalse(
+            tasks.is_delta_synced(1, self.user.pk, self.user.profile.state.name)
+        )
+        for callback in callbacks:
+            callback()
+        self.assertTrue(
+            tasks.is_delta_synced(1, self.user.pk, self.user.profile.state.name)
+        )
+
+    def test_every_change_has_its_own_version(self, mock_task):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group_alpha)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.remove(self.group_alpha)
+
+        versions = {
+            call.kwargs['kwargs']['version'] for call in mock_task.apply_async.call_args_list
+        }
+        self.assertEqual(len(versions), 2)
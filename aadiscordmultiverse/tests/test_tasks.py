@@ -0,0 +1,228 @@
+from unittest.mock import MagicMock, patch
+
+from celery.exceptions import Retry
+from requests.exceptions import Timeout
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase
+
+from allianceauth.tests.auth_utils import AuthUtils
+
+from .. import tasks
+from ..discord_client.exceptions import DiscordApiBackoff
+from ..models import DiscordManagedServer, MultiDiscordUser
+
+MODULE_PATH = 'aadiscordmultiverse.tasks'
+
+
+@patch(MODULE_PATH + '.DMV_SYNC_DEBOUNCE_SECONDS', 5)
+class TestDebounceUserTask(TestCase):
+
+    def setUp(self):
+        self.task = MagicMock()
+        self.task.name = 'aadiscordmultiverse.tasks.test_task'
+        cache.delete(tasks._debounce_key(self.task.name, 1, 2))
+        cache.delete(tasks._debounce_key(self.task.name, 3, 2))
+
+    def test_collapses_burst_into_one_task(self):
+        self.assertTrue(tasks.debounce_user_task(self.task, 1, 2, priority=3))
+        self.assertFalse(tasks.debounce_user_task(self.task, 1, 2, priority=3))
+        self.assertFalse(tasks.debounce_user_task(self.task, 1, 2, priority=3))
+
+        self.task.apply_async.assert_called_once_with(
+            kwargs={'guild_id': 1, 'user_pk': 2}, countdown=5, priority=3
+        )
+
+    def test_keyed_by_guild(self):
+        self.assertTrue(tasks.debounce_user_task(self.task, 1, 2, priority=3))
+        self.assertTrue(tasks.debounce_user_task(self.task, 3, 2, priority=3))
+        self.assertEqual(self.task.apply_async.call_count, 2)
+
+    def test_can_schedule_again_once_started(self):
+        tasks.debounce_user_task(self.task, 1, 2, priority=3)
+        tasks._clear_debounce(self.task, 1, 2)
+        self.assertTrue(tasks.debounce_user_task(self.task, 1, 2, priority=3))
+        self.assertEqual(self.task.apply_async.call_count, 2)
+
+
+@patch(MODULE_PATH + '.DMV_SYNC_DEBOUNCE_SECONDS', 0)
+@patch(MODULE_PATH + '.MultiDiscordUser.update_nickname', autospec=True)
+@patch(MODULE_PATH + '.MultiDiscordUser.update_groups', autospec=True)
+class TestSyncUserAllGuilds(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AuthUtils.create_user('sync_user')
+        cls.group_alpha = Group.objects.create(name='alpha')
+        cls.group_bravo = Group.objects.create(name='bravo')
+        cls.user.groups.add(cls.group_alpha, cls.group_bravo)
+        cls.guild_1 = DiscordManagedServer.objects.create(
+            guild_id=1, server_name='one', include_all_managed_groups=False
+        )
+        cls.guild_1.included_groups.add(cls.group_alpha)
+        cls.guild_2 = DiscordManagedServer.objects.create(
+            guild_id=2, server_name='two', include_all_managed_groups=False,
+            sync_names=True
+        )
+        cls.guild_2.included_groups.add(cls.group_alpha, cls.group_bravo)
+        for guild in (cls.guild_1, cls.guild_2):
+            MultiDiscordUser.objects.create(guild=guild, user=cls.user, uid=99)
+
+    def test_updates_all_guilds_with_own_groups(self, mock_update_groups, mock_update_nickname):
+        mock_update_groups.return_value = True
+        mock_update_nickname.return_value = True
+
+        tasks.sync_user_all_guilds(self.user.pk, state_name='Member')
+
+        calls = {
+            args[0].guild_id: kwargs['group_names']
+            for args, kwargs in mock_update_groups.call_args_list
+        }
+        self.assertEqual(calls, {1: ['alpha', 'Member'], 2: ['alpha', 'bravo', 'Member']})
+        self.assertEqual(mock_update_nickname.call_count, 1)
+
+    @patch(MODULE_PATH + '.update_nickname')
+    @patch(MODULE_PATH + '.update_groups')
+    def test_hands_over_guild_on_backoff(
+        self, mock_task_groups, mock_task_nickname, mock_update_groups, mock_update_nickname
+    ):
+        def update_groups(discord_user, **kwargs):
+            if discord_user.guild_id == 1:
+                raise DiscordApiBackoff(2000)
+            return True
+
+        mock_update_groups.side_effect = update_groups
+        mock_update_nickname.return_value = True
+
+        tasks.sync_user_all_guilds(self.user.pk, state_name='Member')
+
+        mock_task_groups.apply_async.assert_called_once()
+        _, kwargs = mock_task_groups.apply_async.call_args
+        self.assertEqual(kwargs['kwargs']['guild_id'], 1)
+        self.assertEqual(kwargs['countdown'], 2)
+        self.assertEqual(mock_update_groups.call_count, 2)
+
+    @patch(MODULE_PATH + '.update_nickname')
+    @patch(MODULE_PATH + '.update_groups')
+    def test_hands_over_guild_on_timeout(
+        self, mock_task_groups, mock_task_nickname, mock_update_groups, mock_update_nickname
+    ):
+        mock_update_groups.return_value = True
+        mock_update_nickname.side_effect = Timeout()
+
+        tasks.sync_user_all_guilds(self.user.pk, state_name='Member')
+
+        _, kwargs = mock_task_groups.apply_async.call_args
+        self.assertEqual(kwargs['kwargs']['guild_id'], 2)
+        _, kwargs = mock_task_nickname.apply_async.call_args
+        self.assertEqual(kwargs['kwargs']['guild_id'], 2)
+
+    def test_skips_deleted_user(self, mock_update_groups, mock_update_nickname):
+        tasks.sync_user_all_guilds(self.user.pk + 1000, state_name='Member')
+
+        mock_update_groups.assert_not_called()
+
+
+@patch(MODULE_PATH + '.MultiDiscordUser.objects.add_user_with_token')
+class TestActivateUser(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(guild_id=1, server_name='one')
+        cls.user = AuthUtils.create_user('activation_user')
+
+    def setUp(self):
+        cache.set(MultiDiscordUser.objects._activation_key(1, self.user.pk), 'access-token')
+
+    def tearDown(self):
+        MultiDiscordUser.objects.finish_activation(1, self.user.pk)
+
+    def test_adds_user_with_kept_token(self, mock_add_user_with_token):
+        mock_add_user_with_token.return_value = True
+
+        tasks.activate_user(guild_id=1, user_pk=self.user.pk)
+
+        self.assertEqual(mock_add_user_with_token.call_args.kwargs['access_token'], 'access-token')
+        self.assertFalse(MultiDiscordUser.objects.activation_pending(self.user, 1))
+        self.assertEqual(
+            self.user.notification_set.get().title, 'Discord Account Activated'
+        )
+
+    @patch(MODULE_PATH + '.activate_user.retry')
+    def test_retries_on_backoff(self, mock_retry, mock_add_user_with_token):
+        mock_add_user_with_token.side_effect = DiscordApiBackoff(3000)
+        mock_retry.side_effect = Retry
+
+        with self.assertRaises(Retry):
+            tasks.activate_user(guild_id=1, user_pk=self.user.pk)
+
+        mock_retry.assert_called_once_with(countdown=3)
+        self.assertTrue(MultiDiscordUser.objects.activation_pending(self.user, 1))
+
+    def test_notifies_user_of_timeout(self, mock_add_user_with_token):
+        mock_add_user_with_token.side_effect = Timeout()
+
+        tasks.activate_user(guild_id=1, user_pk=self.user.pk)
+
+        self.assertFalse(MultiDiscordUser.objects.activation_pending(self.user, 1))
+        self.assertEqual(
+            self.user.notification_set.get().title, 'Discord Account Not Activated'
+        )
+
+    def test_notifies_user_of_unexpected_error(self, mock_add_user_with_token):
+        mock_add_user_with_token.side_effect = KeyError('id')
+
+        tasks.activate_user(guild_id=1, user_pk=self.user.pk)
+
+        self.assertFalse(MultiDiscordUser.objects.activation_pending(self.user, 1))
+        self.assertEqual(
+            self.user.notification_set.get().title, 'Discord Account Not Activated'
+        )
+
+    def test_notifies_user_of_expired_activation(self, mock_add_user_with_token):
+        MultiDiscordUser.objects.finish_activation(1, self.user.pk)
+
+        tasks.activate_user(guild_id=1, user_pk=self.user.pk)
+
+        mock_add_user_with_token.assert_not_called()
+        self.assertEqual(
+            self.user.notification_set.get().title, 'Discord Account Not Activated'
+        )
+
+
+@patch(MODULE_PATH + '.update_groups')
+@patch(MODULE_PATH + '.MultiDiscordUser.update_groups_delta')
+class TestUpdateGroupsDelta(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(guild_id=1, server_name='one')
+        cls.user = AuthUtils.create_user('delta_task_user')
+        MultiDiscordUser.objects.create(guild=cls.guild, user=cls.user, uid=1)
+
+    def setUp(self):
+        tasks.mark_delta_synced(1, self.user.pk, 'Guest')
+
+    def tearDown(self):
+        tasks.clear_delta_mark(1, self.user.pk)
+
+    def test_keeps_mark_on_success(self, mock_update_groups_delta, mock_update_groups):
+        mock_update_groups_delta.return_value = True
+
+        tasks.update_groups_delta(1, self.user.pk, [1], version=1)
+
+        self.assertTrue(tasks.is_delta_synced(1, self.user.pk, 'Guest'))
+        mock_update_groups.apply_async.assert_not_called()
+
+    def test_falls_back_to_full_sync_on_failure(
+        self, mock_update_groups_delta, mock_update_groups
+    ):
+        mock_update_groups_delta.side_effect = KeyError('id')
+
+        tasks.update_groups_delta(1, self.user.pk, [1], version=1)
+
+        self.assertFalse(tasks.is_delta_synced(1, self.user.pk, 'Guest'))
+        mock_update_groups.apply_async.assert_called_once_with(
+            args=[1, self.user.pk], priority=tasks.SINGLE_TASK_PRIORITY
+        )
@@ -0,0 +1,116 @@
+from unittest.mock import patch
+
+from requests.exceptions import HTTPError, Timeout
+
+from django.test import TestCase
+from django.urls import reverse
+
+from allianceauth.tests.auth_utils import AuthUtils
+
+from ..discord_client.metrics import metrics
+from ..models import DiscordManagedServer, MultiDiscordUser
+
+MODULE_PATH = 'aadiscordmultiverse.views'
+
+
+@patch('aadiscordmultiverse.discord_client.metrics.DMV_METRICS_ENABLED', True)
+@patch(MODULE_PATH + '.DMV_METRICS_TOKEN', 'secret')
+class TestPrometheusMetrics(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_can_be_scraped_with_token(self):
+        metrics.inc('dmv_task_results_total', guild_id=1, result='success')
+
+        response = self.client.get(
+            reverse('dmv:metrics'), HTTP_AUTHORIZATION='Bearer secret'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'dmv_task_results_total{guild_id="1",result="success"} 1',
+            response.content.decode()
+        )
+
+    def test_rejects_wrong_token(self):
+        response = self.client.get(
+            reverse('dmv:metrics'), HTTP_AUTHORIZATION='Bearer wrong'
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_superuser_can_view(self):
+        user = AuthUtils.create_user('metrics_admin')
+        user.is_superuser = True
+        user.save()
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('dmv:metrics'))
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_rejects_other_users(self):
+        self.client.force_login(AuthUtils.create_user('metrics_user'))
+
+        response = self.client.get(reverse('dmv:metrics'))
+
+        self.assertEqual(response.status_code, 403)
+
+
+@patch(MODULE_PATH + '.DMV_ASYNC_ACTIVATION', True)
+@patch(MODULE_PATH + '.tasks.activate_user.apply_async')
+@patch(MODULE_PATH + '.DiscordManagedServer.user_can_access_guild', return_value=True)
+@patch(MODULE_PATH + '.MultiDiscordUser.objects._exchange_auth_code_for_token')
+class TestAsyncActivation(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.guild = DiscordManagedServer.objects.create(guild_id=1, server_name='one')
+        cls.user = AuthUtils.create_user('activating_user')
+        AuthUtils.add_main_character(cls.user, 'Bruce Wayne', 1001)
+        AuthUtils.add_permission_to_user_by_name(
+            'aadiscordmultiverse.access_discord_multiverse', cls.user
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        MultiDiscordUser.objects.finish_activation(1, self.user.pk)
+
+    def test_exchanges_code_and_queues_activation(
+        self, mock_exchange, mock_can_access, mock_apply_async
+    ):
+        mock_exchange.return_value = 'access-token'
+
+        response = self.client.get(reverse('dmv:callback'), {'code': 'abc', 'state': '1'})
+
+        self.assertRedirects(response, reverse('services:services'), fetch_redirect_response=False)
+        mock_exchange.assert_called_once_with('abc', bot_name='')
+        self.assertEqual(MultiDiscordUser.objects.activation_token(1, self.user.pk), 'access-token')
+        mock_apply_async.assert_called_once_with(
+            kwargs={'guild_id': 1, 'user_pk': self.user.pk}, priority=1
+        )
+
+    def test_does_not_queue_when_exchange_fails(
+        self, mock_exchange, mock_can_access, mock_apply_async
+    ):
+        mock_exchange.side_effect = HTTPError()
+
+        response = self.client.get(reverse('dmv:callback'), {'code': 'abc', 'state': '1'})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(MultiDiscordUser.objects.activation_pending(self.user, 1))
+        mock_apply_async.assert_not_called()
+
+    def test_does_not_queue_when_exchange_times_out(
+        self, mock_exchange, mock_can_access, mock_apply_async
+    ):
+        mock_exchange.side_effect = Timeout()
+
+        response = self.client.get(reverse('dmv:callback'), {'code': 'abc', 'state': '1'})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(MultiDiscordUser.objects.activation_pending(self.user, 1))
+        mock_apply_async.assert_not_called()
@@ -13,4 +13,6 @@ urlpatterns = [
     re_path(r'reset/(?P<guild_id>(\d)*)/', views.reset_discord, name='reset'),
     path('callback/', views.discord_callback, name='callback'),
     path('add_bot/', views.discord_add_bot, name='add_bot'),
+    path('metrics/', views.prometheus_metrics, name='metrics'),
+    path('dashboard/', views.dashboard, name='dashboard'),
 ]
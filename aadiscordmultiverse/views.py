@@ -1,15 +1,26 @@
+import hmac
 import logging
 
+from oauthlib.oauth2.rfc6749.errors import OAuth2Error
+from requests.exceptions import RequestException
+
 from django.contrib import messages
 from django.contrib.auth.decorators import (
     login_required, permission_required, user_passes_test,
 )
-from django.shortcuts import redirect
+from django.http import HttpResponse, HttpResponseForbidden
+from django.shortcuts import redirect, render
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
 from django.utils.translation import gettext_lazy as _
 
 from allianceauth.services.views import superuser_test
 
+from . import tasks
+from .app_settings import DMV_ASYNC_ACTIVATION, DMV_METRICS_TOKEN
+from .dashboard import dashboard_context
 from .discord_client.exceptions import DiscordApiBackoff
+from .discord_client.metrics import metrics
 from .models import DiscordManagedServer, MultiDiscordUser
 
 logger = logging.getLogger(__name__)
@@ -25,7 +36,8 @@ def deactivate_discord(request, guild_id):
         discord_user = MultiDiscordUser.objects.get(
             guild_id=guild_id, user=request.user)
         if discord_user.delete_user(
-            handle_api_exceptions=True
+            handle_api_exceptions=True,
+            is_interactive=True
         ):
             logger.info(
                 "Successfully deactivated discord for user %s", request.user)
@@ -56,7 +68,8 @@ def reset_discord(request, guild_id):
         discord_user = MultiDiscordUser.objects.get(
             guild_id=guild_id, user=request.user)
         if discord_user.delete_user(
-            handle_api_exceptions=True
+            handle_api_exceptions=True,
+            is_interactive=True
         ):
             logger.info(
                 ("Successfully deleted discord user for user %s - "
@@ -95,7 +108,12 @@ def activate_discord(request, guild_id):
         return redirect("services:services")
 
     logger.debug("activate_discordmv called by user %s", request.user)
-    return redirect(MultiDiscordUser.objects.generate_oauth_redirect_url(guild_id))
+    guild = DiscordManagedServer.objects.get(guild_id=guild_id)
+    return redirect(
+        MultiDiscordUser.objects.generate_oauth_redirect_url(
+            guild_id, bot_name=guild.bot_name
+        )
+    )
 
 
 @login_required
@@ -131,11 +149,15 @@ def discord_callback(request):
                 )
             )
             return redirect("services:services")
+        if DMV_ASYNC_ACTIVATION:
+            _start_activation(request, guild, authorization_code)
+            return redirect("services:services")
         try:
             if MultiDiscordUser.objects.add_user(
                 user=request.user,
                 authorization_code=authorization_code,
-                guild=guild
+                guild=guild,
+                is_interactive=True
             ):
                 logger.info(
                     "Successfully activated Discord account for user %s", request.user
@@ -172,7 +194,76 @@ def discord_callback(request):
     return redirect("services:services")
 
 
+def _start_activation(request, guild, authorization_code: str) -> None:
+    """Exchange the code while the user waits and leave the rest to a task"""
+    try:
+        MultiDiscordUser.objects.start_activation(
+            user=request.user, authorization_code=authorization_code, guild=guild
+        )
+    except (RequestException, OAuth2Error):
+        logger.warning(
+            "Failed to start activation of Discord account for user %s",
+            request.user,
+            exc_info=True
+        )
+        messages.error(
+            request,
+            _(
+                'An error occurred while trying to activate your Discord account. '
+                'Please try again.'
+            )
+        )
+        return
+
+    tasks.activate_user.apply_async(
+        kwargs={'guild_id': guild.guild_id, 'user_pk': request.user.pk},
+        priority=tasks.ACTIVATION_TASK_PRIORITY
+    )
+    logger.info("Queued activation of Discord account for user %s", request.user)
+    messages.info(
+        request,
+        _(
+            'Your Discord account is being activated. '
+            'You will be notified once it is done.'
+        )
+    )
+
+
 @login_required
 @user_passes_test(superuser_test)
 def discord_add_bot(request):
-    return redirect(MultiDiscordUser.objects.generate_bot_add_url())
+    # dedicated bots are added with ?bot=<name>
+    return redirect(
+        MultiDiscordUser.objects.generate_bot_add_url(request.GET.get('bot', ''))
+    )
+
+
+def prometheus_metrics(request):
+    """Metrics in the Prometheus text format.
+    Can be scraped with DMV_METRICS_TOKEN as bearer token or viewed by superusers.
+    """
+    auth_header = request.headers.get('Authorization', '')
+    has_token = bool(DMV_METRICS_TOKEN) and hmac.compare_digest(
+        auth_header.encode(), f'Bearer {DMV_METRICS_TOKEN}'.encode()
+    )
+    if not has_token and not request.user.is_superuser:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        metrics.export(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+@login_required
+@user_passes_test(superuser_test)
+def dashboard(request):
+    """Rate limit state, sync backlog and 429s at a glance"""
+    try:
+        get_template('allianceauth/base-bs5.html')
+        base_template = 'allianceauth/base-bs5.html'
+    except TemplateDoesNotExist:
+        base_template = 'allianceauth/base.html'
+    return render(
+        request,
+        'aadiscordmultiverse/dashboard.html',
+        {'base_template': base_template, **dashboard_context()}
+    )
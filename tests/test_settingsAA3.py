@@ -8,9 +8,14 @@ from allianceauth.project_template.project_name.settings.base import *  # noqa
 CELERY_ALWAYS_EAGER = True  # Forces celery to run locally for testing
 
 INSTALLED_APPS += [
+    # the inbuilt Discord service, migrated from by dmv_core_to_dmv
+    'allianceauth.services.modules.discord',
     'aadiscordmultiverse'
 ]
 
+# the inbuilt Discord service needs a bot token to be loaded
+DISCORD_BOT_TOKEN = 'bot-token'
+
 ROOT_URLCONF = 'tests.urls'
 
 NOSE_ARGS = [
@@ -49,3 +54,15 @@ CACHES = {
         }
     }
 }
+
+# API calls are mocked in tests, so the global rate limit must not throttle the suite
+DMV_GLOBAL_RATE_LIMIT = 100000
+
+# retries are tested explicitly, keep other tests from sleeping between them
+DMV_API_RETRY_MAX = 0
+
+# the circuit breaker is tested explicitly, mocked Redis clients can not run its scripts
+DMV_CIRCUIT_BREAKER_THRESHOLD = 0
+
+# lets the metrics endpoint be scraped without a login
+APPS_WITH_PUBLIC_VIEWS = ["dmv"]